@@ -0,0 +1,325 @@
+"""性能基准：在合成的文件树上，用桩脚本代替 ffprobe / 编码器，测量扫描、探测、日志、任务派发几条热路径。
+
+每次运行的结果追加到 bench_results.jsonl，并与参数相同的上一次结果对比，变慢超过阈值的指标标为退化。
+无需 ffmpeg 与图形界面，Linux 下可直接运行：python -m batch_bench [--only scan,probe] [--repeat 3] [--check]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+from datetime import datetime
+
+from batch_core import (
+    DATA_DIR, SUPPORTED_EXTS, ensure_parent, iter_media_files, Prober, ProbeCache, ProbePool, LogWriter,
+    BatchSettings, BatchRunner,
+)
+
+RESULTS_FILE = os.path.join(DATA_DIR, "bench_results.jsonl")
+# 比上一次慢超过该百分比视为退化
+REGRESSION_PERCENT = 10.0
+BENCHES = ("scan", "probe", "log", "dispatch")
+
+# 桩 ffprobe：输出固定的媒体信息，只测本工具自身的开销
+STUB_FFPROBE = """#!/bin/sh
+printf '%s\\n' '{"format": {"duration": "60.0", "size": "1048576", "bit_rate": "800000"}, "streams": [{"codec_type": "video", "codec_name": "h264", "bit_rate": "700000"}, {"codec_type": "audio", "codec_name": "aac", "bit_rate": "128000"}]}'
+"""
+
+# 桩编码器：以最快速度输出 ffmpeg 风格的状态行，最后写出输出文件
+STUB_ENCODER = """import sys
+src, dst, lines = sys.argv[1], sys.argv[2], int(sys.argv[3])
+out = sys.stdout
+for n in range(lines):
+    t = 60.0 * n / lines
+    out.write(f"frame={n:6d} fps=250 q=28.0 size=  {n * 4}kB time=00:{int(t) // 60:02d}:{t % 60:05.2f} bitrate= 800.0kbits/s speed=10.0x\\n")
+out.flush()
+with open(src, "rb") as f, open(dst, "wb") as g:
+    g.write(f.read())
+"""
+
+
+class Workspace:
+    """基准用的临时目录：合成文件树与桩脚本，运行期间切换到该目录，结束后删除"""
+
+    def __init__(self, seed=0):
+        self.root = tempfile.mkdtemp(prefix="cmd_batch_bench_")
+        self.bin_dir = os.path.join(self.root, "bin")
+        self.random = random.Random(seed)
+        os.makedirs(self.bin_dir)
+        ffprobe = os.path.join(self.bin_dir, "ffprobe")
+        with open(ffprobe, "w") as f:
+            f.write(STUB_FFPROBE)
+        os.chmod(ffprobe, 0o755)
+        self.encoder = os.path.join(self.bin_dir, "stub_encoder.py")
+        with open(self.encoder, "w") as f:
+            f.write(STUB_ENCODER)
+        # 续跑日志照常写入 (计入调度开销)，但写在工作目录里，不挤掉用户真实批次的日志
+        self.journal_dir = os.path.join(self.root, "batch_journals")
+        self._cwd = os.getcwd()
+        self._path = os.environ.get("PATH", "")
+
+    def __enter__(self):
+        # 基准本身产生的文件 (输出、日志) 都在工作目录下，不污染当前目录
+        os.chdir(self.root)
+        os.environ["PATH"] = self.bin_dir + os.pathsep + self._path
+        return self
+
+    def __exit__(self, *exc):
+        os.chdir(self._cwd)
+        os.environ["PATH"] = self._path
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def make_tree(self, name, files, fanout=20, noise=0.3, size=256):
+        """生成约 files 个媒体文件的多层目录，另掺入 noise 比例的非媒体文件，返回根目录"""
+        top = os.path.join(self.root, name)
+        exts = sorted(set(SUPPORTED_EXTS))
+        dirs = [top]
+        os.makedirs(top)
+        payload = b"\0" * size
+        made = 0
+        while made < files:
+            folder = self.random.choice(dirs)
+            if len(dirs) < max(1, files // fanout) and self.random.random() < 0.1:
+                sub = os.path.join(folder, f"d{len(dirs)}")
+                os.makedirs(sub)
+                dirs.append(sub)
+                continue
+            if self.random.random() < noise:
+                path = os.path.join(folder, f"n{made}_{self.random.randrange(1 << 30)}.txt")
+            else:
+                path = os.path.join(folder, f"f{made}{self.random.choice(exts)}")
+                made += 1
+            with open(path, "wb") as f:
+                f.write(payload)
+        return top
+
+
+def timed(fn, repeat):
+    """执行 repeat 次，返回 (中位耗时秒数, 最后一次的返回值)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench_scan(ws, params, repeat):
+    top = ws.make_tree("scan", params["scan_files"])
+    seconds, found = timed(lambda: sum(1 for _ in iter_media_files([top], recursive=True)), repeat)
+    return {"scan_seconds": seconds, "scan_files_per_s": found / seconds}
+
+
+def probe_all(prober, files):
+    """用后台探测池探测全部文件，阻塞到所有回调完成"""
+    pool = ProbePool(prober.probe_entry)
+    remaining = [len(files)]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def callback(info):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    for path in files:
+        pool.submit(path, callback)
+    done.wait()
+    pool.close()
+
+
+def bench_probe(ws, params, repeat):
+    top = ws.make_tree("probe", params["probe_files"], noise=0)
+    files = [p for p, _ in iter_media_files([top], recursive=True)]
+    cold, _ = timed(lambda: probe_all(Prober(), files), repeat)
+    cache = ProbeCache(os.path.join(ws.root, "probe_cache.sqlite"))
+    probe_all(Prober(cache), files)
+    warm, _ = timed(lambda: probe_all(Prober(cache), files), repeat)
+    return {"probe_files_per_s": len(files) / cold, "probe_cached_files_per_s": len(files) / warm}
+
+
+def drain(log_queue, stop):
+    """模拟界面的日志刷新：反复取空队列"""
+    count = 0
+    while not (stop.is_set() and log_queue.empty()):
+        try:
+            log_queue.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        count += 1
+        while True:
+            try:
+                log_queue.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+    return count
+
+
+def bench_log(ws, params, repeat):
+    lines = params["log_lines"]
+    top = ws.make_tree("log", 1, noise=0)
+    src = next(p for p, _ in iter_media_files([top], recursive=True))
+    cmd = f'"{sys.executable}" "{ws.encoder}" {{input}} {{output}} {lines}'
+
+    def run_once():
+        log_queue = queue.Queue()
+        stop = threading.Event()
+        consumer = threading.Thread(target=drain, args=(log_queue, stop), daemon=True)
+        consumer.start()
+        settings = BatchSettings(cmd, overwrite="overwrite", slots=1)
+        runner = BatchRunner(settings, log=lambda message, level="命令", slot=None: log_queue.put((message, level, slot)),
+                             journal_dir=ws.journal_dir)
+        runner.run([src], durations=[60.0])
+        stop.set()
+        consumer.join()
+
+    seconds, _ = timed(run_once, repeat)
+
+    line = "frame=  100 fps=250 q=28.0 size=  400kB time=00:00:04.00 bitrate= 800.0kbits/s speed=10.0x\n"
+
+    def write_lines():
+        # 写入线程是异步的，以 close() 等到全部落盘为止计时
+        writer = LogWriter()
+        writer.open(os.path.join(ws.root, "bench.log"), truncate=True)
+        for _ in range(lines):
+            writer.write(line)
+        writer.close()
+
+    write_seconds, _ = timed(write_lines, repeat)
+    return {"log_lines_per_s": lines / seconds, "log_writer_lines_per_s": lines / write_seconds}
+
+
+def bench_dispatch(ws, params, repeat):
+    jobs = params["dispatch_jobs"]
+    top = ws.make_tree("dispatch", jobs, noise=0)
+    files = [p for p, _ in iter_media_files([top], recursive=True)]
+    cmd = "cp {input} {output}"
+
+    # 基线：直接逐个执行同样的命令
+    def baseline():
+        for path in files:
+            subprocess.run(f'cp "{path}" "{path}.base"', shell=True)
+
+    base_seconds, _ = timed(baseline, repeat)
+
+    def run_with(slots):
+        settings = BatchSettings(cmd, overwrite="overwrite", slots=slots)
+        BatchRunner(settings, journal_dir=ws.journal_dir).run(files, durations=[60.0] * len(files))
+
+    serial, _ = timed(lambda: run_with(1), repeat)
+    parallel, _ = timed(lambda: run_with(os.cpu_count() or 1), repeat)
+    return {
+        "dispatch_overhead_ms": (serial - base_seconds) / len(files) * 1000,
+        "dispatch_jobs_per_s": len(files) / serial,
+        "dispatch_parallel_jobs_per_s": len(files) / parallel,
+    }
+
+
+def lower_is_better(metric):
+    return metric.endswith("_seconds") or metric.endswith("_ms")
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_previous(path, params):
+    """结果文件中参数相同的最近一次记录"""
+    previous = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("params") == params:
+                    previous = record
+    except OSError:
+        pass
+    return previous
+
+
+def compare(metrics, previous, threshold):
+    """打印与上一次的对比，返回退化的指标名"""
+    regressions = []
+    old = (previous or {}).get("metrics", {})
+    if previous:
+        print(f"对比基准：{previous['time']} ({previous.get('commit') or '未知提交'})")
+    print(f"{'指标':<30}{'本次':>14}{'上次':>14}{'变化':>10}")
+    for name, value in metrics.items():
+        before = old.get(name)
+        if before:
+            change = (value - before) / before * 100
+            worse = change > threshold if lower_is_better(name) else change < -threshold
+            flag = "  退化" if worse else ""
+            if worse:
+                regressions.append(name)
+            print(f"{name:<30}{value:>14.2f}{before:>14.2f}{change:>9.1f}%{flag}")
+        else:
+            print(f"{name:<30}{value:>14.2f}{'-':>14}{'-':>10}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch_bench", description="批处理工具性能基准")
+    parser.add_argument("--only", default=",".join(BENCHES), help=f"要运行的基准，逗号分隔：{','.join(BENCHES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取中位数")
+    parser.add_argument("--scan-files", type=int, default=20000, help="扫描基准的媒体文件数")
+    parser.add_argument("--probe-files", type=int, default=300, help="探测基准的文件数")
+    parser.add_argument("--log-lines", type=int, default=100000, help="日志基准的输出行数")
+    parser.add_argument("--dispatch-jobs", type=int, default=100, help="派发基准的任务数")
+    parser.add_argument("--seed", type=int, default=0, help="生成文件树的随机种子")
+    parser.add_argument("--results", default=RESULTS_FILE, help="结果文件 (JSONL，逐次追加)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_PERCENT, help="判定退化的变慢百分比")
+    parser.add_argument("--check", action="store_true", help="有指标退化时以退出码 1 结束")
+    args = parser.parse_args(argv)
+
+    selected = [b for b in args.only.split(",") if b]
+    unknown = set(selected) - set(BENCHES)
+    if unknown:
+        parser.error(f"未知的基准：{', '.join(sorted(unknown))}")
+    params = {"benches": selected, "repeat": args.repeat, "seed": args.seed, "scan_files": args.scan_files,
+              "probe_files": args.probe_files, "log_lines": args.log_lines, "dispatch_jobs": args.dispatch_jobs}
+    results_path = os.path.abspath(args.results)
+    benches = {"scan": bench_scan, "probe": bench_probe, "log": bench_log, "dispatch": bench_dispatch}
+
+    metrics = {}
+    with Workspace(args.seed) as ws:
+        for name in selected:
+            print(f"运行基准：{name} …", flush=True)
+            metrics.update(benches[name](ws, params, args.repeat))
+
+    record = {
+        "time": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "params": params, "metrics": {k: round(v, 4) for k, v in metrics.items()},
+    }
+    regressions = compare(record["metrics"], load_previous(results_path, params), args.threshold)
+    ensure_parent(results_path)
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"结果已追加到 {results_path}")
+    if regressions and args.check:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
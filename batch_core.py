@@ -0,0 +1,3103 @@
+"""批处理引擎：文件扫描、媒体信息探测、命令模板与并发执行，不依赖任何界面库。
+
+命令行用法：python -m batch_core -p 预设名 文件或文件夹...
+"""
+import os
+import sys
+import json
+import csv
+import time
+import subprocess
+import threading
+import re
+import heapq
+import queue
+import sqlite3
+import argparse
+import shlex
+import hashlib
+import fnmatch
+import shutil
+import signal
+import stat
+import tempfile
+import locale
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# 预设文件放在每个用户自己的配置目录，第一次使用时从当前目录的旧文件或程序自带的默认预设复制
+if os.name == "nt":
+    USER_CONFIG_DIR = os.path.join(os.environ.get("APPDATA") or os.path.expanduser("~"), "cmd_batch")
+else:
+    USER_CONFIG_DIR = os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "cmd_batch")
+CONFIG_FILE = os.path.join(USER_CONFIG_DIR, "cmd_presets.json")
+LEGACY_CONFIG_FILE = os.path.abspath("cmd_presets.json")
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cmd_presets.json")
+# 运行数据 (媒体信息缓存、增量清单、续跑日志) 与预设文件放在同一目录，不随启动时的当前目录变化
+DATA_DIR = os.path.dirname(CONFIG_FILE)
+# 媒体信息缓存
+PROBE_CACHE_FILE = os.path.join(DATA_DIR, "probe_cache.sqlite")
+
+# 日志文件超过该大小时轮转，保留的旧文件个数，以及定期落盘间隔 (秒)
+LOG_FILE_MAX_BYTES = 20 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+LOG_FSYNC_SECONDS = 5.0
+
+# 增量处理清单：记录每个输出由哪个输入指纹、命令和工具版本生成
+MANIFEST_FILE = os.path.join(DATA_DIR, "build_manifest.sqlite")
+# 抽样哈希时从文件头、中、尾各读取的字节数
+HASH_SAMPLE_BYTES = 64 * 1024
+
+# 批处理日志 (续跑用)，保留最近的若干份
+JOURNAL_DIR = os.path.join(DATA_DIR, "batch_journals")
+JOURNAL_KEEP = 20
+
+# 多步骤流水线的中间文件目录，优先放在内存盘上，任务结束即删除
+SCRATCH_DIR = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "cmd_batch")
+
+# 分段并行：每段至少多少秒；拼接后输出时长与输入之差允许的误差 (取秒数与比例中较大者)
+SPLIT_MIN_SECONDS = 120
+SPLIT_TOLERANCE_SECONDS = 1.0
+SPLIT_TOLERANCE_RATIO = 0.005
+
+# 输出磁盘至少保留的剩余空间 (字节)
+DISK_MIN_FREE = 1024 ** 3
+
+# 失败分类：按输出内容 (不区分大小写的正则) 判断失败是否值得重试，都不匹配的视为永久失败
+FAILURE_PATTERNS = {
+    # 资源耗尽：重试，并降低该资源类别的并发数
+    "resource": [r"out of memory", r"Cannot allocate memory", r"OpenEncodeSessionEx failed",
+                 r"out of sessions", r"No capable devices found", r"CUDA error", r"No space left on device"],
+    # 临时故障 (网络共享断开等)：按退避时间重试
+    "transient": [r"Connection (reset|refused|timed out)", r"Network is unreachable", r"Input/output error",
+                  r"Stale file handle", r"Resource temporarily unavailable", r"Device or resource busy"],
+    # 永久失败：输入损坏、参数错误等，重试无意义
+    "permanent": [r"Invalid data found", r"No such file or directory", r"Unknown encoder",
+                  r"Unrecognized option", r"moov atom not found", r"Invalid argument"],
+}
+# 默认重试策略：最多尝试次数 (含第一次)、首次退避秒数 (之后每次翻倍) 与退避上限
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 5.0
+RETRY_MAX_BACKOFF = 300.0
+# 判断失败类别时保留的输出行数
+FAILURE_TAIL_LINES = 50
+
+# 资源类别：gpu 受 NVENC 会话数/显存限制，cpu、io 默认只受总槽位数限制
+RESOURCE_CLASSES = ("cpu", "gpu", "io")
+DEFAULT_CLASS_LIMITS = {"gpu": 2}
+# 自动并发时槽位数最多可调到 CPU 核数的多少倍 (流复制等 I/O 型任务可以超过核数)
+AUTO_SLOTS_FACTOR = 2
+GPU_HINTS = ("nvenc", "cuda", "qsv", "_amf", "vaapi", "videotoolbox", "cuvid")
+
+
+def ensure_parent(path):
+    """创建文件所在的目录；失败时留给随后打开文件的操作报错"""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    except OSError:
+        pass
+
+
+def guess_resource(cmd):
+    """根据命令内容推断资源类别（用于旧格式预设或手工修改过的命令）"""
+    low = cmd.lower()
+    if any(h in low for h in GPU_HINTS):
+        return "gpu"
+    if "-c copy" in low or "-codec copy" in low:
+        return "io"
+    return "cpu"
+
+
+def normalize_preset(value, presets=None):
+    """兼容旧格式：预设可以是命令字符串，也可以是 {"cmd", "resource", "max_jobs"} 字典。
+
+    流水线预设用 "steps" 列出各步骤 (预设名或命令行)，拼成多行命令，presets 用于按名称查找步骤。
+    """
+    if isinstance(value, str):
+        value = {"cmd": value}
+    preset = dict(value)
+    if preset.get("steps") and not preset.get("cmd"):
+        preset["cmd"] = expand_steps(preset["steps"], presets or {})
+    preset.setdefault("cmd", "")
+    preset.setdefault("resource", guess_resource(preset["cmd"]))
+    preset.setdefault("max_jobs", None)
+    preset.setdefault("scratch_dir", None)
+    preset.setdefault("encoding", None)
+    preset.setdefault("split", None)
+    preset.setdefault("retry", None)
+    return preset
+
+
+def expand_steps(steps, presets):
+    """把流水线步骤展开为多行命令模版；以 | 开头的步骤经管道读取上一步的输出"""
+    lines = []
+    for step in steps:
+        piped = step.startswith("|")
+        name = step[1:].strip() if piped else step.strip()
+        cmd = presets[name]["cmd"] if name in presets else name
+        lines.append(("| " if piped else "") + cmd)
+    return "\n".join(lines)
+
+
+def class_limits_from(presets):
+    """汇总各预设声明的资源类别并发上限，同一类别取最小值"""
+    limits = dict(DEFAULT_CLASS_LIMITS)
+    declared = {}
+    for preset in presets.values():
+        cls, limit = preset["resource"], preset.get("max_jobs")
+        if limit:
+            declared[cls] = min(declared.get(cls, limit), int(limit))
+    limits.update(declared)
+    return limits
+
+
+def kill_process_tree(proc):
+    """强制结束子进程及其派生的全部进程"""
+    try:
+        if os.name == "nt":
+            # Windows下彻底杀死进程树
+            subprocess.run(f"taskkill /F /T /PID {proc.pid}", shell=True, capture_output=True)
+        else:
+            # 子进程以独立会话启动，直接结束整个进程组
+            os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        proc.terminate()
+
+
+def signal_processes(procs, sig):
+    """向子进程所在的进程组发送信号 (仅 POSIX)，进程已结束时忽略"""
+    for proc in procs:
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            pass
+
+
+# ru_maxrss 的单位：Linux 为 KB，macOS 为字节
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def read_proc_io(pid):
+    """读取 /proc/<pid>/io：io_* 为读写系统调用的字节数，disk_* 为实际落到存储设备的字节数"""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"io_read": int(fields["rchar"]), "io_write": int(fields["wchar"]),
+                "disk_read": int(fields["read_bytes"]), "disk_write": int(fields["write_bytes"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def wait_with_usage(proc):
+    """等待子进程结束并返回其资源用量 (含已被它回收的后代进程)；平台不支持时只等待并返回 None"""
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    io = {}
+    try:
+        if hasattr(os, "waitid"):
+            # 先不回收：进程成为僵尸后 /proc/<pid>/io 里是包含后代在内的最终累计值
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            io = read_proc_io(proc.pid)
+        _, status, ru = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # 已被其他地方回收 (例如终止任务时)
+        proc.wait()
+        return None
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return dict(io, cpu_user=ru.ru_utime, cpu_sys=ru.ru_stime, max_rss=ru.ru_maxrss * RSS_UNIT)
+
+
+# 子进程输出按块读取，按换行或回车 (ffmpeg 的状态行) 分行
+OUTPUT_CHUNK_BYTES = 64 * 1024
+LINE_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+
+
+class OutputDecoder:
+    """子进程输出的解码：指定编码时直接使用；auto 时先按 UTF-8 解码，失败再用系统区域编码 (中文 Windows 为 GBK)，
+    系统编码本身就是 UTF-8 时退回 GBK"""
+
+    def __init__(self, encoding="auto"):
+        self.encoding = None if encoding in (None, "", "auto") else codecs.lookup(encoding).name
+        fallback = codecs.lookup(locale.getpreferredencoding(False) or "utf-8").name
+        self.fallback = "gbk" if fallback == "utf-8" else fallback
+
+    def __call__(self, data):
+        if self.encoding:
+            return data.decode(self.encoding, errors="replace")
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return data.decode(self.fallback, errors="replace")
+
+
+def iter_output_lines(stream, decode):
+    """以二进制方式读取 stream 直到结束，逐行产出解码后的文本 (末尾带换行符)"""
+    fd = stream.fileno()
+    pending = b""
+    while True:
+        chunk = os.read(fd, OUTPUT_CHUNK_BYTES)
+        if not chunk:
+            break
+        lines = LINE_BREAK_RE.split(pending + chunk)
+        pending = lines.pop()
+        for line in lines:
+            yield decode(line) + "\n"
+    if pending:
+        yield decode(pending) + "\n"
+
+
+def merge_usage(total, usage):
+    """累加流水线中多个子进程的资源用量：时间与读写量求和，峰值内存取最大"""
+    for key, value in usage.items():
+        total[key] = max(total.get(key, 0), value) if key == "max_rss" else total.get(key, 0) + value
+    return total
+
+
+class LogWriter:
+    """后台日志写入线程：持有缓冲文件句柄，定期 fsync，文件超过上限时轮转"""
+
+    def __init__(self, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS,
+                 fsync_seconds=LOG_FSYNC_SECONDS, on_error=None):
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.fsync_seconds = fsync_seconds
+        self.on_error = on_error        # on_error(exception)，每个文件只报告一次
+        self.path = None
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._dirty = False
+        self._failed = False
+        self._last_sync = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="log-writer")
+        self._thread.start()
+
+    def open(self, path, truncate=False):
+        """切换到新的日志文件；truncate=True 时清空原有内容"""
+        self.path = path
+        self._queue.put(("open", path, truncate))
+
+    def write(self, text):
+        self._queue.put(("write", text, None))
+
+    def write_json(self, record):
+        self.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._queue.put(("flush", None, None))
+
+    def close(self, wait=True):
+        self._queue.put(("close", None, None))
+        if wait:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while True:
+            try:
+                op, arg, truncate = self._queue.get(timeout=self.fsync_seconds)
+            except queue.Empty:
+                op = None
+            try:
+                if op == "open":
+                    self._close_file()
+                    self._failed = False
+                    os.makedirs(os.path.dirname(arg) or ".", exist_ok=True)
+                    self._file = open(arg, "w" if truncate else "a", encoding="utf-8")
+                elif op == "write" and self._file:
+                    self._file.write(arg)
+                    self._dirty = True
+                    if self._file.tell() > self.max_bytes:
+                        self._rotate()
+                elif op == "flush":
+                    self._sync()
+                elif op == "close":
+                    self._close_file()
+                    return
+                if self._dirty and time.monotonic() - self._last_sync >= self.fsync_seconds:
+                    self._sync()
+            except Exception as e:
+                self._close_file()
+                if not self._failed and self.on_error:
+                    self.on_error(e)
+                self._failed = True
+
+    def _sync(self):
+        if self._file and self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        """batch_cmd.log -> batch_cmd.log.1 -> ... -> batch_cmd.log.N"""
+        path = self._file.name
+        self._close_file()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        self._file = open(path, "w", encoding="utf-8")
+
+    def _close_file(self):
+        if self._file:
+            try:
+                self._sync()
+            finally:
+                self._file.close()
+                self._file = None
+
+
+def partial_name(full_out):
+    """处理中的临时输出文件名，保留原后缀以便工具识别输出格式"""
+    stem, ext = os.path.splitext(full_out)
+    return f"{stem}.partial{ext}"
+
+
+# 处理中的临时输出 (partial_name) 及分段文件夹 (<临时输出>.split) 永远不作为输入
+ALWAYS_EXCLUDE = ("*.partial.*",)
+
+
+def is_partial(name):
+    return any(fnmatch.fnmatch(name, p) for p in ALWAYS_EXCLUDE)
+
+
+class BatchJournal:
+    """可在崩溃后续跑的批处理日志。
+
+    文件第一行是批次设置与按派发顺序排列的输入列表 (通过临时文件+改名原子写入)，
+    之后每行追加一条任务状态变化；重放时忽略最后一条写了一半的记录。
+    任务状态：pending / running / done / failed / skipped。
+    """
+
+    def __init__(self, path, header, states=None):
+        self.path = path
+        self.header = header
+        self.states = states if states is not None else {p: {"state": "pending"} for p in header["inputs"]}
+        self.complete = False
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def create(cls, settings, inputs, journal_dir=JOURNAL_DIR):
+        os.makedirs(journal_dir, exist_ok=True)
+        batch_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        path = os.path.join(journal_dir, f"batch_{batch_id}.journal")
+        header = dict(settings, batch=batch_id, inputs=list(inputs))
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        cls.prune(journal_dir)
+        return cls(path, header)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            journal = cls(path, header)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break   # 崩溃时写了一半的记录
+                if record.get("complete"):
+                    journal.complete = True
+                elif record.get("input") in journal.states:
+                    journal.states[record.pop("input")] = record
+        return journal
+
+    @classmethod
+    def load_last(cls, journal_dir=JOURNAL_DIR):
+        """读取最近一次批处理的日志，不存在时返回 None"""
+        if not os.path.isdir(journal_dir):
+            return None
+        files = [os.path.join(journal_dir, f) for f in os.listdir(journal_dir) if f.endswith(".journal")]
+        if not files:
+            return None
+        return cls.load(max(files, key=os.path.getmtime))
+
+    @staticmethod
+    def prune(journal_dir, keep=JOURNAL_KEEP):
+        files = sorted((os.path.join(journal_dir, f) for f in os.listdir(journal_dir) if f.endswith(".journal")),
+                       key=os.path.getmtime)
+        for path in files[:-keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _append(self, record):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def mark(self, in_path, state, **extra):
+        record = dict(extra, state=state)
+        self.states[in_path] = record
+        self._append(dict(record, input=in_path))
+
+    def remaining(self):
+        """未完成 (待处理或中断) 的输入，按原派发顺序"""
+        return [p for p in self.header["inputs"] if self.states.get(p, {}).get("state") in ("pending", "running")]
+
+    def discard_partials(self):
+        """删除中断任务留下的临时输出，返回删除的文件数"""
+        removed = 0
+        for p in self.remaining():
+            partial = self.states[p].get("partial")
+            if partial and os.path.exists(partial):
+                try:
+                    os.remove(partial)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def close(self, complete=False):
+        if complete:
+            self._append({"complete": True})
+            self.complete = True
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class JobScheduler:
+    """并发任务调度器：维护 N 个执行槽位，空闲槽位按队列顺序领取下一个任务。
+
+    每个任务属于一个资源类别 (resource_of(job))，class_limits 限定各类别的同时运行数，
+    类别已满时跳过该任务，先派发队列中其他类别的任务。
+    """
+
+    def __init__(self, slots, handler, class_limits=None, resource_of=None):
+        self.slots = max(1, int(slots))
+        self.handler = handler      # handler(job, slot)，在各自的工作线程中执行单个任务
+        self.class_limits = dict(class_limits or {})
+        self.resource_of = resource_of or (lambda job: "cpu")
+        self.active = {}            # 资源类别 -> 正在运行的任务数
+        self.is_running = False
+        self.queue = []
+        self.limit = self.slots     # 当前允许同时运行的任务数，自动并发时由 AdaptiveConcurrency 调整
+        self.delayed = 0            # 等待退避结束后重新排队的任务数
+        self.assigned = {}          # 槽位 -> 正在执行的任务
+        self._cond = threading.Condition()
+
+    def _next_job(self, queue):
+        """取出队列中第一个所属类别仍有余量的任务，没有则返回 None"""
+        for idx, job in enumerate(queue):
+            cls = self.resource_of(job)
+            limit = self.class_limits.get(cls)
+            if not limit or self.active.get(cls, 0) < limit:
+                del queue[idx]
+                return job, cls
+        return None
+
+    def set_limit(self, limit):
+        """调整同时运行的任务数上限 (1 ~ slots)；调低时不中断已在运行的任务"""
+        with self._cond:
+            self.limit = max(1, min(self.slots, int(limit)))
+            self._cond.notify_all()
+
+    def running(self):
+        with self._cond:
+            return sum(self.active.values())
+
+    def snapshot(self):
+        """返回 (排队任务数, 等待重试的任务数, {槽位: 任务})"""
+        with self._cond:
+            return len(self.queue), self.delayed, dict(self.assigned)
+
+    def submit(self, job, front=False):
+        """运行中追加任务 (follow 模式下用于持续送入新任务)；front 为真时排到队首优先派发"""
+        with self._cond:
+            if front:
+                self.queue.insert(0, job)
+            else:
+                self.queue.append(job)
+            self._cond.notify_all()
+
+    def submit_later(self, job, delay):
+        """delay 秒后把任务放回队列 (重试退避)；等待期间 run() 不会因队列为空而结束"""
+        def fire():
+            with self._cond:
+                self.delayed -= 1
+                if self.is_running:
+                    self.queue.append(job)
+                self._cond.notify_all()
+
+        with self._cond:
+            self.delayed += 1
+        timer = threading.Timer(delay, fire)
+        timer.daemon = True
+        timer.start()
+
+    def shrink_class(self, cls):
+        """把资源类别的并发上限降到当前运行数减一 (至少为 1)，返回 (原上限, 新上限)"""
+        with self._cond:
+            old = self.class_limits.get(cls) or self.limit
+            self.class_limits[cls] = new = max(1, min(old, self.active.get(cls, 0)) - 1)
+            return old, new
+
+    def run(self, jobs, follow=False):
+        """阻塞执行全部任务，直到队列清空且没有运行中的任务，或被 stop() 终止；follow 为真时队列空了也继续等待 submit()"""
+        self.is_running = True
+        with self._cond:
+            # 在 run() 之前 submit() 的任务排在初始任务之后
+            self.queue[:0] = list(jobs)
+            queue = self.queue
+        free_slots = list(range(1, self.slots + 1))     # 小根堆，总是优先复用编号小的槽位
+        threads = []
+
+        def worker(job, slot, cls):
+            try:
+                self.handler(job, slot)
+            finally:
+                with self._cond:
+                    self.assigned.pop(slot, None)
+                    self.active[cls] -= 1
+                    heapq.heappush(free_slots, slot)
+                    self._cond.notify_all()
+
+        while True:
+            with self._cond:
+                picked = None
+                # 仍有任务在运行时继续等待：运行中的任务可能 submit() 后续任务 (如分段任务)
+                while self.is_running and (queue or follow or self.delayed or len(free_slots) < self.slots):
+                    if free_slots and queue and self.slots - len(free_slots) < self.limit:
+                        picked = self._next_job(queue)
+                        if picked:
+                            break
+                    self._cond.wait()
+                if not picked:
+                    break
+                job, cls = picked
+                slot = heapq.heappop(free_slots)
+                self.assigned[slot] = job
+                self.active[cls] = self.active.get(cls, 0) + 1
+            t = threading.Thread(target=worker, args=(job, slot, cls), daemon=True)
+            t.start()
+            # 长时间运行时只保留未结束的线程
+            threads = [x for x in threads if x.is_alive()]
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+
+
+class SystemLoad:
+    """从 /proc 采样系统负载：CPU 利用率与 iowait (两次采样之间)、每核 1 分钟负载、可用内存比例、内存压力 (PSI)"""
+
+    def __init__(self):
+        self.cpus = os.cpu_count() or 1
+        self._last = self._cpu_times()
+
+    @staticmethod
+    def available():
+        return os.path.exists("/proc/stat") and os.path.exists("/proc/meminfo")
+
+    @staticmethod
+    def _cpu_times():
+        with open("/proc/stat") as f:
+            values = [int(v) for v in f.readline().split()[1:9]]
+        # user nice system idle iowait irq softirq steal
+        return sum(values), values[3], values[4]
+
+    @staticmethod
+    def _memory():
+        fields = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                fields[key] = int(rest.split()[0])
+        return fields.get("MemAvailable", fields.get("MemFree", 0)) / max(fields.get("MemTotal", 1), 1)
+
+    @staticmethod
+    def _memory_pressure():
+        """最近 10 秒内有任务因等待内存而停顿的时间百分比；内核不支持 PSI 时返回 None"""
+        try:
+            with open("/proc/pressure/memory") as f:
+                for line in f:
+                    if line.startswith("some"):
+                        return float(line.split("avg10=")[1].split()[0])
+        except (OSError, IndexError, ValueError):
+            pass
+        return None
+
+    def sample(self):
+        total, idle, iowait = self._cpu_times()
+        last_total, last_idle, last_iowait = self._last
+        self._last = (total, idle, iowait)
+        elapsed = max(total - last_total, 1)
+        with open("/proc/loadavg") as f:
+            load1 = float(f.read().split()[0])
+        return {
+            "cpu": 1 - (idle - last_idle + iowait - last_iowait) / elapsed,
+            "iowait": (iowait - last_iowait) / elapsed,
+            "load": load1 / self.cpus,
+            "mem_free": self._memory(),
+            "mem_pressure": self._memory_pressure(),
+        }
+
+
+class AdaptiveConcurrency:
+    """自动并发：定期采样系统负载，逐个增减调度器允许同时运行的任务数，并记录吞吐量。
+
+    CPU 与磁盘都有余量时加一个槽位；内存紧张、磁盘 iowait 过高或运行队列明显过载时减一个槽位。
+    每次调整后冷却若干个采样周期，等新的负载稳定下来再判断。
+    """
+
+    INTERVAL = 5.0          # 采样间隔 (秒)
+    COOLDOWN = 2            # 调整后跳过的采样周期数
+    REPORT_EVERY = 6        # 无调整时每隔多少个周期报告一次吞吐
+    CPU_LOW = 0.75          # CPU 利用率低于此值才考虑加槽位
+    IOWAIT_LOW = 0.15
+    IOWAIT_HIGH = 0.30      # iowait 高于此值说明磁盘已饱和
+    LOAD_HIGH = 1.5         # 每核运行队列长度高于此值视为过载
+    MEM_LOW = 0.10          # 可用内存比例低于此值时减槽位
+    PSI_HIGH = 10.0         # 内存压力 (百分比) 高于此值时减槽位
+
+    def __init__(self, scheduler, runner, log, interval=INTERVAL, load=None):
+        self.scheduler = scheduler
+        self.runner = runner
+        self.log = log
+        self.interval = interval
+        self.load = load or SystemLoad()
+        self.history = []       # (时刻, 槽位数, 任务/分, 媒体秒/秒)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="adaptive-slots")
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval)
+
+    def decide(self, sample, limit, queued):
+        """返回 (新的槽位数, 原因)；不调整时原因为 None"""
+        pressure = sample["mem_pressure"]
+        if sample["mem_free"] < self.MEM_LOW or (pressure is not None and pressure > self.PSI_HIGH):
+            return limit - 1, "内存紧张"
+        if sample["iowait"] > self.IOWAIT_HIGH:
+            return limit - 1, "磁盘 iowait 过高"
+        if sample["load"] > self.LOAD_HIGH and sample["cpu"] > self.CPU_LOW:
+            return limit - 1, "CPU 过载"
+        if queued and sample["cpu"] < self.CPU_LOW and sample["iowait"] < self.IOWAIT_LOW:
+            return limit + 1, "CPU 与磁盘仍有余量"
+        return limit, None
+
+    def _loop(self):
+        runner = self.runner
+        last_time = time.monotonic()
+        last_done, last_media = runner.stats.get("done", 0), runner.progress.media_done
+        cooldown = quiet = 0
+        while not self._stop.wait(self.interval):
+            try:
+                sample = self.load.sample()
+            except (OSError, ValueError):
+                continue
+            now = time.monotonic()
+            done, media = runner.stats.get("done", 0), runner.progress.media_done
+            jobs_per_min = (done - last_done) * 60 / (now - last_time)
+            media_rate = (media - last_media) / (now - last_time)
+            last_time, last_done, last_media = now, done, media
+
+            limit = self.scheduler.limit
+            new_limit, reason = limit, None
+            if cooldown:
+                cooldown -= 1
+            else:
+                new_limit, reason = self.decide(sample, limit, len(self.scheduler.queue))
+                new_limit = max(1, min(self.scheduler.slots, new_limit))
+            self.history.append((now, new_limit, jobs_per_min, media_rate))
+            detail = (f"CPU {sample['cpu']:.0%}，iowait {sample['iowait']:.0%}，负载 {sample['load']:.2f}/核，"
+                      f"可用内存 {sample['mem_free']:.0%}；吞吐 {jobs_per_min:.1f} 任务/分，媒体 {media_rate:.1f} 秒/秒")
+            quiet += 1
+            if new_limit != limit:
+                self.scheduler.set_limit(new_limit)
+                cooldown, quiet = self.COOLDOWN, 0
+                self.log(f"自动并发：{limit} → {new_limit}（{reason}）{detail}", "信息")
+            elif quiet >= self.REPORT_EVERY:
+                quiet = 0
+                self.log(f"自动并发：保持 {limit}，{detail}", "信息")
+
+
+def run_ffprobe(file_path):
+    """调用 ffprobe 获取原始 JSON 信息，失败时返回 None"""
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        return None
+    return data if data.get('format') else None
+
+
+def media_numbers(data):
+    """从 ffprobe 数据中取出 (时长秒数, 文件字节数)，缺失时为 None"""
+    f = (data or {}).get('format', {})
+    try:
+        duration = float(f['duration'])
+    except (KeyError, TypeError, ValueError):
+        duration = None
+    try:
+        size = int(f['size'])
+    except (KeyError, TypeError, ValueError):
+        size = None
+    return duration, size
+
+
+def format_seconds(seconds):
+    """秒数格式化为 H:MM:SS，时长超过 24 小时也能正确显示"""
+    seconds = int(max(0, seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class FfmpegProgress:
+    """解析 ffmpeg 输出中的进度信息。
+
+    同时支持 -stats 状态行 (frame= fps= time= speed=) 与 -progress pipe: 的 key=value 输出。
+    """
+
+    STATUS_RE = re.compile(r"(frame|fps|time|speed)=\s*(\S+)")
+
+    def __init__(self, duration=None):
+        self.duration = duration    # 输入媒体时长 (秒)，未知时无法计算百分比
+        self.out_time = 0.0
+        self.fps = None
+        self.speed = None
+
+    @staticmethod
+    def parse_time(value):
+        """解析 HH:MM:SS.xx 格式的时间，无效值 (如 N/A) 返回 None"""
+        parts = value.split(":")
+        try:
+            seconds = 0.0
+            for part in parts:
+                seconds = seconds * 60 + float(part)
+            return seconds
+        except ValueError:
+            return None
+
+    def feed(self, line):
+        """处理一行输出，识别到进度信息时返回 True"""
+        line = line.strip()
+        if line.startswith(("out_time_us=", "out_time_ms=")):
+            # -progress 输出中 out_time_ms 实际单位也是微秒
+            try:
+                self.out_time = max(0.0, int(line.split("=", 1)[1]) / 1e6)
+                return True
+            except ValueError:
+                return False
+        if line.startswith(("fps=", "speed=")) and " " not in line:
+            key, value = line.split("=", 1)
+            self._set(key, value)
+            return False
+        matches = self.STATUS_RE.findall(line)
+        if not any(key == "time" for key, _ in matches):
+            return False
+        for key, value in matches:
+            self._set(key, value)
+        return True
+
+    def _set(self, key, value):
+        if key == "time":
+            seconds = self.parse_time(value)
+            if seconds is not None:
+                self.out_time = seconds
+        elif key == "fps":
+            try:
+                self.fps = float(value)
+            except ValueError:
+                pass
+        elif key == "speed":
+            try:
+                self.speed = float(value.rstrip("x"))
+            except ValueError:
+                pass
+
+    def percent(self):
+        if not self.duration:
+            return None
+        return min(100.0, self.out_time / self.duration * 100)
+
+    def eta(self):
+        """按当前处理速度估算本任务剩余秒数"""
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, self.duration - self.out_time) / self.speed
+
+    def describe(self):
+        parts = []
+        pct = self.percent()
+        parts.append(f"{pct:5.1f}%" if pct is not None else format_seconds(self.out_time))
+        if self.fps is not None:
+            parts.append(f"fps {self.fps:g}")
+        if self.speed is not None:
+            parts.append(f"{self.speed:g}x")
+        eta = self.eta()
+        if eta is not None:
+            parts.append(f"剩余 {format_seconds(eta)}")
+        return " | ".join(parts)
+
+
+class BatchProgress:
+    """按媒体时长加权统计整批进度，并根据已处理的媒体时长估算整批剩余时间。
+
+    时长未知的文件按已知文件的平均时长计权。
+    """
+
+    def __init__(self, durations):
+        self._lock = threading.Lock()
+        self.durations = dict(durations)    # 任务 key -> 时长 (秒) 或 None
+        self.position = {}                  # 任务 key -> 已处理的媒体秒数
+        self.done = set()
+        self.started = time.monotonic()
+        self.media_done = 0.0               # 本批实际处理的媒体秒数 (不含跳过)
+
+    def _weight(self, key):
+        duration = self.durations.get(key)
+        if duration:
+            return duration
+        known = [d for d in self.durations.values() if d]
+        return sum(known) / len(known) if known else 1.0
+
+    def set_duration(self, key, duration):
+        with self._lock:
+            self.durations[key] = duration
+
+    def reopen(self, key):
+        """已结束的任务重新开始 (重跑失败任务时)"""
+        with self._lock:
+            self.done.discard(key)
+            self.position.pop(key, None)
+
+    def fraction(self, key):
+        """单个任务的完成比例，时长或进度未知时返回 None"""
+        with self._lock:
+            duration, position = self.durations.get(key), self.position.get(key)
+        return position / duration if duration and position else None
+
+    def update(self, key, seconds):
+        with self._lock:
+            self.position[key] = seconds
+
+    def finish(self, key, processed=True):
+        """任务结束；跳过的任务计入完成但不参与速度估算"""
+        with self._lock:
+            weight = self._weight(key)
+            if processed:
+                self.media_done += weight
+            self.position.pop(key, None)
+            self.done.add(key)
+
+    def rate(self):
+        """本批平均每秒处理的媒体秒数"""
+        with self._lock:
+            processed = self.media_done + sum(min(pos, self._weight(k)) for k, pos in self.position.items())
+        elapsed = time.monotonic() - self.started
+        return processed / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """返回 (完成比例 0~1, 预计剩余秒数或 None)"""
+        with self._lock:
+            total = sum(self._weight(k) for k in self.durations) or 1.0
+            finished = sum(self._weight(k) for k in self.done)
+            running = sum(min(pos, self._weight(k)) for k, pos in self.position.items())
+            fraction = min(1.0, (finished + running) / total)
+            processed = self.media_done + running
+            elapsed = time.monotonic() - self.started
+            if processed <= 0 or elapsed <= 0:
+                return fraction, None
+            remaining = total * (1 - fraction)
+            return fraction, remaining / (processed / elapsed)
+
+
+# 队列排序策略
+QUEUE_ORDERS = {
+    "list": "列表顺序",
+    "lpt": "最长优先 (总耗时最短)",
+    "sjf": "最短优先 (尽早出结果)",
+    "codec": "按编码分组",
+}
+
+
+def order_jobs(keys, strategy, durations, sizes, codecs=None):
+    """按策略返回派发顺序。
+
+    durations/sizes/codecs 均以任务 key 索引；以时长为主、文件大小为辅排序，
+    相同权重保持原有顺序，保证同一列表多次排序 (如续跑) 得到相同结果。
+    """
+    keys = list(keys)
+    if strategy not in ("lpt", "sjf", "codec"):
+        return keys
+
+    def weight(k):
+        return (durations[k] or 0.0, sizes[k] or 0)
+
+    if strategy == "sjf":
+        # 时长未知的文件放在最后
+        return sorted(keys, key=lambda k: (durations[k] is None, weight(k)))
+    if strategy == "codec":
+        return sorted(keys, key=lambda k: (tuple(codecs[k]) if codecs else (), tuple(-x for x in weight(k))))
+    return sorted(keys, key=lambda k: tuple(-x for x in weight(k)))
+
+
+class ProbeCache:
+    """ffprobe 结果的持久化缓存 (SQLite)，以 (绝对路径, 大小, mtime_ns) 判断是否命中。
+
+    超过 max_entries 条时按最近使用时间淘汰最旧的记录。
+    """
+
+    def __init__(self, db_path=PROBE_CACHE_FILE, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        ensure_parent(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS probe (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS probe_last_used ON probe (last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM probe").fetchone()[0]
+
+    def get(self, path, st):
+        """返回缓存的原始 JSON 数据；文件大小或修改时间变化视为未命中"""
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, data FROM probe WHERE path = ?", (path,)).fetchone()
+            if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE probe SET last_used = ? WHERE path = ?", (time.time(), path))
+            self._maybe_commit()
+            return json.loads(row[2])
+
+    def put(self, path, st, data):
+        row = (st.st_size, st.st_mtime_ns, json.dumps(data, ensure_ascii=False), time.time(), path)
+        with self._lock:
+            # 文件变化后重新探测的记录原地更新，只有新增的记录才计数
+            updated = self._conn.execute(
+                "UPDATE probe SET size = ?, mtime_ns = ?, data = ?, last_used = ? WHERE path = ?", row
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO probe (size, mtime_ns, data, last_used, path) VALUES (?, ?, ?, ?, ?)", row
+                )
+                self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+            self._maybe_commit()
+
+    def _evict(self):
+        # 一次多淘汰 10%，避免每次写入都触发淘汰
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM probe WHERE path IN (SELECT path FROM probe ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM probe").fetchone()[0]
+
+    def _maybe_commit(self):
+        self._writes += 1
+        if self._writes >= 200:
+            self._conn.commit()
+            self._writes = 0
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._writes = 0
+
+    def take_stats(self):
+        """返回并清零 (命中数, 未命中数)"""
+        with self._lock:
+            stats = (self.hits, self.misses)
+            self.hits = self.misses = 0
+            return stats
+
+
+def fingerprint(path, sampled=False):
+    """输入文件指纹：默认为 大小+修改时间，sampled=True 时附加头/中/尾抽样内容的哈希"""
+    st = os.stat(path)
+    fp = f"{st.st_size}:{st.st_mtime_ns}"
+    if not sampled:
+        return fp
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for offset in (0, max(0, st.st_size // 2 - HASH_SAMPLE_BYTES // 2), max(0, st.st_size - HASH_SAMPLE_BYTES)):
+            f.seek(offset)
+            h.update(f.read(HASH_SAMPLE_BYTES))
+    return f"{fp}:{h.hexdigest()}"
+
+
+_tool_versions = {}
+_tool_versions_lock = threading.Lock()
+
+
+def tool_version(cmd):
+    """命令所调用工具的版本 (取 -version/--version 输出的第一行)，同一工具只查询一次；流水线取各步骤的版本"""
+    steps = pipeline_steps(cmd)
+    if len(steps) > 1:
+        return " | ".join(tool_version(step.lstrip("| ")) for step in steps)
+    try:
+        tool = shlex.split(cmd, posix=(os.name != "nt"))[0].strip('"')
+    except (ValueError, IndexError):
+        return "unknown"
+    with _tool_versions_lock:
+        if tool in _tool_versions:
+            return _tool_versions[tool]
+        version = "unknown"
+        for flag in ("-version", "--version"):
+            try:
+                result = subprocess.run([tool, flag], capture_output=True, text=True, errors='replace', timeout=15)
+            except (OSError, subprocess.SubprocessError):
+                break
+            first = (result.stdout or result.stderr).strip().splitlines()
+            if result.returncode == 0 and first:
+                version = first[0]
+                break
+        _tool_versions[tool] = version
+        return version
+
+
+class BuildManifest:
+    """增量处理清单 (SQLite)：输出文件 -> (输入指纹, 命令, 工具版本)。
+
+    三者均未变化且输出文件仍在时，该任务视为已是最新，可直接跳过。
+    """
+
+    def __init__(self, db_path=MANIFEST_FILE):
+        self._lock = threading.Lock()
+        ensure_parent(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outputs (output TEXT PRIMARY KEY, input TEXT, fingerprint TEXT, "
+            "command TEXT, tool TEXT, out_size INTEGER, updated REAL)"
+        )
+        self._conn.commit()
+
+    def is_current(self, output, fp, command, tool):
+        try:
+            out_size = os.stat(output).st_size
+        except OSError:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, command, tool, out_size FROM outputs WHERE output = ?", (os.path.abspath(output),)
+            ).fetchone()
+        return row is not None and tuple(row) == (fp, command, tool, out_size)
+
+    def record(self, output, in_path, fp, command, tool):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outputs (output, input, fingerprint, command, tool, out_size, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(output), os.path.abspath(in_path), fp, command, tool, os.stat(output).st_size, time.time())
+            )
+            self._conn.commit()
+
+
+class ProbePool:
+    """后台媒体信息探测池：限定 ffprobe 并发数，结果通过回调返回，可整体取消"""
+
+    def __init__(self, probe, workers=None):
+        self.probe = probe
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="probe")
+        self._pending = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def submit(self, path, callback):
+        """提交一个探测任务，完成后在工作线程中调用 callback(info)"""
+        with self._lock:
+            generation = self._generation
+            future = self._executor.submit(self._run, path, callback, generation)
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+
+    def _run(self, path, callback, generation):
+        if generation != self._generation:
+            return
+        info = self.probe(path)
+        # cancel() 之后返回的结果直接丢弃
+        if generation == self._generation:
+            callback(info)
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """取消未完成的探测并结束工作线程"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def cancel(self):
+        """取消所有排队中的探测，正在运行的探测结果也不再回调"""
+        with self._lock:
+            self._generation += 1
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+
+
+class FileEntry:
+    """文件列表中的一项：路径与媒体信息列 (未探测完成时 info 为 None)"""
+    __slots__ = ("iid", "path", "info", "duration", "size")
+
+    def __init__(self, iid, path):
+        self.iid = iid
+        self.path = path
+        self.info = None
+        self.duration = None    # 媒体时长 (秒)
+        self.size = None        # 文件字节数
+
+    def values(self):
+        info = self.info or ("探测中…", "", "", "", "", "")
+        return (os.path.basename(self.path), *info, self.path)
+
+
+class FileListModel:
+    """文件列表数据模型：按顺序保存全部条目，并维护路径与行 ID 索引。
+
+    Treeview 只显示其中的一个可见窗口，增删、移动、去重都在这里完成，无需遍历界面控件。
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.by_path = {}
+        self.by_iid = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.by_path
+
+    def add(self, path):
+        """追加一个文件，已存在时返回 None"""
+        if path in self.by_path:
+            return None
+        self._next_id += 1
+        entry = FileEntry(f"F{self._next_id:x}", path)
+        self.entries.append(entry)
+        self.by_path[path] = entry
+        self.by_iid[entry.iid] = entry
+        return entry
+
+    def remove(self, iids):
+        iids = set(iids)
+        if not iids:
+            return
+        self.entries = [e for e in self.entries if e.iid not in iids]
+        for iid in iids:
+            entry = self.by_iid.pop(iid, None)
+            if entry:
+                del self.by_path[entry.path]
+
+    def move(self, iids, direction):
+        """将选中的条目整体上移 (-1) 或下移 (1) 一位"""
+        iids = set(iids)
+        positions = [i for i, e in enumerate(self.entries) if e.iid in iids]
+        if direction > 0:
+            positions.reverse()
+        for i in positions:
+            j = i + direction
+            if 0 <= j < len(self.entries) and self.entries[j].iid not in iids:
+                self.entries[i], self.entries[j] = self.entries[j], self.entries[i]
+
+    def clear(self):
+        self.entries = []
+        self.by_path.clear()
+        self.by_iid.clear()
+
+    def paths(self):
+        return [e.path for e in self.entries]
+
+
+
+# 支持的文件格式
+VIDEO_EXTS = ('.mp4', '.mkv', '.avi', '.mpeg', '.mpg', '.wmv')
+AUDIO_EXTS = ('.mp3', '.aac', '.mka', '.mpa', '.flac', '.wav', '.wma', '.ogg', '.ape')
+SUPPORTED_EXTS = tuple(ext.lower() for ext in VIDEO_EXTS + AUDIO_EXTS)
+
+# 命令行退出码
+EXIT_OK = 0
+EXIT_FAILED = 1         # 有任务处理失败
+EXIT_USAGE = 2          # 参数或预设错误
+EXIT_NO_INPUT = 3       # 没有可处理的文件
+EXIT_INTERRUPTED = 130  # 被 Ctrl+C 终止
+
+
+def parse_presets(raw, errors=None):
+    """把预设文件的内容规范化，返回 {名称: 预设}。
+
+    格式不对的单个预设被跳过，原因记入 errors ({名称: 问题列表})；只有顶层不是对象时整个文件无效。
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("预设文件的顶层必须是 {名称: 预设} 对象")
+    errors = {} if errors is None else errors
+    presets = {}
+    # 先载入普通预设，流水线的步骤可按名称引用它们
+    for name, value in sorted(raw.items(), key=lambda item: isinstance(item[1], dict) and "steps" in item[1]):
+        if not isinstance(value, (str, dict)):
+            errors[name] = ["应为命令字符串或对象"]
+            continue
+        try:
+            presets[name] = normalize_preset(value, presets)
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
+            errors[name] = [f"格式无效：{e}"]
+    return {name: presets[name] for name in raw if name in presets}
+
+
+def load_presets(path=CONFIG_FILE):
+    """读取预设文件，返回 {名称: 规范化后的预设}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_presets(json.load(f))
+
+
+def validate_preset(preset):
+    """检查规范化后的预设，返回问题列表 (为空表示可用)"""
+    problems = []
+    cmd = preset.get("cmd") or ""
+    steps = pipeline_steps(cmd)
+    if not steps:
+        return ["命令为空"]
+    for k, line in enumerate(steps):
+        where = f"第 {k + 1} 步" if len(steps) > 1 else "命令"
+        try:
+            argv = split_args(line[1:] if line.startswith("|") else line)
+        except ValueError as e:
+            problems.append(f"{where}无法解析：{e}")
+            continue
+        if not argv or PLACEHOLDER_RE.fullmatch(argv[0]):
+            problems.append(f"{where}缺少要执行的程序")
+    fields = compile_template(cmd).fields
+    for field in ("input", "output"):
+        if field not in fields:
+            problems.append(f"缺少 {{{field}}} 占位符")
+    if preset.get("resource") not in RESOURCE_CLASSES:
+        problems.append(f"资源类别 {preset.get('resource')!r} 无效，应为 {' / '.join(RESOURCE_CLASSES)}")
+    for key in ("max_jobs", "split"):
+        value = preset.get(key)
+        if value is not None and not isinstance(value, bool) and (not isinstance(value, int) or value < 0):
+            problems.append(f"{key} 应为非负整数")
+    if preset.get("encoding"):
+        try:
+            codecs.lookup(preset["encoding"])
+        except LookupError:
+            problems.append(f"未知的编码：{preset['encoding']}")
+    if preset.get("retry") is not None:
+        try:
+            RetryPolicy.from_dict(preset["retry"])
+        except (TypeError, ValueError, AttributeError, re.error) as e:
+            problems.append(f"重试策略无效：{e}")
+    return problems
+
+
+class PresetStore:
+    """预设库：载入一次后缓存在内存，每次读取只比较文件的修改时间与大小，外部修改后自动重新载入。
+
+    保存时先写临时文件再改名，写入前发现文件已被外部修改则合并后重写，不会覆盖别人的改动。
+    校验不通过的预设不出现在 presets() 中，原因记录在 errors。GUI 与命令行共用。
+    """
+
+    def __init__(self, path=CONFIG_FILE, seeds=(LEGACY_CONFIG_FILE, DEFAULT_CONFIG_FILE)):
+        self.path = os.path.abspath(path)
+        self.seeds = seeds          # 预设文件不存在时依次尝试复制的来源
+        self.errors = {}            # 名称 -> 问题列表
+        self._raw = {}
+        self._presets = {}
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def ensure_file(self):
+        """预设文件不存在时创建 (从 seeds 中第一个存在的文件复制)，返回文件路径"""
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            seed = next((p for p in self.seeds if os.path.abspath(p) != self.path and os.path.isfile(p)), None)
+            if seed:
+                shutil.copyfile(seed, self.path)
+        return self.path
+
+    def refresh(self):
+        """文件有变化时重新载入，返回是否重新载入；文件内容无效时抛出 OSError / ValueError 并保留原有缓存"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp is None and self._stamp is None and self.seeds:
+                self.ensure_file()
+                stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return False
+            raw = {}
+            if stamp is not None:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+            errors = {}
+            presets = parse_presets(raw, errors)
+            for name, preset in presets.items():
+                problems = validate_preset(preset)
+                if problems:
+                    errors[name] = problems
+            self._raw = raw
+            self._presets = {name: p for name, p in presets.items() if name not in errors}
+            self.errors = errors
+            self._stamp = stamp
+            return True
+
+    def presets(self):
+        """{名称: 规范化后的预设} (只含校验通过的)"""
+        with self._lock:
+            self.refresh()
+            return dict(self._presets)
+
+    def get(self, name):
+        return self.presets().get(name)
+
+    def raw(self, name):
+        """预设在文件中的原始内容 (流水线保留 steps)，不存在时返回 None"""
+        with self._lock:
+            self.refresh()
+            value = self._raw.get(name)
+            return json.loads(json.dumps(value)) if value is not None else None
+
+    def save(self, name, value):
+        """校验后写入一个预设 (value 为原始格式)；校验失败抛出 ValueError"""
+        with self._lock:
+            for _ in range(3):
+                self.refresh()
+                raw = dict(self._raw)
+                raw[name] = value
+                errors = {}
+                parsed = parse_presets(raw, errors)
+                problems = errors.get(name) or validate_preset(parsed[name])
+                if problems:
+                    raise ValueError("；".join(problems))
+                stamp = self._stamp
+                if self._file_stamp() != stamp:
+                    # 读取之后文件又被外部修改，重新合并
+                    continue
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=".cmd_presets.", suffix=".tmp", dir=os.path.dirname(self.path))
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(raw, f, indent=4, ensure_ascii=False)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    self.remove_tmp(tmp_path)
+                    raise
+                self.refresh()
+                return
+            raise OSError("预设文件正在被其他程序频繁修改，请稍后再保存")
+
+    @staticmethod
+    def remove_tmp(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def path_excluded(path, top, excludes):
+    """path 的名称或相对 top 的路径匹配 excludes 中任一通配符时返回 True"""
+    name = os.path.basename(path)
+    rel = os.path.relpath(path, top).replace(os.sep, "/")
+    return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel, p) for p in excludes)
+
+
+def iter_media_files(paths, recursive=False, exts=SUPPORTED_EXTS, excludes=(), max_depth=None, cancel=None, on_dir=None):
+    """逐个产出 (路径, 字节数)：文件夹用 os.scandir 逐层展开，边扫描边产出。
+
+    目录项的类型与大小直接取自 DirEntry (Windows 上无需额外 stat)，扩展名不符的文件不做任何系统调用。
+    excludes 为通配符，匹配文件/文件夹名或相对所选文件夹的路径即跳过；ALWAYS_EXCLUDE 总是跳过；
+    max_depth 为向下递归的层数 (0 只看所选文件夹本身，None 不限)；cancel 为 threading.Event，置位后尽快停止；
+    on_dir(文件夹) 在展开每个文件夹前调用。
+    """
+    excludes = tuple(excludes or ())
+
+    def excluded(entry, top):
+        return is_partial(entry.name) or (bool(excludes) and path_excluded(entry.path, top, excludes))
+
+    def walk(top):
+        stack = [(top, 0)]
+        while stack:
+            if cancel is not None and cancel.is_set():
+                return
+            folder, depth = stack.pop()
+            if on_dir is not None:
+                on_dir(folder)
+            subdirs = []
+            try:
+                it = os.scandir(folder)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and (max_depth is None or depth < max_depth) and not excluded(entry, top):
+                                subdirs.append(entry.path)
+                        elif entry.name.lower().endswith(exts) and entry.is_file() and not excluded(entry, top):
+                            yield entry.path, entry.stat().st_size
+                    except OSError:
+                        continue
+            # 逆序入栈，保持与 os.walk 相同的先序遍历顺序
+            stack.extend((p, depth + 1) for p in reversed(subdirs))
+
+    for path in paths:
+        if cancel is not None and cancel.is_set():
+            return
+        if os.path.isdir(path):
+            yield from walk(path)
+        elif path.lower().endswith(exts) and not is_partial(os.path.basename(path)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield path, st.st_size
+
+
+def scan_paths(paths, recursive=False, exts=SUPPORTED_EXTS, existing=(), excludes=(), max_depth=None, cancel=None):
+    """逐个产出 paths 中受支持且不在 existing 中的媒体文件路径 (参数含义同 iter_media_files)"""
+    seen = set()
+    for full_p, _ in iter_media_files(paths, recursive, exts, excludes, max_depth, cancel):
+        if full_p not in existing and full_p not in seen:
+            seen.add(full_p)
+            yield full_p
+
+
+# 命令模板中的占位符：{字段} 或 {字段:参数}，参数目前只用于流水线中间文件的后缀 ({output:.wav})
+PLACEHOLDER_RE = re.compile(r"\{(\w+)(?::([^{}\s]*))?\}")
+# 取自媒体信息 (ffprobe) 的字段，模板用到时才探测
+PROBE_FIELDS = ("duration", "v_codec", "a_codec", "width", "height")
+COMMAND_FIELDS = ("input", "output", "name", "ext") + PROBE_FIELDS
+NAMING_FIELDS = ("name", "ext")
+# 未加引号时只能由 shell 解释的符号 (重定向、管道、命令串联等)
+SHELL_OPERATOR_CHARS = "();<>|&"
+PIPE_INPUT = "pipe:0"
+PIPE_OUTPUT = "pipe:1"
+
+
+class TextTemplate:
+    """预先把文本切分为字面量与占位符，渲染时只做拼接；不认识的 {…} 原样保留"""
+
+    __slots__ = ("parts", "fields")
+
+    def __init__(self, text, fields=COMMAND_FIELDS):
+        self.parts = []
+        pos = 0
+        for m in PLACEHOLDER_RE.finditer(text):
+            if m.group(1) not in fields:
+                continue
+            if m.start() > pos:
+                self.parts.append(text[pos:m.start()])
+            self.parts.append((m.group(1), m.group(2)))
+            pos = m.end()
+        if pos < len(text):
+            self.parts.append(text[pos:])
+        self.fields = {p[0] for p in self.parts if isinstance(p, tuple)}
+
+    def render(self, values):
+        return "".join(p if isinstance(p, str) else values.get(p[0], "") for p in self.parts)
+
+    def arg(self, field):
+        """field 占位符的参数 (如 {output:.wav} 的 .wav)，没有时返回 None"""
+        return next((p[1] for p in self.parts if isinstance(p, tuple) and p[0] == field and p[1]), None)
+
+
+def split_args(line):
+    """把一行命令切分为参数列表；Windows 上反斜杠是路径分隔符而不是转义符"""
+    lexer = shlex.shlex(line, posix=True, punctuation_chars=SHELL_OPERATOR_CHARS)
+    lexer.whitespace_split = True
+    if os.name == "nt":
+        lexer.escape = ""
+    return list(lexer)
+
+
+def quote_arg(arg):
+    return subprocess.list2cmdline([arg]) if os.name == "nt" else shlex.quote(arg)
+
+
+class CommandStep:
+    __slots__ = ("line", "argv", "piped")
+
+    def __init__(self, line, argv, piped):
+        self.line = line        # 整行模板 (shell 方式执行及显示用)
+        self.argv = argv        # 各参数的模板；shell 方式时为 None
+        self.piped = piped      # 是否从上一步的标准输出读取
+
+
+class CommandTemplate:
+    """编译后的命令模板：每行一步，各步骤预先切分为参数列表，任务执行时只替换占位符后直接启动进程。
+
+    占位符整体作为一个参数传入，路径中的空格、引号无需转义；
+    模板含有未加引号的重定向、管道等 shell 语法时退回 shell 方式执行 (shell 属性为真)。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.steps = []
+        self.shell = False
+        for line in pipeline_steps(text):
+            piped = line.startswith("|")
+            if piped:
+                line = line[1:].strip()
+            try:
+                tokens = split_args(line)
+            except ValueError:
+                # 引号不配对等，交给 shell 处理
+                tokens = None
+            if not tokens or any(t and not t.strip(SHELL_OPERATOR_CHARS) for t in tokens):
+                self.shell = True
+            self.steps.append(CommandStep(TextTemplate(line), tokens, piped))
+        for step in self.steps:
+            step.argv = None if self.shell else [TextTemplate(t) for t in step.argv]
+        self.fields = set().union(*(step.line.fields for step in self.steps))
+        self.needs_probe = not self.fields.isdisjoint(PROBE_FIELDS)
+
+    def render(self, in_path, out_path, scratch_dir=None, media=None):
+        """返回 RenderedCommand。
+
+        上一步的 {output} 写入 scratch_dir 下的中间文件，作为下一步的 {input}；
+        下一步以 | 开头时两步改用管道连接 (pipe:1 -> pipe:0)，不落盘。media 为 media_fields() 的结果。
+        """
+        name, ext = os.path.splitext(os.path.basename(in_path))
+        values = dict(media or {}, name=name, ext=ext)
+        scratch_dir = scratch_dir or SCRATCH_DIR
+        # 中间文件名由输出路径决定：并发任务互不冲突，同一任务每次渲染结果一致 (增量清单据此比较命令)
+        stem, final_ext = os.path.splitext(os.path.basename(out_path))
+        token = hashlib.md5(out_path.encode("utf-8")).hexdigest()[:8]
+        steps = []
+        scratch_files = []
+        current = in_path
+        for k, step in enumerate(self.steps):
+            if step.piped:
+                current = PIPE_INPUT
+            if k == len(self.steps) - 1:
+                target = out_path
+            elif self.steps[k + 1].piped:
+                target = PIPE_OUTPUT
+            else:
+                target = os.path.join(scratch_dir, f"{stem}.{token}.step{k + 1}{step.line.arg('output') or final_ext}")
+                scratch_files.append(target)
+            values["input"], values["output"] = current, target
+            if self.shell:
+                quoted = {key: v if v in (PIPE_INPUT, PIPE_OUTPUT) else f'"{v}"' if key in ("input", "output") else v
+                          for key, v in values.items()}
+                steps.append((step.line.render(quoted), step.piped))
+            else:
+                steps.append(([arg.render(values) for arg in step.argv], step.piped))
+            current = target
+        return RenderedCommand(steps, scratch_files, self.shell)
+
+
+class RenderedCommand:
+    """一个任务的具体命令：steps 为 [(参数列表或 shell 命令行, 是否接上一步管道)]"""
+
+    __slots__ = ("steps", "scratch_files", "shell", "text")
+
+    def __init__(self, steps, scratch_files, shell):
+        self.steps = steps
+        self.scratch_files = scratch_files
+        self.shell = shell
+        # 等价的单条 shell 命令，用于日志、增量清单与分布式执行端
+        self.text = ""
+        for k, (cmd, piped) in enumerate(steps):
+            line = cmd if shell else " ".join(quote_arg(a) for a in cmd)
+            self.text += line if k == 0 else (" | " if piped else " && ") + line
+
+    def groups(self):
+        """按 && 切分的各组步骤，组内各步骤由管道相连"""
+        groups = []
+        for cmd, piped in self.steps:
+            if piped and groups:
+                groups[-1].append(cmd)
+            else:
+                groups.append([cmd])
+        return groups
+
+
+_templates_lock = threading.Lock()
+_templates = {}
+
+
+def compile_template(text, fields=None):
+    """编译并缓存模板：fields 为 None 时编译为 CommandTemplate，否则为只含这些字段的 TextTemplate"""
+    key = (text, fields)
+    with _templates_lock:
+        tpl = _templates.get(key)
+        if tpl is None:
+            tpl = _templates[key] = CommandTemplate(text) if fields is None else TextTemplate(text, fields)
+        return tpl
+
+
+def media_fields(data):
+    """从 ffprobe 数据中取出命令模板可用的媒体字段"""
+    values = dict.fromkeys(PROBE_FIELDS, "")
+    duration = media_numbers(data)[0] if data else None
+    if duration is not None:
+        values["duration"] = f"{duration:.3f}"
+    for s in (data or {}).get("streams", []):
+        if s.get("codec_type") == "video" and not values["v_codec"]:
+            values["v_codec"] = s.get("codec_name", "")
+            values["width"], values["height"] = str(s.get("width", "")), str(s.get("height", ""))
+        elif s.get("codec_type") == "audio" and not values["a_codec"]:
+            values["a_codec"] = s.get("codec_name", "")
+    return values
+
+
+def output_path_for(in_path, naming_rule, output_dir, use_own_dir=True):
+    """按命名规则生成输出文件的完整路径"""
+    name_only, ext = os.path.splitext(os.path.basename(in_path))
+    out_fname = compile_template(naming_rule, NAMING_FIELDS).render({"name": name_only, "ext": ext})
+    out_dir = os.path.dirname(in_path) if use_own_dir else output_dir
+    return os.path.join(out_dir, out_fname)
+
+
+def output_glob(naming_rule):
+    """命名规则对应的通配符，用于在输入目录中认出本工具的输出；规则无法区分输出时返回 None"""
+    pattern = naming_rule.replace("{name}", "*").replace("{ext}", ".*")
+    return None if pattern.strip("*.") == "" else pattern
+
+
+def pipeline_steps(cmd_tpl):
+    """命令模版的各步骤 (每个非空行一步)；单行模版即只有一步"""
+    return [line.strip() for line in cmd_tpl.splitlines() if line.strip()]
+
+
+def render_command(cmd_tpl, in_path, out_path, scratch_dir=None, media=None):
+    """渲染为等价的单条 shell 命令"""
+    return compile_template(cmd_tpl).render(in_path, out_path, scratch_dir, media).text
+
+
+def split_seconds(duration):
+    """将 timedelta 拆分为 (时, 分, 秒)"""
+    total_seconds = int(duration.total_seconds())
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return hours, minutes, seconds
+
+
+class Prober:
+    """媒体信息探测：文件未变化时直接读取持久化缓存，否则调用 ffprobe"""
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def probe_media(self, file_path):
+        """获取原始 ffprobe 数据"""
+        file_path = os.path.abspath(file_path)
+        st = os.stat(file_path)
+        if self.cache:
+            data = self.cache.get(file_path, st)
+            if data is not None:
+                return data
+        data = run_ffprobe(file_path)
+        if data is not None and self.cache:
+            self.cache.put(file_path, st, data)
+        return data
+
+    def probe_entry(self, file_path):
+        """返回 (列表显示用的媒体信息, 时长秒数, 文件字节数)"""
+        try:
+            data = self.probe_media(file_path)
+            f = data.get('format', {})
+            streams = data.get('streams', [])
+            size = f"{int(f.get('size', 0)) / (1024*1024):.2f} MB"
+            dur = format_seconds(float(f.get('duration', 0)))
+            v_codec, v_br, a_codec, a_br = "N/A", "N/A", "N/A", "N/A"
+            for s in streams:
+                br = f"{int(s.get('bit_rate', 0)) // 1000}k" if s.get('bit_rate') else "N/A"
+                if s.get('codec_type') == 'video':
+                    v_codec, v_br = s.get('codec_name', 'unknown'), br
+                elif s.get('codec_type') == 'audio':
+                    a_codec, a_br = s.get('codec_name', 'unknown'), br
+            return (size, dur, v_codec, v_br, a_codec, a_br), *media_numbers(data)
+        except:
+            return ("Error", "N/A", "N/A", "N/A", "N/A", "N/A"), None, None
+
+
+class BatchLogFile:
+    """输出目录下的 batch_cmd.log，每行带时间戳，通过后台 LogWriter 写入"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, out_dir, content, first_time=False):
+        if not out_dir:
+            return
+        log_file = os.path.join(out_dir, "batch_cmd.log")
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if first_time or self.writer.path != log_file:
+            self.writer.open(log_file, truncate=first_time)
+        if first_time:
+            self.writer.write(f"[{timestamp}] {content}")
+        else:
+            self.writer.write(f"\n[{timestamp}] {content}")
+
+
+class PerfReport:
+    """逐个任务记录资源用量与效率指标，批次结束时汇总，并可按预设导出 CSV / JSON 便于横向比较"""
+
+    FIELDS = ("file", "status", "slot", "wall", "cpu_user", "cpu_sys", "max_rss", "io_read", "io_write",
+              "disk_read", "disk_write", "in_size", "out_size", "size_ratio", "media_duration", "realtime")
+    CSV_FILE = "batch_perf.csv"
+    JSON_FILE = "batch_perf.json"
+
+    def __init__(self):
+        self.rows = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def job_row(in_path, out_path, status, slot, wall, media_duration, usage):
+        """单个任务的一行指标；out_path 为 None 表示没有产出"""
+        row = dict.fromkeys(PerfReport.FIELDS)
+        row.update(usage or {})
+        for key in ("cpu_user", "cpu_sys"):
+            if row[key] is not None:
+                row[key] = round(row[key], 3)
+        row.update(file=in_path, status=status, slot=slot, wall=round(wall, 3), media_duration=media_duration)
+        try:
+            row["in_size"] = os.path.getsize(in_path)
+            if out_path:
+                row["out_size"] = os.path.getsize(out_path)
+                row["size_ratio"] = round(row["out_size"] / row["in_size"], 4) if row["in_size"] else None
+        except OSError:
+            pass
+        if media_duration and wall > 0:
+            row["realtime"] = round(media_duration / wall, 3)
+        return row
+
+    def add(self, row):
+        with self._lock:
+            self.rows.append(row)
+
+    def summary(self):
+        """成功任务的汇总；没有成功任务时返回 None"""
+        with self._lock:
+            rows = [r for r in self.rows if r["status"] == "processed"]
+        if not rows:
+            return None
+
+        def total(key):
+            return sum(r[key] or 0 for r in rows)
+
+        wall, media = total("wall"), total("media_duration")
+        cpu_user, cpu_sys = total("cpu_user"), total("cpu_sys")
+        in_size, out_size = total("in_size"), total("out_size")
+        return {
+            "jobs": len(rows), "wall": round(wall, 3),
+            "cpu_user": round(cpu_user, 3), "cpu_sys": round(cpu_sys, 3),
+            "cpu_util": round((cpu_user + cpu_sys) / wall, 3) if wall else None,
+            "max_rss": max(r["max_rss"] or 0 for r in rows),
+            "io_read": total("io_read"), "io_write": total("io_write"),
+            "disk_read": total("disk_read"), "disk_write": total("disk_write"),
+            "in_size": in_size, "out_size": out_size,
+            "size_ratio": round(out_size / in_size, 4) if in_size else None,
+            "media_duration": round(media, 3), "realtime": round(media / wall, 3) if media and wall else None,
+        }
+
+    def export(self, out_dir, batch, preset, slots, cmd):
+        """任务明细追加到 CSV，批次汇总按预设归档到 JSON"""
+        info = {"batch": batch, "preset": preset or "", "slots": slots}
+        csv_path = os.path.join(out_dir, self.CSV_FILE)
+        new_file = not os.path.exists(csv_path)
+        with self._lock:
+            rows = list(self.rows)
+        with open(csv_path, "a", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=tuple(info) + self.FIELDS)
+            if new_file:
+                writer.writeheader()
+            for row in rows:
+                writer.writerow(dict(row, **info))
+
+        summary = self.summary()
+        if summary is None:
+            return
+        json_path = os.path.join(out_dir, self.JSON_FILE)
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            report = {}
+        report.setdefault(preset or cmd, []).append(dict(summary, batch=batch, slots=slots))
+        tmp_path = json_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, json_path)
+
+    @classmethod
+    def history_ratio(cls, out_dir, key):
+        """batch_perf.json 中同一预设 (或命令) 以往批次的输出/输入体积比，没有记录时返回 None"""
+        try:
+            with open(os.path.join(out_dir, cls.JSON_FILE), "r", encoding="utf-8") as f:
+                batches = json.load(f).get(key) or []
+        except (OSError, ValueError, AttributeError):
+            return None
+        in_size = sum(b.get("in_size") or 0 for b in batches)
+        out_size = sum(b.get("out_size") or 0 for b in batches)
+        return out_size / in_size if in_size and out_size else None
+
+
+class DiskGuard:
+    """输出磁盘的空间与写入带宽守卫。
+
+    任务开始前按 输入大小 × 输出/输入体积比 估算输出大小 (体积比取本批已完成任务的实测值，没有时取以往批次的记录)，
+    输出所在磁盘的剩余空间扣除运行中任务预计还要写入的量后低于 min_free 时，暂缓启动任务直到空间足够；
+    max_write 不为 0 时统计各任务输出文件的增长速度，超过上限就短暂暂停全部子进程 (仅限 POSIX)。
+    """
+
+    POLL_SECONDS = 2.0
+    THROTTLE_SECONDS = 0.5
+    # 没有任何参考时按输出与输入一样大估算
+    DEFAULT_RATIO = 1.0
+
+    def __init__(self, min_free=DISK_MIN_FREE, max_write=0, ratio=None):
+        self.min_free = min_free
+        self.max_write = max_write
+        self.prior_ratio = ratio
+        self.in_total = 0
+        self.out_total = 0
+        self.active = {}        # 任务 key -> [输出路径, 预计字节数, 设备号, 完成比例函数]
+        self._version = 0       # active 每次变化递增，用于发现锁外计算期间的变化
+        self._cond = threading.Condition()
+
+    def ratio(self):
+        if self.in_total and self.out_total:
+            return self.out_total / self.in_total
+        return self.prior_ratio or self.DEFAULT_RATIO
+
+    def estimate(self, in_size):
+        return int((in_size or 0) * self.ratio())
+
+    @staticmethod
+    def written(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def outstanding(self, device, entries):
+        """entries (active 的快照) 中位于 device 上的任务预计还要写入的字节数；已写出一部分的任务按进度外推"""
+        total = 0
+        for path, estimate, dev, fraction in entries:
+            if dev != device:
+                continue
+            written = self.written(path)
+            done = fraction()
+            if done and done > 0.05:
+                estimate = max(estimate, written / done)
+            total += max(estimate - written, 0)
+        return total
+
+    def acquire(self, key, out_path, need, fraction, is_running, on_wait):
+        """阻塞直到输出磁盘的空间足够写入 need 字节，返回 True；等待中 is_running() 为假时返回 False；
+        没有其他运行中的任务 (不会再有空间释放出来) 而空间仍不够时返回 None。
+
+        第一次需要等待时调用 on_wait(need, 可用字节数)。查询磁盘与回调都在锁外进行。
+        """
+        folder = os.path.dirname(os.path.abspath(out_path))
+        waited = False
+        while is_running():
+            with self._cond:
+                entries = list(self.active.values())
+                version = self._version
+            try:
+                device = os.stat(folder).st_dev
+                available = shutil.disk_usage(folder).free - self.outstanding(device, entries)
+            except OSError:
+                # 输出目录还不存在等情况交给任务本身报错
+                device, available = None, need + self.min_free
+            with self._cond:
+                if version != self._version:
+                    # 计算期间有任务登记或结束，重新计算
+                    continue
+                if available - need >= self.min_free:
+                    self.active[key] = [out_path, need, device, fraction]
+                    self._version += 1
+                    return True
+                if not self.active:
+                    return None
+            if not waited:
+                waited = True
+                on_wait(need, max(available, 0))
+            with self._cond:
+                if version == self._version:
+                    self._cond.wait(self.POLL_SECONDS)
+        return False
+
+    def release(self, key, in_size=None, out_size=None):
+        """任务结束；成功任务的实际体积计入体积比"""
+        with self._cond:
+            if self.active.pop(key, None) is not None:
+                self._version += 1
+            if in_size and out_size:
+                self.in_total += in_size
+                self.out_total += out_size
+            self._cond.notify_all()
+
+    def throttle(self, processes, is_running):
+        """写入限速循环 (在独立线程中运行)：processes() 返回当前全部子进程"""
+        sizes = {}
+        debt = 0.0
+        while is_running():
+            time.sleep(self.THROTTLE_SECONDS)
+            with self._cond:
+                paths = {key: entry[0] for key, entry in self.active.items()}
+            grown = 0
+            current = {}
+            for key, path in paths.items():
+                current[key] = self.written(path)
+                grown += max(current[key] - sizes.get(key, current[key]), 0)
+            sizes = current
+            # 超出配额的字节数累积起来，攒够后按上限折算暂停时长
+            debt = max(debt + grown - self.max_write * self.THROTTLE_SECONDS, 0.0)
+            pause = debt / self.max_write
+            if pause < self.THROTTLE_SECONDS:
+                continue
+            procs = processes()
+            signal_processes(procs, signal.SIGSTOP)
+            try:
+                time.sleep(min(pause, 5.0))
+            finally:
+                signal_processes(procs, signal.SIGCONT)
+            debt = 0.0
+
+
+class RetryPolicy:
+    """失败任务的重试策略：按输出把失败归为 resource (资源耗尽)、transient (临时故障) 或 permanent (永久失败)，
+    前两类在 attempts 次以内按指数退避重新排队。patterns 为 {类别: [正则]}，优先于内置规则匹配。
+    """
+
+    CLASSES = ("resource", "transient", "permanent")
+    LABELS = {"resource": "资源不足", "transient": "临时故障", "permanent": "永久失败"}
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF, max_backoff=RETRY_MAX_BACKOFF, patterns=None):
+        self.attempts = max(1, int(attempts))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        patterns = patterns or {}
+        self.patterns = []
+        for cls in self.CLASSES:
+            rules = list(patterns.get(cls) or []) + FAILURE_PATTERNS[cls]
+            self.patterns.append((cls, re.compile("|".join(f"(?:{r})" for r in rules), re.IGNORECASE)))
+
+    @classmethod
+    def from_dict(cls, data):
+        """预设中的 retry 配置，忽略不认识的键"""
+        data = data or {}
+        return cls(**{k: data[k] for k in ("attempts", "backoff", "max_backoff", "patterns") if k in data})
+
+    def classify(self, lines, returncode=None):
+        """根据输出的最后若干行判断失败类别；被信号杀死 (如系统内存不足) 视为资源耗尽"""
+        text = "\n".join(lines)
+        for cls, regex in self.patterns:
+            if regex.search(text):
+                return cls
+        if returncode is not None and returncode < 0:
+            return "resource"
+        return "permanent"
+
+    def delay(self, failures):
+        """第 failures 次失败后的退避秒数"""
+        return min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+
+
+class BatchSettings:
+    """一次批处理的全部设置，与界面控件无关，可随续跑日志一起保存"""
+
+    FIELDS = ("cmd", "output_dir", "use_own_dir", "naming_rule", "overwrite",
+              "slots", "resource", "class_limits", "job_log", "order", "hash_sample", "scratch_dir",
+              "preset", "perf_report", "auto_slots", "encoding", "split", "min_free", "max_write",
+              "retry", "rerun_failed")
+
+    def __init__(self, cmd, output_dir="", use_own_dir=True, naming_rule="{name}_done{ext}",
+                 overwrite="skip", slots=None, resource=None, class_limits=None, job_log=False, order="list",
+                 hash_sample=False, scratch_dir=None, preset=None, perf_report=False, auto_slots=False,
+                 encoding="auto", split=0, min_free=DISK_MIN_FREE, max_write=0, retry=None, rerun_failed=False):
+        self.cmd = cmd
+        self.output_dir = output_dir
+        self.use_own_dir = use_own_dir
+        self.naming_rule = naming_rule
+        self.overwrite = overwrite
+        self.slots = max(1, int(slots or os.cpu_count() or 1))
+        self.resource = resource or guess_resource(cmd)
+        self.class_limits = dict(class_limits) if class_limits is not None else dict(DEFAULT_CLASS_LIMITS)
+        self.job_log = job_log
+        self.order = order
+        self.hash_sample = hash_sample  # 增量模式下是否用抽样哈希判断输入变化
+        self.scratch_dir = scratch_dir or SCRATCH_DIR
+        self.preset = preset            # 预设名称，仅用于性能报告归类
+        self.perf_report = perf_report  # 是否导出 batch_perf.csv / batch_perf.json
+        self.auto_slots = auto_slots    # 自动并发：以 slots 为起点按系统负载增减
+        self.encoding = encoding or "auto"  # 子进程输出的编码，auto 为自动识别
+        # 长文件切成几段并行处理 (0 不分段，True 按并发数分段)
+        self.split = self.slots if split is True else int(split or 0)
+        self.min_free = int(min_free or 0)  # 输出磁盘至少保留的字节数
+        self.max_write = int(max_write or 0)  # 全部任务合计的写入上限 (字节/秒)，0 不限
+        self.retry = dict(retry or {})  # 重试策略 (RetryPolicy 的参数)，为空时使用默认策略
+        self.rerun_failed = rerun_failed    # 整批结束后把失败的任务再集中跑一轮
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.FIELDS if name in data})
+
+    def resolve_output_dir(self, files):
+        """未指定输出目录时使用第一个文件所在的目录"""
+        if not self.output_dir and files:
+            self.output_dir = os.path.dirname(files[0])
+        return self.output_dir
+
+
+class SplitJob:
+    """分段并行处理中的一个文件：切分、各段任务与拼接共享的状态，由 lock 保护"""
+
+    def __init__(self, i, in_path, full_out, tmp_out, build_key, media_duration, start_time, tag):
+        self.i = i
+        self.in_path = in_path
+        self.full_out = full_out
+        self.tmp_out = tmp_out
+        self.build_key = build_key
+        self.media_duration = media_duration
+        self.start_time = start_time
+        self.tag = tag
+        # 分段文件放在输出旁的 .partial 文件夹中 (体积与输入相当，不放内存盘；匹配 ALWAYS_EXCLUDE，扫描与监视都会忽略它)
+        self.work_dir = tmp_out + ".split"
+        self.segments = []
+        self.lengths = []       # 各段时长 (秒)
+        self.outputs = []       # 各段的处理结果，失败为 None
+        self.positions = []     # 各段已处理的媒体秒数
+        self.remaining = 0
+        self.failed = False
+        self.usage = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def duration_matches(self, out_duration):
+        """拼接后的时长与输入是否一致 (允许关键帧对齐带来的少量误差)；时长未知视为不一致"""
+        tolerance = max(SPLIT_TOLERANCE_SECONDS, self.media_duration * SPLIT_TOLERANCE_RATIO)
+        return out_duration is not None and abs(out_duration - self.media_duration) <= tolerance
+
+
+class BatchRunner:
+    """批处理执行引擎：按设置并发执行全部任务，通过回调输出日志与进度。
+
+    log(message, level, slot) 接收日志；status(done, total, fraction, eta) 接收整批进度。
+    """
+
+    # 进程启动以来各批次累计的任务数，不随新批次清零，供监控接口作为计数器导出
+    totals = {"processed": 0, "failed": 0, "skipped": 0, "retried": 0}
+    totals_lock = threading.Lock()
+
+    # ffmpeg -progress 输出的 key=value 行 (只认 ffmpeg 的键，其他工具形如 a=b 的输出照常显示)
+    PROGRESS_KEY_RE = re.compile(
+        r"^(?:frame|fps|bitrate|total_size|out_time_us|out_time_ms|out_time|dup_frames|drop_frames|speed|progress"
+        r"|stream_\w+)=\S*\s*$"
+    )
+
+    def __init__(self, settings, prober=None, log=None, status=None, job_log_writer=None, remote=None, manifest=None,
+                 journal_dir=JOURNAL_DIR):
+        self.settings = settings
+        self.manifest = manifest        # 增量处理清单 (BuildManifest)，为 None 时不记录
+        self.journal_dir = journal_dir  # 续跑日志目录，为 None 时不写续跑日志
+        self.remote = remote            # 分布式执行时的任务服务器 (batch_remote.JobServer)
+        self.prober = prober or Prober()
+        self.log = log or (lambda message, level="命令", slot=None: None)
+        self.status = status or (lambda done, total, fraction=None, eta=None: None)
+        self.job_log_writer = job_log_writer
+        self.is_running = False
+        self.scheduler = None
+        self.running_processes = {}     # 槽位 -> 正在运行的子进程列表 (管道相连的多个进程)
+        self.proc_lock = threading.Lock()
+        self.stats = {}
+        self.slot_progress = {}         # 槽位 -> (显示名称, FfmpegProgress, 开始时刻)，供 metrics() 读取
+
+    def stop(self):
+        """停止派发新任务，并结束所有正在运行的子进程"""
+        self.is_running = False
+        if self.scheduler:
+            self.scheduler.stop()
+        for proc in self.local_processes():
+            kill_process_tree(proc)
+        if self.remote:
+            self.remote.cancel_all()
+
+    def run(self, files, durations=None, sizes=None, codecs=None, journal=None, watcher=None):
+        """阻塞执行整批任务，返回统计数据。
+
+        durations/sizes/codecs 与 files 一一对应，用于排序和进度估算；续跑时传入原日志。
+        watcher (batch_watch.FolderWatcher) 不为空时为监视模式：持续把新到达的文件送入队列，直到 stop()。
+        """
+        s = self.settings
+        files = list(files)
+        self.files = files
+        self.files_total = files_total = len(files)
+        self.durations = list(durations) if durations else [None] * files_total
+        self.stats = {"done": 0, "processed": 0, "failed": 0, "skipped": 0, "retried": 0, "job_time": timedelta(0)}
+        if not files and watcher is None:
+            return self.stats
+        self.is_running = True
+        s.resolve_output_dir(files or [os.path.join(watcher.folder, "")])
+
+        # 续跑时沿用日志中的原顺序
+        strategy = "list" if journal else s.order
+        order = order_jobs(range(files_total), strategy, self.durations, sizes or [None] * files_total, codecs)
+
+        # 续跑日志：记录每个任务的状态，崩溃或终止后可从中断处继续
+        # 监视模式没有确定的文件清单，不写续跑日志；重启后由覆盖策略跳过已处理的文件
+        try:
+            if journal is None and watcher is None and self.journal_dir:
+                journal = BatchJournal.create(s.to_dict(), [files[i] for i in order], self.journal_dir)
+        except OSError as e:
+            self.log(f"无法创建续跑日志：{e}", "错误")
+            journal = None
+        self.journal = journal
+
+        # JSONL 任务日志跨批次追加，供统计面板直接读取
+        if s.job_log and self.job_log_writer:
+            self.job_log_writer.open(os.path.join(s.output_dir, "batch_jobs.jsonl"))
+        self.batch_id = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.log(f"启动命令：\n {s.cmd}", "信息")
+        limit = s.class_limits.get(s.resource)
+        auto = s.auto_slots and not self.remote and SystemLoad.available()
+        if s.auto_slots and not auto:
+            self.log("自动并发需要读取本机 /proc，当前环境 (或分布式执行) 不可用，改用固定并发", "错误")
+        if s.split and self.remote:
+            self.log("分布式执行时不支持分段并行，按整个文件处理", "错误")
+        max_slots = max(s.slots, AUTO_SLOTS_FACTOR * (os.cpu_count() or 1)) if auto else s.slots
+        self.log(f"并发任务数：{min(s.slots, limit) if limit else s.slots}" + (f" (自动调节，最多 {max_slots})" if auto else "")
+                 + f"（资源类别 {s.resource}" + (f"，上限 {limit}）" if limit else "）"), "信息")
+        self.log("-------------------------------------", "信息")
+
+        # 各槽位共享的统计数据，由 stats_lock 保护
+        self.stats_lock = threading.Lock()
+        self.perf = PerfReport()
+        self.splits = set()             # 正在分段处理的文件 (SplitJob)
+        self.policy = RetryPolicy.from_dict(s.retry)
+        self.attempts = {}              # 任务 (或分段) -> 已失败次数
+        self.failed_jobs = []           # 最终失败的任务，供整批结束后重跑
+        self.disk = DiskGuard(s.min_free, s.max_write, PerfReport.history_ratio(s.output_dir, s.preset or s.cmd))
+        self.preflight_disk(files, sizes)
+        batch_start = datetime.now()
+        # 按媒体时长加权的整批进度
+        self.progress = BatchProgress(enumerate(self.durations))
+        self._last_status = 0.0
+        self.status(0, files_total)
+
+        resource = s.resource
+        self.scheduler = JobScheduler(max_slots, self.run_job, s.class_limits, lambda job: resource)
+        controller = None
+        if auto:
+            self.scheduler.limit = s.slots
+            controller = AdaptiveConcurrency(self.scheduler, self, self.log)
+            controller.start()
+        if watcher is not None:
+            self.start_watch(watcher)
+        throttle_done = threading.Event()
+        if s.max_write and not self.remote:
+            if hasattr(signal, "SIGSTOP"):
+                threading.Thread(target=self.disk.throttle, daemon=True, name="write-throttle",
+                                 args=(self.local_processes, lambda: self.is_running and not throttle_done.is_set())).start()
+            else:
+                self.log("写入限速需要暂停子进程，当前系统不支持，已忽略", "错误")
+        self.scheduler.run([(i, files[i]) for i in order], follow=watcher is not None)
+        if s.rerun_failed and self.is_running and self.failed_jobs:
+            self.rerun_failed()
+        throttle_done.set()
+        if controller:
+            controller.stop()
+        # 终止时尚未拼接的分段文件
+        for split in list(self.splits):
+            shutil.rmtree(split.work_dir, ignore_errors=True)
+            self.remove_partial(split.tmp_out)
+        if journal:
+            journal.close(complete=self.is_running)
+
+        if self.is_running:
+            self.log("", "结果")
+            self.log("✨ 所有批处理任务已顺利结束", "结果")
+
+        # 显示处理结果：实际耗时为整批的墙钟时间，累计耗时为各任务耗时之和
+        stats = self.stats
+        stats["wall_time"] = wall_time = datetime.now() - batch_start
+        hours, minutes, seconds = split_seconds(wall_time)
+        job_h, job_m, job_s = split_seconds(stats["job_time"])
+        speedup = stats["job_time"].total_seconds() / max(wall_time.total_seconds(), 1e-6)
+
+        self.log("========= 处理总结 =========", "结果")
+        self.log(f"文件总数：{self.files_total}", "结果")
+        self.log(f"成功完成：{stats['processed']}", "结果")
+        self.log(f"  已跳过：{stats['skipped']}", "结果")
+        self.log(f"处理失败：{stats['failed']}", "结果")
+        if stats["retried"]:
+            self.log(f"  已重试：{stats['retried']} 次", "结果")
+        self.log(f"实际耗时：{hours} 小时 {minutes} 分钟 {seconds} 秒", "结果")
+        self.log(f"累计耗时：{job_h} 小时 {job_m} 分钟 {job_s} 秒 (并行加速 {speedup:.2f}x)", "结果")
+        if controller and controller.history:
+            rates = [h[2] for h in controller.history]
+            stats["slots_final"] = controller.history[-1][1]
+            self.log(f"自动并发：最终 {stats['slots_final']} 个槽位，平均吞吐 {sum(rates) / len(rates):.1f} 任务/分", "结果")
+        perf = stats["perf"] = self.perf.summary()
+        if perf:
+            mb = 1024 * 1024
+            self.log(f"CPU 时间：用户 {perf['cpu_user']:.1f} 秒，系统 {perf['cpu_sys']:.1f} 秒"
+                     + (f" (平均占用 {perf['cpu_util']:.2f} 核)" if perf['cpu_util'] is not None else ""), "结果")
+            self.log(f"峰值内存：{perf['max_rss'] / mb:.1f} MB，读取 {perf['io_read'] / mb:.1f} MB，写入 {perf['io_write'] / mb:.1f} MB", "结果")
+            if perf["size_ratio"] is not None:
+                self.log(f"  体积比：{perf['size_ratio']:.3f} ({perf['in_size'] / mb:.1f} MB → {perf['out_size'] / mb:.1f} MB)", "结果")
+            if perf["realtime"] is not None:
+                self.log(f"实时倍率：{perf['realtime']:.2f}x (媒体时长 ÷ 任务耗时)", "结果")
+        self.log("==========================", "结果")
+        if s.perf_report:
+            try:
+                self.perf.export(s.output_dir, self.batch_id, s.preset, s.slots, s.cmd)
+            except OSError as e:
+                self.log(f"无法导出性能报告：{e}", "错误")
+        if s.job_log and self.job_log_writer:
+            self.job_log_writer.flush()
+        stats["interrupted"] = not self.is_running
+        self.scheduler = None
+        return stats
+
+    # --- 磁盘空间 ---
+    def preflight_disk(self, files, sizes):
+        """开始前估算整批输出大小，与输出磁盘的剩余空间比较"""
+        s = self.settings
+        try:
+            free = shutil.disk_usage(s.output_dir or ".").free
+        except OSError:
+            return
+        in_total = sum(size if size is not None else DiskGuard.written(path)
+                       for path, size in zip(files, sizes or [None] * len(files)))
+        need = self.disk.estimate(in_total)
+        gb = 1024 ** 3
+        self.log(f"预计输出约 {need / gb:.2f} GB (体积比 {self.disk.ratio():.2f})，输出磁盘可用 {free / gb:.2f} GB", "信息")
+        if need > free - s.min_free:
+            self.log(f"输出磁盘空间可能不足 (保留 {s.min_free / gb:.1f} GB)，空间不够时任务会暂停等待", "错误")
+
+    def reserve_disk(self, i, in_path, tmp_out, split, slot, tag):
+        """等待输出磁盘空间足够后登记该任务；等待中被终止返回 False，空间不可能足够时返回 None (见 DiskGuard.acquire)"""
+        s = self.settings
+        in_size = DiskGuard.written(in_path)
+        need = self.disk.estimate(in_size)
+        if split:
+            # 分段文件、各段输出与拼接结果会同时存在
+            need = in_size + 2 * need
+
+        def on_wait(need, available):
+            gb = 1024 ** 3
+            self.log(f"{tag}等待磁盘空间：预计输出 {need / gb:.2f} GB，可用 {available / gb:.2f} GB (保留 {s.min_free / gb:.1f} GB)",
+                     "错误", slot)
+
+        return self.disk.acquire(i, tmp_out, need, lambda: self.progress.fraction(i), lambda: self.is_running, on_wait)
+
+    def local_processes(self):
+        with self.proc_lock:
+            return [proc for group in self.running_processes.values() for proc in group]
+
+    # --- 运行指标 ---
+    def metrics(self):
+        """当前的运行指标 (直接读取现有计数，不额外采集)，供监控接口与界面的槽位面板使用"""
+        stats = dict(self.stats)
+        scheduler = self.scheduler
+        queued, delayed, assigned = scheduler.snapshot() if scheduler else (0, 0, {})
+        progress = getattr(self, "progress", None)
+        fraction, eta = progress.snapshot() if progress and scheduler else (None, None)
+        now = time.monotonic()
+        slots = []
+        for slot, job in sorted(assigned.items()):
+            name, parser, started = self.slot_progress.get(slot) or (os.path.basename(job[1]), None, None)
+            slots.append({
+                "slot": slot, "file": name,
+                "elapsed": round(now - started, 1) if started else None,
+                "percent": parser.percent() if parser else None,
+                "out_time": parser.out_time if parser else None,
+                "fps": parser.fps if parser else None,
+                "speed": parser.speed if parser else None,
+                "eta": parser.eta() if parser else None,
+            })
+        metrics = {
+            "running": bool(scheduler and self.is_running),
+            "files_total": getattr(self, "files_total", 0),
+            "done": stats.get("done", 0),
+            "processed": stats.get("processed", 0),
+            "failed": stats.get("failed", 0),
+            "skipped": stats.get("skipped", 0),
+            "retried": stats.get("retried", 0),
+            "queued": queued,
+            "retry_waiting": delayed,
+            "active": len(assigned),
+            "slot_limit": scheduler.limit if scheduler else 0,
+            "progress": fraction,
+            "eta": eta,
+            "media_rate": progress.rate() if progress and scheduler else None,
+            "slots": slots,
+        }
+        with self.totals_lock:
+            metrics["totals"] = dict(self.totals)
+        if self.remote:
+            metrics["hosts"] = self.remote.host_stats()
+        return metrics
+
+    # --- 监视模式 ---
+    def start_watch(self, watcher):
+        s = self.settings
+        self.outputs = set()
+        for in_path in self.files:
+            full_out = output_path_for(in_path, s.naming_rule, s.output_dir, s.use_own_dir)
+            self.outputs.update((full_out, partial_name(full_out)))
+        # 输出写回监视目录时，按命名规则排除以前生成的输出，避免反复处理
+        out_dir = os.path.abspath(s.output_dir)
+        pattern = output_glob(s.naming_rule)
+        if pattern and (s.use_own_dir or (out_dir + os.sep).startswith(os.path.join(os.path.abspath(watcher.folder), ""))):
+            watcher.excludes += (pattern,)
+        self.log(f"正在监视文件夹：{watcher.folder}（{watcher.mode}，文件 {watcher.stable_seconds} 秒无变化后处理）", "信息")
+
+        def feed():
+            try:
+                for in_path in watcher.watch(lambda: self.is_running):
+                    self.add_job(in_path)
+            except OSError as e:
+                self.log(f"监视文件夹失败：{e}", "错误")
+                self.stop()
+
+        threading.Thread(target=feed, daemon=True, name="watch-feed").start()
+
+    def add_job(self, in_path):
+        """监视模式：把新到达的文件追加到运行中的队列，本工具自己的输出返回 False"""
+        s = self.settings
+        full_out = output_path_for(in_path, s.naming_rule, s.output_dir, s.use_own_dir)
+        with self.stats_lock:
+            if in_path in self.outputs:
+                return False
+            self.outputs.update((full_out, partial_name(full_out)))
+            i = len(self.files)
+            self.files.append(in_path)
+            self.durations.append(None)
+            self.files_total += 1
+        self.progress.set_duration(i, None)
+        self.log(f"发现新文件：【{os.path.basename(in_path)}】", "信息")
+        self.scheduler.submit((i, in_path))
+        self.show_progress(force=True)
+        return True
+
+    # --- 单个任务 ---
+    def show_progress(self, force=False):
+        # 进度事件很密集，状态栏最多每 0.5 秒刷新一次
+        now = time.monotonic()
+        if not force and now - self._last_status < 0.5:
+            return
+        self._last_status = now
+        fraction, eta = self.progress.snapshot()
+        self.status(self.stats["done"], self.files_total, fraction, eta)
+
+    def finish(self, key, result, duration=None):
+        self.progress.finish(key, processed=(result == "processed"))
+        with self.stats_lock:
+            self.stats[result] += 1
+            self.stats["done"] += 1
+            if duration is not None:
+                self.stats["job_time"] += duration
+        with self.totals_lock:
+            self.totals[result] += 1
+        self.show_progress(force=True)
+
+    def record(self, in_path, command, status, start_time=None, end_time=None, returncode=None, slot=None, perf=None):
+        """写入一条机器可读的任务记录"""
+        if not (self.settings.job_log and self.job_log_writer):
+            return
+        self.job_log_writer.write_json({
+            "batch": self.batch_id, "file": in_path, "command": command, "status": status, "slot": slot,
+            "start": start_time.isoformat(timespec="seconds") if start_time else None,
+            "end": end_time.isoformat(timespec="seconds") if end_time else None,
+            "returncode": returncode,
+            "duration": round((end_time - start_time).total_seconds(), 3) if start_time and end_time else None,
+            "perf": perf,
+        })
+
+    def mark(self, in_path, state, **extra):
+        if self.journal:
+            try:
+                self.journal.mark(in_path, state, **extra)
+            except OSError:
+                pass
+
+    def media_fields(self, in_path):
+        """模板用到媒体字段 ({duration}、{v_codec} 等) 时探测输入文件，否则返回 None"""
+        if not compile_template(self.settings.cmd).needs_probe:
+            return None
+        try:
+            return media_fields(self.prober.probe_media(in_path))
+        except Exception:
+            return media_fields(None)
+
+    @staticmethod
+    def remove_partial(path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+    def run_local(self, command, slot, on_line, usage=None):
+        """在本机执行 RenderedCommand，逐行回调输出，返回退出码；usage 不为 None 时填入子进程的资源用量"""
+        decode = OutputDecoder(self.settings.encoding)
+        returncode = 0
+        for group in command.groups():
+            returncode = self.run_group(group, command.shell, slot, on_line, decode, usage)
+            if returncode != 0 or not self.is_running:
+                break
+        return returncode
+
+    def run_group(self, group, shell, slot, on_line, decode, usage):
+        """启动由管道相连的一组进程：前一个的标准输出接后一个的标准输入，
+        全部进程的标准错误与最后一个的标准输出汇入同一管道逐行读取。任一进程失败即返回其退出码。"""
+        read_fd, write_fd = os.pipe()
+        procs = []
+        try:
+            stdin = subprocess.DEVNULL
+            for k, cmd in enumerate(group):
+                last = k == len(group) - 1
+                proc = subprocess.Popen(
+                    cmd, shell=shell, stdin=stdin, stdout=write_fd if last else subprocess.PIPE, stderr=write_fd,
+                    start_new_session=(os.name != "nt")
+                )
+                if k:
+                    stdin.close()   # 管道读端已交给后一个进程
+                stdin = proc.stdout
+                procs.append(proc)
+        except BaseException:
+            for proc in procs:
+                kill_process_tree(proc)
+                proc.wait()
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        with self.proc_lock:
+            self.running_processes[slot] = procs
+        try:
+            with open(read_fd, "rb", buffering=0) as stream:
+                for line in iter_output_lines(stream, decode):
+                    if not self.is_running: break
+                    on_line(line)
+            for proc in procs:
+                measured = wait_with_usage(proc)
+                if usage is not None and measured:
+                    merge_usage(usage, measured)
+        finally:
+            with self.proc_lock:
+                self.running_processes.pop(slot, None)
+        return next((proc.returncode for proc in reversed(procs) if proc.returncode), 0)
+
+    def line_handler(self, fname, slot, parser, on_progress, tail=None):
+        """生成逐行处理子进程输出的回调：进度行交给 on_progress(已处理秒数)，其余行写入日志并追加到 tail (用于判断失败类别)"""
+        self.slot_progress[slot] = (fname, parser, time.monotonic())
+
+        def on_line(line):
+            if parser.feed(line):
+                on_progress(parser.out_time)
+                self.log(f"处理进度：{fname} {parser.describe()}", "命令", slot)
+                self.show_progress()
+            elif self.PROGRESS_KEY_RE.match(line):
+                # -progress 输出的其余 key=value 行不显示
+                return
+            elif line.strip():
+                lvl = "错误" if "Error" in line or "Failed" in line else "命令"
+                self.log(f" {line.strip()}", lvl, slot)
+                if tail is not None:
+                    tail.append(line.strip())
+        return on_line
+
+    def run_job(self, job, slot):
+        self.slot_progress.pop(slot, None)
+        if len(job) == 3:
+            return self.run_segment(job, slot)
+        i, in_path = job
+        if not self.is_running: return
+        s = self.settings
+        tag = f"[槽位{slot}] 第{i+1}/{self.files_total}个任务"
+
+        fname = os.path.basename(in_path)
+        full_out = output_path_for(in_path, s.naming_rule, s.output_dir, s.use_own_dir)
+
+        if os.path.exists(full_out) and s.overwrite == "skip":
+            self.log(f"[槽位{slot}] 跳过已存在文件: {fname}", "信息", slot)
+            self.record(in_path, None, "skipped", slot=slot)
+            self.mark(in_path, "skipped")
+            self.finish(i, "skipped")
+            return
+
+        # 增量模式：输入指纹、命令、工具版本都未变化时跳过
+        build_key = None
+        if self.manifest:
+            try:
+                build_key = (fingerprint(in_path, s.hash_sample),
+                             render_command(s.cmd, in_path, full_out, s.scratch_dir, self.media_fields(in_path)), tool_version(s.cmd))
+            except OSError:
+                build_key = None
+            if build_key and s.overwrite == "incremental" and self.manifest.is_current(full_out, *build_key):
+                self.log(f"[槽位{slot}] 跳过未变化的文件: {fname}", "信息", slot)
+                self.record(in_path, None, "skipped", slot=slot)
+                self.mark(in_path, "skipped")
+                self.finish(i, "skipped")
+                return
+
+        # 先写入临时文件，成功后再改名，中断时不会留下看似完整的输出
+        tmp_out = partial_name(full_out)
+        self.mark(in_path, "running", partial=tmp_out, output=full_out)
+
+        # 1. 记录开始时间
+        start_time = datetime.now()
+        self.log(f"{tag}启动: 【{fname}】at {start_time.strftime('%Y-%m-%d %H:%M:%S')}", "信息", slot)
+
+        # 时长未探测完成的文件在这里补探测 (命中缓存时只需一次 stat)
+        media_duration = self.durations[i]
+        if media_duration is None:
+            try:
+                media_duration = media_numbers(self.prober.probe_media(in_path))[0]
+            except Exception:
+                pass
+            self.progress.set_duration(i, media_duration)
+
+        count = self.split_count(media_duration)
+        reserved = self.reserve_disk(i, in_path, tmp_out, count, slot, tag)
+        if reserved is None and count:
+            self.log(f"{tag}输出磁盘空间不足以分段处理，改为整体处理: 【{fname}】", "错误", slot)
+            count = 0
+            reserved = self.reserve_disk(i, in_path, tmp_out, count, slot, tag)
+        if reserved is None:
+            self.log(f"{tag}输出磁盘空间不足，且没有其他任务可释放空间，放弃处理: 【{fname}】", "错误", slot)
+            self.complete_job(i, in_path, full_out, "failed", None, start_time, media_duration, {}, None, slot, tag)
+            return
+        if not reserved:
+            return
+        if count:
+            split = SplitJob(i, in_path, full_out, tmp_out, build_key, media_duration, start_time, tag)
+            if self.start_split(split, count, slot):
+                return
+            # 切分失败时按整个文件处理
+            self.log(f"{tag}分段失败，改为整体处理: 【{fname}】", "错误", slot)
+
+        command = compile_template(s.cmd).render(in_path, tmp_out, s.scratch_dir, self.media_fields(in_path))
+        final_cmd, scratch_files = command.text, command.scratch_files
+        parser = FfmpegProgress(media_duration)
+        tail = deque(maxlen=FAILURE_TAIL_LINES)
+        on_line = self.line_handler(fname, slot, parser, lambda seconds: self.progress.update(i, seconds), tail)
+
+        result = "failed"
+        failure = None
+        returncode = None
+        usage = {}
+        # 上次崩溃或被强制结束时留下的临时输出与中间文件：不加 -y 的命令遇到已存在的文件会直接失败
+        for path in [tmp_out] + scratch_files:
+            self.remove_partial(path)
+        try:
+            if scratch_files:
+                os.makedirs(s.scratch_dir, exist_ok=True)
+            if self.remote:
+                scratch_dirs = sorted({os.path.dirname(path) for path in scratch_files})
+                returncode = self.remote.run_command(final_cmd, on_line, lambda: self.is_running, usage, s.encoding, scratch_dirs)
+            else:
+                returncode = self.run_local(command, slot, on_line, usage)
+            if not self.is_running:
+                # 被终止的任务保持 running 状态，续跑时重新排队
+                self.remove_partial(tmp_out)
+                return
+
+            if returncode == 0 and os.path.exists(tmp_out):
+                os.replace(tmp_out, full_out)
+                self.log(f"{tag}成功输出：【{full_out}】", "信息", slot)
+                result = "processed"
+                if build_key:
+                    self.manifest.record(full_out, in_path, *build_key)
+            else:
+                failure = self.policy.classify(tail, returncode)
+                self.log(f"{tag}处理失败 ({RetryPolicy.LABELS[failure]}): 【{fname}】", "错误", slot)
+        except Exception as e:
+            self.log(f"{tag}系统错误: {str(e)}", "错误", slot)
+        finally:
+            # 流水线的中间文件无论成败都删除
+            for path in scratch_files:
+                self.remove_partial(path)
+
+        if result != "processed":
+            self.remove_partial(tmp_out)
+        if not self.is_running:
+            return
+        if failure and self.retry_later(job, i, failure, slot, tag):
+            return
+        self.complete_job(i, in_path, full_out, result, returncode, start_time, media_duration, usage, final_cmd, slot, tag)
+
+    def complete_job(self, i, in_path, full_out, result, returncode, start_time, media_duration, usage, command, slot, tag):
+        """任务结束后的记录：续跑日志、耗时、性能报告、JSONL 任务日志与整批进度"""
+        self.mark(in_path, "done" if result == "processed" else "failed", output=full_out, returncode=returncode)
+
+        # 2. 记录结束时间并计算耗时
+        end_time = datetime.now()
+        duration = end_time - start_time
+        hours, minutes, seconds = split_seconds(duration)
+        self.log(f"{tag}结束 at {end_time.strftime('%Y-%m-%d %H:%M:%S')}，耗时：{hours} 小时 {minutes} 分钟 {seconds} 秒", "信息", slot)
+        perf = PerfReport.job_row(in_path, full_out if result == "processed" else None, result, slot,
+                                  duration.total_seconds(), media_duration, usage)
+        self.perf.add(perf)
+        self.disk.release(i, perf["in_size"], perf["out_size"])
+        if result == "failed":
+            with self.stats_lock:
+                self.failed_jobs.append((i, in_path))
+        self.record(in_path, command, result, start_time, end_time, returncode, slot, perf)
+        self.finish(i, result, duration)
+
+    # --- 失败重试 ---
+    def retry_later(self, job, key, failure, slot, tag):
+        """资源不足或临时故障且未超过尝试次数时，按退避时间重新排队并返回 True。
+
+        资源不足时同时降低该资源类别的并发上限。key 区分整个文件与各分段的尝试次数。
+        """
+        if failure == "permanent":
+            return False
+        with self.stats_lock:
+            failures = self.attempts[key] = self.attempts.get(key, 0) + 1
+            if failures >= self.policy.attempts:
+                return False
+            self.stats["retried"] += 1
+        with self.totals_lock:
+            self.totals["retried"] += 1
+        if failure == "resource":
+            resource = self.settings.resource
+            old, new = self.scheduler.shrink_class(resource)
+            if new < old:
+                self.log(f"资源不足：{resource} 类并发上限 {old} → {new}", "错误", slot)
+        delay = self.policy.delay(failures)
+        self.log(f"{tag}{RetryPolicy.LABELS[failure]}，{delay:g} 秒后第 {failures + 1}/{self.policy.attempts} 次尝试", "信息", slot)
+        if len(job) == 2:
+            self.disk.release(job[0])
+            self.progress.update(job[0], 0)
+        self.scheduler.submit_later(job, delay)
+        return True
+
+    def rerun_failed(self):
+        """整批结束后把失败的任务重新排队跑一轮 (重新计算尝试次数)"""
+        jobs, self.failed_jobs = self.failed_jobs, []
+        self.attempts.clear()
+        self.log(f"重跑失败的任务：共 {len(jobs)} 个", "信息")
+        with self.stats_lock:
+            self.stats["failed"] -= len(jobs)
+            self.stats["done"] -= len(jobs)
+        for i, _ in jobs:
+            self.progress.reopen(i)
+        self.show_progress(force=True)
+        self.scheduler.run(jobs)
+
+    # --- 分段并行 ---
+    def split_count(self, media_duration):
+        """长文件切成几段并行处理；不分段时返回 0"""
+        count = self.settings.split
+        if not count or self.remote or not media_duration:
+            return 0
+        count = min(count, int(media_duration // SPLIT_MIN_SECONDS))
+        return count if count >= 2 else 0
+
+    def run_tool(self, argv, slot, usage):
+        """在本机执行切分/拼接等内部命令，出错输出写入日志，返回退出码"""
+        def on_line(line):
+            if "Error" in line or "Failed" in line or "Invalid" in line:
+                self.log(f" {line.strip()}", "错误", slot)
+        return self.run_local(RenderedCommand([(argv, False)], [], False), slot, on_line, usage)
+
+    def start_split(self, split, count, slot):
+        """按关键帧把输入无损切成 count 段 (分界点按时长均分，落在其后的第一个关键帧)，
+        各段作为新任务排到队首并行处理；切分失败返回 False"""
+        fname = os.path.basename(split.in_path)
+        shutil.rmtree(split.work_dir, ignore_errors=True)
+        os.makedirs(split.work_dir)
+        ext = os.path.splitext(split.in_path)[1]
+        times = ",".join(f"{split.media_duration * k / count:.3f}" for k in range(1, count))
+        argv = ["ffmpeg", "-hide_banner", "-nostdin", "-y", "-i", split.in_path, "-map", "0", "-c", "copy",
+                "-f", "segment", "-segment_times", times, "-reset_timestamps", "1",
+                os.path.join(split.work_dir, f"seg%03d{ext}")]
+        split.commands.append(RenderedCommand([(argv, False)], [], False).text)
+        self.log(f"{split.tag}按关键帧切分为 {count} 段: 【{fname}】", "信息", slot)
+        try:
+            returncode = self.run_tool(argv, slot, split.usage)
+            segments = sorted(e.path for e in os.scandir(split.work_dir) if e.name.startswith("seg"))
+        except Exception as e:
+            self.log(f"{split.tag}系统错误: {str(e)}", "错误", slot)
+            returncode, segments = None, []
+        if returncode != 0 or len(segments) < 2 or not self.is_running:
+            shutil.rmtree(split.work_dir, ignore_errors=True)
+            return not self.is_running
+        split.segments = segments
+        split.lengths = [media_numbers(run_ffprobe(path))[0] for path in segments]
+        split.outputs = [None] * len(segments)
+        split.positions = [0.0] * len(segments)
+        split.remaining = len(segments)
+        self.splits.add(split)
+        # 倒序插入队首，各段按顺序派发
+        for k in reversed(range(len(segments))):
+            self.scheduler.submit((split.i, split.in_path, (split, k)), front=True)
+        return True
+
+    def run_segment(self, job, slot):
+        i, in_path, (split, k) = job
+        s = self.settings
+        n = len(split.segments)
+        ok = False
+        if self.is_running and not split.failed:
+            out_ext = os.path.splitext(split.full_out)[1]
+            seg_out = os.path.join(split.work_dir, f"out{k:03d}{out_ext}")
+            command = compile_template(s.cmd).render(split.segments[k], seg_out, s.scratch_dir, self.media_fields(in_path))
+            if k == 0:
+                split.commands.append(command.text)
+            fname = f"{os.path.basename(in_path)} 分段{k + 1}/{n}"
+
+            def on_progress(seconds):
+                with split.lock:
+                    split.positions[k] = seconds
+                    self.progress.update(i, sum(split.positions))
+
+            tail = deque(maxlen=FAILURE_TAIL_LINES)
+            on_line = self.line_handler(fname, slot, FfmpegProgress(split.lengths[k]), on_progress, tail)
+            failure = None
+            usage = {}
+            # 重试时上一次失败留下的分段输出与中间文件
+            for path in [seg_out] + command.scratch_files:
+                self.remove_partial(path)
+            try:
+                if command.scratch_files:
+                    os.makedirs(s.scratch_dir, exist_ok=True)
+                returncode = self.run_local(command, slot, on_line, usage)
+                ok = returncode == 0 and os.path.exists(seg_out)
+                if not ok and self.is_running:
+                    failure = self.policy.classify(tail, returncode)
+                    self.log(f"[槽位{slot}] 分段{k + 1}/{n}处理失败 ({RetryPolicy.LABELS[failure]}): 【{os.path.basename(in_path)}】",
+                             "错误", slot)
+            except Exception as e:
+                self.log(f"[槽位{slot}] 分段{k + 1}/{n}系统错误: {str(e)}", "错误", slot)
+            finally:
+                for path in command.scratch_files:
+                    self.remove_partial(path)
+            with split.lock:
+                merge_usage(split.usage, usage)
+                if ok:
+                    split.outputs[k] = seg_out
+                    split.positions[k] = split.lengths[k] or 0.0
+            if failure and self.is_running and not split.failed and \
+                    self.retry_later(job, (i, k), failure, slot, f"[槽位{slot}] 分段{k + 1}/{n}"):
+                return
+        with split.lock:
+            # 任一段失败后，尚未开始的段直接放弃
+            split.failed = split.failed or not ok
+            split.remaining -= 1
+            last = split.remaining == 0
+        if last:
+            self.join_split(split, slot)
+
+    def join_split(self, split, slot):
+        """全部分段结束后用 concat 分离器无损拼接，并核对输出时长与输入一致"""
+        fname = os.path.basename(split.in_path)
+        result = "failed"
+        returncode = None
+        try:
+            if not self.is_running:
+                # 被终止的任务保持 running 状态，续跑时重新排队
+                return
+            if not split.failed:
+                list_file = os.path.join(split.work_dir, "concat.txt")
+                with open(list_file, "w", encoding="utf-8") as f:
+                    for path in split.outputs:
+                        escaped = path.replace("'", "'\\''")
+                        f.write(f"file '{escaped}'\n")
+                argv = ["ffmpeg", "-hide_banner", "-nostdin", "-y", "-f", "concat", "-safe", "0", "-i", list_file,
+                        "-map", "0", "-c", "copy", split.tmp_out]
+                split.commands.append(RenderedCommand([(argv, False)], [], False).text)
+                returncode = self.run_tool(argv, slot, split.usage)
+                if not self.is_running:
+                    return
+                out_duration = media_numbers(run_ffprobe(split.tmp_out))[0] if returncode == 0 else None
+                if returncode != 0 or not os.path.exists(split.tmp_out):
+                    self.log(f"{split.tag}分段拼接失败: 【{fname}】", "错误", slot)
+                elif not split.duration_matches(out_duration):
+                    shown = f"{out_duration:.2f}" if out_duration is not None else "未知"
+                    self.log(f"{split.tag}拼接后时长不符 (输入 {split.media_duration:.2f} 秒，输出 {shown} 秒): 【{fname}】", "错误", slot)
+                else:
+                    os.replace(split.tmp_out, split.full_out)
+                    self.log(f"{split.tag}成功输出：【{split.full_out}】({len(split.segments)} 段拼接)", "信息", slot)
+                    result = "processed"
+                    if split.build_key:
+                        self.manifest.record(split.full_out, split.in_path, *split.build_key)
+            else:
+                self.log(f"{split.tag}处理失败: 【{fname}】", "错误", slot)
+        except Exception as e:
+            self.log(f"{split.tag}系统错误: {str(e)}", "错误", slot)
+        finally:
+            self.splits.discard(split)
+            shutil.rmtree(split.work_dir, ignore_errors=True)
+            if result != "processed":
+                self.remove_partial(split.tmp_out)
+        self.complete_job(split.i, split.in_path, split.full_out, result, returncode, split.start_time,
+                          split.media_duration, split.usage, "\n".join(split.commands), slot, split.tag)
+
+
+# --- 命令行入口 ---
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="python -m batch_core", description="按预设命令批量处理媒体文件 (无界面)")
+    parser.add_argument("paths", nargs="*", help="要处理的文件或文件夹")
+    cmd_group = parser.add_mutually_exclusive_group()
+    cmd_group.add_argument("-p", "--preset", help="预设名称 (见 --list-presets)")
+    cmd_group.add_argument("-c", "--cmd", help="命令模板，须包含 {input} 和 {output}")
+    parser.add_argument("--presets-file", default=CONFIG_FILE, help=f"预设文件路径 (默认 {CONFIG_FILE})")
+    parser.add_argument("--list-presets", action="store_true", help="列出全部预设后退出")
+    parser.add_argument("-o", "--output-dir", default="", help="输出目录，默认输出到各文件所在目录")
+    parser.add_argument("-n", "--naming", default="{name}_done{ext}", help="输出命名规则，{name}=原名, {ext}=原后缀")
+    conflict = parser.add_mutually_exclusive_group()
+    conflict.add_argument("--overwrite", action="store_true", help="强制覆盖已存在的输出 (默认跳过)")
+    conflict.add_argument("--incremental", action="store_true", help="只处理输入、命令或工具版本有变化的文件")
+    parser.add_argument("--scratch-dir", default=None, help=f"多步骤流水线的中间文件目录，默认 {SCRATCH_DIR}")
+    parser.add_argument("--encoding", default=None,
+                        help="子进程输出的编码 (如 utf-8、gbk)，默认自动识别：先按 UTF-8，失败再用系统编码")
+    parser.add_argument("--split", type=int, default=None, metavar="N",
+                        help=f"把时长足够的文件按关键帧切成 N 段并行处理后无损拼接 (每段至少 {SPLIT_MIN_SECONDS} 秒，0 不分段)")
+    parser.add_argument("--min-free", type=float, default=DISK_MIN_FREE / 1024 ** 3, metavar="GB",
+                        help="输出磁盘至少保留的剩余空间，预计不足时任务暂停等待")
+    parser.add_argument("--max-write", type=float, default=0, metavar="MB/s",
+                        help="全部任务合计的输出写入带宽上限，0 不限 (仅 Linux/macOS)")
+    parser.add_argument("--hash-sample", action="store_true", help="增量模式下额外用抽样哈希判断输入是否变化")
+    parser.add_argument("--retries", type=int, default=None, metavar="N",
+                        help=f"资源不足或临时故障时最多尝试的次数 (含第一次)，默认取预设或 {RETRY_ATTEMPTS}")
+    parser.add_argument("--retry-backoff", type=float, default=None, metavar="SEC",
+                        help=f"第一次重试前等待的秒数，之后每次翻倍，默认 {RETRY_BACKOFF:g}")
+    parser.add_argument("--rerun-failed", action="store_true", help="整批结束后把失败的任务再集中跑一轮")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归子目录")
+    parser.add_argument("--max-depth", type=int, default=None, help="递归的最大层数 (0 只扫描所给文件夹本身)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                        help="跳过匹配的文件或文件夹 (名称或相对路径的通配符)，可重复指定")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并发任务数，默认=CPU核数")
+    parser.add_argument("--auto-jobs", action="store_true", help="按 CPU、负载、内存与磁盘 iowait 自动增减并发数 (以 -j 为起点)")
+    parser.add_argument("--order", choices=list(QUEUE_ORDERS), default="list", help="队列排序策略")
+    parser.add_argument("--job-log", action="store_true", help="输出 JSONL 任务日志 (batch_jobs.jsonl)")
+    parser.add_argument("--perf-report", action="store_true", help="导出每个任务的资源用量 (batch_perf.csv / batch_perf.json)")
+    parser.add_argument("--no-cache", action="store_true", help="不使用媒体信息缓存")
+    parser.add_argument("--resume", action="store_true", help="续跑上次未完成的批处理")
+    parser.add_argument("--watch", action="store_true", help="监视模式：持续处理所给文件夹中新到达的文件，Ctrl+C 结束")
+    parser.add_argument("--stable-seconds", type=float, default=5, help="监视模式下文件大小多少秒不变才开始处理")
+    parser.add_argument("--serve", metavar="[HOST:]PORT", default=None,
+                        help="作为协调端运行，任务交给 batch_remote 执行端执行；未设置 --token 时只监听本机")
+    parser.add_argument("--token", default=None, help="协调端与执行端之间的访问口令")
+    parser.add_argument("--metrics", metavar="[HOST:]PORT", default=None,
+                        help="在该端口提供运行指标 (/metrics 为 Prometheus 格式，/metrics.json 为 JSON)，默认只监听本机")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示子进程输出与进度行")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+
+    def fail(message, code=EXIT_USAGE):
+        print(message, file=sys.stderr)
+        return code
+
+    # 指定了其他预设文件时按原样读取，不自动创建
+    store = PresetStore(args.presets_file, () if os.path.abspath(args.presets_file) != CONFIG_FILE else
+                        (LEGACY_CONFIG_FILE, DEFAULT_CONFIG_FILE))
+    try:
+        presets = store.presets()
+    except (OSError, ValueError) as e:
+        return fail(f"无法读取预设文件：{e}")
+    if args.list_presets:
+        for name, preset in presets.items():
+            print(f"{name}\t[{preset['resource']}]\t{' => '.join(pipeline_steps(preset['cmd']))}")
+        for name, problems in store.errors.items():
+            print(f"{name}\t[无效]\t{'；'.join(problems)}")
+        return EXIT_OK
+
+    journal = None
+    watcher = None
+    if args.watch and (args.resume or len(args.paths) != 1 or not os.path.isdir(args.paths[0])):
+        return fail("--watch 需要且只能指定一个文件夹，且不能与 --resume 同时使用")
+    if args.resume:
+        journal = BatchJournal.load_last()
+        files = journal.remaining() if journal else []
+        if not files:
+            return fail("没有需要续跑的批处理任务", EXIT_NO_INPUT)
+        journal.discard_partials()
+        settings = BatchSettings.from_dict(journal.header)
+        files = [p for p in files if os.path.isfile(p)]
+    else:
+        if args.preset:
+            if args.preset in store.errors:
+                return fail(f"预设 {args.preset} 无效：{'；'.join(store.errors[args.preset])}")
+            if args.preset not in presets:
+                return fail(f"预设不存在：{args.preset}")
+            preset = presets[args.preset]
+            cmd, resource, scratch_dir, encoding = preset["cmd"], preset["resource"], preset["scratch_dir"], preset["encoding"]
+            split, retry = preset["split"], dict(preset["retry"] or {})
+        elif args.cmd:
+            cmd, resource, scratch_dir, encoding, split, retry = args.cmd, None, None, None, None, {}
+        else:
+            return fail("必须指定 --preset 或 --cmd")
+        if "{input}" not in cmd or "{output}" not in cmd:
+            return fail("命令模版必须包含 {input} 和 {output}")
+        encoding = args.encoding or encoding
+        if args.retries is not None:
+            retry["attempts"] = args.retries
+        if args.retry_backoff is not None:
+            retry["backoff"] = args.retry_backoff
+        try:
+            RetryPolicy.from_dict(retry)
+        except (TypeError, ValueError, re.error) as e:
+            return fail(f"重试策略无效：{e}")
+        try:
+            OutputDecoder(encoding)
+        except LookupError:
+            return fail(f"未知的编码：{encoding}")
+        class_limits = class_limits_from(presets)
+        if args.preset and presets[args.preset]["max_jobs"]:
+            class_limits[resource] = int(presets[args.preset]["max_jobs"])
+        settings = BatchSettings(
+            cmd, output_dir=args.output_dir, use_own_dir=not args.output_dir, naming_rule=args.naming,
+            overwrite="overwrite" if args.overwrite else "incremental" if args.incremental else "skip",
+            slots=args.jobs, resource=resource, class_limits=class_limits, job_log=args.job_log, order=args.order,
+            hash_sample=args.hash_sample, scratch_dir=args.scratch_dir or scratch_dir,
+            preset=args.preset, perf_report=args.perf_report, auto_slots=args.auto_jobs,
+            encoding=encoding, split=split if args.split is None else args.split,
+            min_free=args.min_free * 1024 ** 3, max_write=args.max_write * 1024 ** 2,
+            retry=retry, rerun_failed=args.rerun_failed,
+        )
+        if args.watch:
+            from batch_watch import FolderWatcher
+            # 文件夹中已有的文件也由监视器产出，保证逐个等到写入完成
+            watcher = FolderWatcher(args.paths[0], args.recursive, excludes=args.exclude, max_depth=args.max_depth,
+                                    stable_seconds=args.stable_seconds)
+            files = []
+        else:
+            files = list(scan_paths(args.paths, args.recursive, excludes=args.exclude, max_depth=args.max_depth))
+    if not files and watcher is None:
+        return fail("没有找到可处理的媒体文件", EXIT_NO_INPUT)
+
+    cache = None
+    if not args.no_cache:
+        try:
+            cache = ProbeCache()
+        except sqlite3.Error:
+            pass
+    prober = Prober(cache)
+    # 排序需要时长与大小，续跑时按原顺序执行则无需预先探测
+    durations = sizes = None
+    if settings.order != "list" and not journal:
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as pool:
+            probed = list(pool.map(prober.probe_entry, files))
+        durations = [p[1] for p in probed]
+        sizes = [p[2] for p in probed]
+
+    settings.resolve_output_dir(files or [os.path.join(watcher.folder, "")])
+    log_file = BatchLogFile(LogWriter())
+    log_file.write(settings.output_dir, "批处理任务开始", first_time=True)
+    def log(message, level="命令", slot=None):
+        # 子进程输出与进度行只在 -v 时显示，也不写入日志文件
+        if level == "命令":
+            if args.verbose:
+                print(f"[{level}] {message.strip()}", flush=True)
+            return
+        print(f"[{level}] {message.strip()}", flush=True)
+        log_file.write(settings.output_dir, message.strip())
+
+    job_log_writer = LogWriter() if settings.job_log else None
+    remote = None
+    if args.serve:
+        from batch_remote import JobServer, default_host
+        host, _, port = args.serve.rpartition(":")
+        try:
+            remote = JobServer(host or default_host(args.token), int(port), token=args.token, log=log)
+        except (OSError, ValueError) as e:
+            return fail(f"无法启动协调端：{e}")
+        print(f"协调端已在 {remote.address[0]}:{remote.address[1]} 监听，等待执行端领取任务", flush=True)
+    try:
+        manifest = BuildManifest()
+    except sqlite3.Error:
+        manifest = None
+    runner = BatchRunner(settings, prober, log=log, job_log_writer=job_log_writer, remote=remote, manifest=manifest)
+    metrics_server = None
+    if args.metrics:
+        from batch_metrics import MetricsServer
+        host, _, port = args.metrics.rpartition(":")
+        try:
+            metrics_server = MetricsServer(runner.metrics, host or "127.0.0.1", int(port))
+        except (OSError, ValueError) as e:
+            if remote:
+                remote.close()
+            return fail(f"无法启动指标接口：{e}")
+        print(f"运行指标：http://{metrics_server.address[0]}:{metrics_server.address[1]}/metrics", flush=True)
+    # 在后台线程执行，主线程保持可响应 Ctrl+C
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(runner.run(files, durations, sizes, journal=journal, watcher=watcher)), daemon=True)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        print("🛑 任务已被用户手动终止！", file=sys.stderr)
+        runner.stop()
+        worker.join()
+    finally:
+        log_file.writer.close()
+        if job_log_writer:
+            job_log_writer.close()
+        if cache:
+            cache.flush()
+        if remote:
+            for h in remote.host_stats():
+                print(f"执行端 {h['host']}：完成 {h['completed']}，失败 {h['failed']}，{h['jobs_per_minute']} 任务/分", flush=True)
+            remote.close()
+        if metrics_server:
+            metrics_server.close()
+
+    if watcher is not None:
+        # 监视模式只能由 Ctrl+C 结束，按处理结果返回
+        return EXIT_FAILED if result.get("failed") else EXIT_OK
+    if result.get("interrupted", True):
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if result.get("failed") else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
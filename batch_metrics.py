@@ -0,0 +1,125 @@
+"""运行指标接口：在本机 HTTP 端口上提供 BatchRunner.metrics() 的内容，供通宵批处理时远程查看。
+
+GET /metrics       Prometheus 文本格式
+GET /metrics.json  JSON 格式
+
+指标只在请求到来时从引擎现有的计数中读取，不请求时没有任何额外开销。
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8766
+
+# (指标名, 类型, 说明, metrics() 中的键)
+GAUGES = (
+    ("batch_running", "gauge", "批处理是否正在运行", "running"),
+    ("batch_files_total", "gauge", "本批任务总数", "files_total"),
+    ("batch_queue_depth", "gauge", "排队等待派发的任务数", "queued"),
+    ("batch_retry_waiting", "gauge", "等待退避结束后重试的任务数", "retry_waiting"),
+    ("batch_active_jobs", "gauge", "正在运行的任务数", "active"),
+    ("batch_slot_limit", "gauge", "当前允许同时运行的任务数", "slot_limit"),
+    ("batch_progress_ratio", "gauge", "按媒体时长加权的整批完成比例", "progress"),
+    ("batch_eta_seconds", "gauge", "整批预计剩余秒数", "eta"),
+    ("batch_media_seconds_per_second", "gauge", "平均每秒处理的媒体秒数", "media_rate"),
+)
+RESULTS = ("processed", "failed", "skipped")
+SLOT_GAUGES = (
+    ("batch_slot_progress_percent", "当前任务的完成百分比", "percent"),
+    ("batch_slot_fps", "当前任务的处理帧率", "fps"),
+    ("batch_slot_speed", "当前任务的处理倍速", "speed"),
+    ("batch_slot_eta_seconds", "当前任务预计剩余秒数", "eta"),
+    ("batch_slot_elapsed_seconds", "当前任务已运行的秒数", "elapsed"),
+)
+
+
+def label_value(text):
+    """转义 Prometheus 标签值"""
+    return str(text).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(metrics):
+    """把 metrics() 的结果转换为 Prometheus 文本格式，值未知的指标不输出"""
+    lines = []
+
+    def header(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name, kind, help_text, key in GAUGES:
+        value = metrics.get(key)
+        if value is None:
+            continue
+        header(name, kind, help_text)
+        lines.append(f"{name} {float(value):g}")
+    # 本批的数字每批重新计数，只能作为 gauge；计数器取进程启动以来的累计值
+    header("batch_jobs_finished", "gauge", "本批已结束的任务数 (按结果)")
+    for result in RESULTS:
+        lines.append(f'batch_jobs_finished{{result="{result}"}} {metrics.get(result, 0)}')
+    header("batch_retries", "gauge", "本批已安排的重试次数")
+    lines.append(f"batch_retries {metrics.get('retried', 0)}")
+    totals = metrics.get("totals") or {}
+    header("batch_jobs_total", "counter", "进程启动以来已结束的任务数 (按结果)")
+    for result in RESULTS:
+        lines.append(f'batch_jobs_total{{result="{result}"}} {totals.get(result, 0)}')
+    header("batch_retries_total", "counter", "进程启动以来已安排的重试次数")
+    lines.append(f"batch_retries_total {totals.get('retried', 0)}")
+    for name, help_text, key in SLOT_GAUGES:
+        rows = [s for s in metrics.get("slots", ()) if s.get(key) is not None]
+        if not rows:
+            continue
+        header(name, "gauge", help_text)
+        for s in rows:
+            lines.append(f'{name}{{slot="{s["slot"]}",file="{label_value(s["file"])}"}} {float(s[key]):g}')
+    hosts = metrics.get("hosts") or ()
+    if hosts:
+        header("batch_host_jobs_per_minute", "gauge", "各执行端的吞吐 (任务/分)")
+        for h in hosts:
+            lines.append(f'batch_host_jobs_per_minute{{host="{label_value(h["host"])}"}} {float(h["jobs_per_minute"]):g}')
+        header("batch_host_running", "gauge", "各执行端正在运行的任务数")
+        for h in hosts:
+            lines.append(f'batch_host_running{{host="{label_value(h["host"])}"}} {h["running"]}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """在后台线程提供指标接口；source() 返回当前的指标字典，没有运行中的批处理时可返回 None"""
+
+    def __init__(self, source, host="127.0.0.1", port=DEFAULT_PORT):
+        self.source = source
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="metrics-server").start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, body, content_type):
+                body = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path not in ("/metrics", "/metrics.json"):
+                    self._reply(404, json.dumps({"error": "not found"}), "application/json; charset=utf-8")
+                    return
+                metrics = server.source() or {"running": False}
+                if path == "/metrics.json":
+                    self._reply(200, json.dumps(metrics, ensure_ascii=False), "application/json; charset=utf-8")
+                else:
+                    self._reply(200, prometheus_text(metrics), "text/plain; version=0.0.4; charset=utf-8")
+
+        return Handler
@@ -0,0 +1,414 @@
+"""分布式执行：协调端 (JobServer) 把渲染好的命令交给远程执行端 (agent) 领取执行。
+
+执行端通过 HTTP 轮询领取任务、回传输出与退出码；超过租约时间未续约的任务重新排队。
+输入输出路径在各主机上必须一致 (共享存储)。
+执行端会在本机以 shell 执行协调端下发的任何命令，即完全信任协调端：只应连接自己控制的协调端，
+跨主机连接时必须设置口令。
+
+执行端用法：python -m batch_remote http://协调端地址:8765 [-j 并发数] [--token 口令]
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_core import OutputDecoder, iter_output_lines, kill_process_tree, wait_with_usage
+
+DEFAULT_PORT = 8765
+# 执行端超过该时间 (秒) 未回报，任务重新排队
+LEASE_SECONDS = 30
+# 执行端回传输出 / 续约的间隔 (秒)
+HEARTBEAT_SECONDS = 2
+# 未设置口令时协调端只允许绑定、执行端只允许连接这些地址，避免局域网内任何主机都能领取命令、伪造结果或下发命令
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def default_host(token):
+    """协调端默认绑定的地址：设置了口令才监听全部网卡"""
+    return "0.0.0.0" if token else "127.0.0.1"
+
+
+class RemoteJob:
+    """协调端的一个远程任务"""
+    __slots__ = ("job_id", "command", "encoding", "scratch_dirs", "on_line", "done", "returncode", "usage", "host", "lease", "deadline", "attempts", "cancelled")
+
+    def __init__(self, job_id, command, on_line, encoding=None, scratch_dirs=()):
+        self.job_id = job_id
+        self.command = command
+        self.encoding = encoding    # 输出编码，None 时由执行端自动识别
+        self.scratch_dirs = list(scratch_dirs)  # 执行前需要在执行端创建的中间文件目录
+        self.on_line = on_line
+        self.done = threading.Event()
+        self.returncode = None
+        self.usage = None       # 执行端回报的资源用量
+        self.host = None
+        self.lease = 0          # 每次派发递增，过期租约的回报据此忽略
+        self.deadline = 0.0
+        self.attempts = 0
+        self.cancelled = False
+
+
+class HostStats:
+    """单个执行端主机的吞吐统计"""
+    __slots__ = ("host", "completed", "failed", "running", "busy_seconds", "first_seen", "last_seen")
+
+    def __init__(self, host):
+        self.host = host
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.busy_seconds = 0.0
+        self.first_seen = self.last_seen = time.monotonic()
+
+    def jobs_per_minute(self):
+        elapsed = max(self.last_seen - self.first_seen, 1.0)
+        return (self.completed + self.failed) * 60.0 / elapsed
+
+    def to_dict(self):
+        return {
+            "host": self.host, "completed": self.completed, "failed": self.failed, "running": self.running,
+            "busy_seconds": round(self.busy_seconds, 1), "jobs_per_minute": round(self.jobs_per_minute(), 2),
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+        }
+
+
+class JobServer:
+    """协调端任务服务器：维护待领取队列与租约，供 BatchRunner 以阻塞方式调用 run_command"""
+
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, token=None, lease_seconds=LEASE_SECONDS, log=None):
+        if not token and host not in LOOPBACK_HOSTS:
+            raise ValueError("监听本机以外的地址时必须设置访问口令")
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self.log = log or (lambda message, level="命令", slot=None: None)
+        self.pending = deque()
+        self.jobs = {}              # job_id -> RemoteJob (已派发或排队中)
+        self.hosts = {}             # 主机名 -> HostStats
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._closed = False
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="job-server").start()
+        threading.Thread(target=self._reap_loop, daemon=True, name="lease-reaper").start()
+
+    # --- 供 BatchRunner 调用 ---
+    def run_command(self, command, on_line, is_running=lambda: True, usage=None, encoding=None, scratch_dirs=()):
+        """提交命令并阻塞等待远程执行结束，返回退出码；被取消时返回 None。usage 不为 None 时填入执行端回报的资源用量"""
+        with self._lock:
+            self._next_id += 1
+            job = RemoteJob(str(self._next_id), command, on_line, encoding, scratch_dirs)
+            self.jobs[job.job_id] = job
+            self.pending.append(job)
+        while not job.done.wait(0.5):
+            if not is_running():
+                self.cancel(job)
+                break
+        with self._lock:
+            self.jobs.pop(job.job_id, None)
+        if usage is not None and job.usage:
+            usage.update(job.usage)
+        return job.returncode
+
+    def cancel(self, job):
+        with self._lock:
+            job.cancelled = True
+            if job in self.pending:
+                self.pending.remove(job)
+            if job.host:
+                self.hosts[job.host].running -= 1
+                job.host = None
+        job.done.set()
+
+    def cancel_all(self):
+        """取消全部任务；正在执行的任务在执行端下次续约时被终止"""
+        with self._lock:
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            self.cancel(job)
+
+    def host_stats(self):
+        with self._lock:
+            return [h.to_dict() for h in self.hosts.values()]
+
+    def close(self):
+        self._closed = True
+        self.cancel_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # --- 租约管理 ---
+    def _host(self, name):
+        stats = self.hosts.get(name)
+        if stats is None:
+            stats = self.hosts[name] = HostStats(name)
+        stats.last_seen = time.monotonic()
+        return stats
+
+    def _reap_loop(self):
+        while not self._closed:
+            time.sleep(1)
+            now = time.monotonic()
+            expired = []
+            with self._lock:
+                for job in self.jobs.values():
+                    if job.host and not job.done.is_set() and now > job.deadline:
+                        expired.append((job, job.host))
+                        self.hosts[job.host].running -= 1
+                        job.host = None
+                        job.lease += 1
+                        # 超时任务优先重新派发
+                        self.pending.appendleft(job)
+            for job, host in expired:
+                self.log(f"执行端 {host} 租约超时，任务重新排队: {job.command}", "错误")
+
+    def lease(self, host):
+        with self._lock:
+            stats = self._host(host)
+            while self.pending:
+                job = self.pending.popleft()
+                if job.cancelled:
+                    continue
+                job.host = host
+                job.lease += 1
+                job.attempts += 1
+                job.deadline = time.monotonic() + self.lease_seconds
+                stats.running += 1
+                return {"job_id": job.job_id, "lease": job.lease, "command": job.command,
+                        "encoding": job.encoding, "scratch_dirs": job.scratch_dirs, "heartbeat": HEARTBEAT_SECONDS}
+        return None
+
+    def _current(self, data):
+        """返回租约仍有效的任务，过期或未知的回报返回 None"""
+        job = self.jobs.get(str(data.get("job_id")))
+        if job is None or job.lease != data.get("lease") or job.host != data.get("host"):
+            return None
+        return job
+
+    def progress(self, data):
+        with self._lock:
+            self._host(data.get("host", "?"))
+            job = self._current(data)
+            if job is None:
+                return {"cancel": True}
+            job.deadline = time.monotonic() + self.lease_seconds
+            cancel = job.cancelled
+        for line in data.get("lines", []):
+            job.on_line(line)
+        return {"cancel": cancel}
+
+    def complete(self, data):
+        with self._lock:
+            stats = self._host(data.get("host", "?"))
+            job = self._current(data)
+            if job is None:
+                return {"accepted": False}
+            stats.running -= 1
+            stats.busy_seconds += float(data.get("seconds", 0))
+            if data.get("returncode") == 0:
+                stats.completed += 1
+            else:
+                stats.failed += 1
+            job.host = None
+        for line in data.get("lines", []):
+            job.on_line(line)
+        job.usage = data.get("usage")
+        job.returncode = data.get("returncode")
+        job.done.set()
+        return {"accepted": True}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, payload=None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self):
+                # 定长比较，避免按响应时间逐字符猜出口令；按字节比较以免非 ASCII 口令出错
+                sent = self.headers.get("X-Batch-Token", "").encode("utf-8", "surrogateescape")
+                if server.token and not hmac.compare_digest(sent, server.token.encode("utf-8")):
+                    self._reply(403, {"error": "forbidden"})
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path == "/stats":
+                    self._reply(200, {"hosts": server.host_stats(), "pending": len(server.pending)})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    data = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._reply(400, {"error": "bad request"})
+                    return
+                if self.path == "/lease":
+                    job = server.lease(data.get("host", self.client_address[0]))
+                    if job:
+                        self._reply(200, job)
+                    else:
+                        self._reply(204)
+                elif self.path == "/progress":
+                    self._reply(200, server.progress(data))
+                elif self.path == "/complete":
+                    self._reply(200, server.complete(data))
+                else:
+                    self._reply(404, {"error": "not found"})
+
+        return Handler
+
+
+# --- 执行端 ---
+class Agent:
+    """执行端：以 slots 个线程轮询协调端，领取命令在本机执行并回报结果。
+
+    协调端下发的命令原样交给 shell 执行，连接本机以外的协调端时必须设置口令。
+    """
+
+    def __init__(self, server_url, slots=1, host=None, token=None, poll_seconds=1.0):
+        if not token and urllib.parse.urlsplit(server_url).hostname not in LOOPBACK_HOSTS:
+            raise ValueError("连接本机以外的协调端时必须设置访问口令")
+        self.server_url = server_url.rstrip("/")
+        self.slots = max(1, int(slots))
+        self.host = host or socket.gethostname()
+        self.token = token
+        self.poll_seconds = poll_seconds
+        self.is_running = False
+
+    def _post(self, path, payload):
+        req = urllib.request.Request(
+            self.server_url + path, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json", "X-Batch-Token": self.token or ""}, method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            body = resp.read()
+        return json.loads(body) if body else None
+
+    def run(self):
+        """阻塞运行，直到 stop()"""
+        self.is_running = True
+        threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(self.slots)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def stop(self):
+        self.is_running = False
+
+    def _loop(self):
+        while self.is_running:
+            try:
+                job = self._post("/lease", {"host": self.host})
+            except (urllib.error.URLError, OSError, ValueError):
+                job = None
+            if not job:
+                time.sleep(self.poll_seconds)
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # 单个任务出错不能让领取线程退出；未回报的任务由协调端的租约超时重新排队
+                print(f"执行任务出错：{e}", file=sys.stderr, flush=True)
+
+    def _execute(self, job):
+        ident = {"job_id": job["job_id"], "lease": job["lease"], "host": self.host}
+        heartbeat = job.get("heartbeat", HEARTBEAT_SECONDS)
+        started = time.monotonic()
+        lines = []
+        lines_lock = threading.Lock()
+        try:
+            for folder in job.get("scratch_dirs") or ():
+                os.makedirs(folder, exist_ok=True)
+            proc = subprocess.Popen(
+                job["command"], shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                start_new_session=(os.name != "nt")
+            )
+        except Exception as e:
+            # 启动失败按任务失败回报，本线程继续领取后续任务
+            self._complete(dict(ident, lines=[f"执行端 {self.host} 无法启动命令：{e}"], returncode=127,
+                                seconds=time.monotonic() - started, usage=None))
+            return
+        decode = OutputDecoder(job.get("encoding"))
+
+        def pump():
+            for line in iter_output_lines(proc.stdout, decode):
+                with lines_lock:
+                    lines.append(line)
+
+        reader = threading.Thread(target=pump, daemon=True)
+        reader.start()
+        # 定期回传输出并续约，协调端要求取消时结束进程
+        while reader.is_alive():
+            reader.join(heartbeat)
+            with lines_lock:
+                batch, lines[:] = list(lines), []
+            try:
+                reply = self._post("/progress", dict(ident, lines=batch)) or {}
+            except (urllib.error.URLError, OSError, ValueError):
+                continue
+            if reply.get("cancel"):
+                kill_process_tree(proc)
+        usage = wait_with_usage(proc)
+        with lines_lock:
+            batch = list(lines)
+        self._complete(dict(ident, lines=batch, returncode=proc.returncode, seconds=time.monotonic() - started, usage=usage))
+
+    def _complete(self, payload):
+        # 回报失败时重试几次，仍失败则由协调端的租约超时重新排队
+        for _ in range(5):
+            try:
+                self._post("/complete", payload)
+                return
+            except (urllib.error.URLError, OSError, ValueError):
+                time.sleep(self.poll_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch_remote", description="分布式批处理执行端")
+    parser.add_argument("server", help="协调端地址，如 http://192.168.1.10:8765")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="本机并发任务数")
+    parser.add_argument("--name", default=None, help="本机在协调端显示的名称，默认为主机名")
+    parser.add_argument("--token", default=None, help="与协调端一致的访问口令")
+    args = parser.parse_args(argv)
+
+    try:
+        agent = Agent(args.server, args.jobs, args.name, args.token)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"执行端 {agent.host} 已启动，并发 {agent.slots}，协调端 {agent.server_url}", flush=True)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
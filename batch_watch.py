@@ -0,0 +1,176 @@
+"""监视文件夹：持续发现新到达的媒体文件，文件大小稳定后交给 BatchRunner 处理。
+
+Linux 上使用 inotify 获取文件变化通知，其他平台或 inotify 不可用时退回定时扫描。
+无论哪种方式，文件都要在 stable_seconds 秒内大小与修改时间不变才算写入完成。
+"""
+import os
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+
+from batch_core import ALWAYS_EXCLUDE, SUPPORTED_EXTS, iter_media_files, path_excluded
+
+# 文件大小保持不变多少秒后才开始处理
+STABLE_SECONDS = 5
+# 检查稳定性 / 定时扫描的间隔 (秒)
+POLL_SECONDS = 1.0
+
+
+class Inotify:
+    """基于 ctypes 的最小 inotify 封装，只监视文件夹"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.dirs = {}      # 监视描述符 -> 文件夹
+
+    @staticmethod
+    def available():
+        return hasattr(select, "poll") and os.path.exists("/proc/sys/fs/inotify")
+
+    @classmethod
+    def open(cls):
+        """当前平台支持时返回实例，否则返回 None"""
+        if not cls.available():
+            return None
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+    def add(self, folder):
+        wd = self._add_watch(self.fd, os.fsencode(folder), self.MASK)
+        if wd >= 0:
+            self.dirs[wd] = folder
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回 [(路径, mask)]；事件队列溢出时路径为 None"""
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(timeout * 1000):
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif wd in self.dirs and name:
+                events.append((os.path.join(self.dirs[wd], os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    """监视 folder 下的媒体文件 (参数含义同 batch_core.iter_media_files)，watch() 逐个产出已写完的文件"""
+
+    def __init__(self, folder, recursive=False, exts=SUPPORTED_EXTS, excludes=(), max_depth=None,
+                 stable_seconds=STABLE_SECONDS, poll_seconds=POLL_SECONDS):
+        self.folder = os.path.abspath(folder)
+        self.recursive = recursive
+        self.exts = exts
+        self.excludes = ALWAYS_EXCLUDE + tuple(excludes or ())
+        self.max_depth = max_depth
+        self.stable_seconds = stable_seconds
+        self.poll_seconds = poll_seconds
+        self.mode = "inotify" if Inotify.available() else "定时扫描"
+        self.pending = {}       # 路径 -> [(大小, 修改时间), 该状态最早出现的时刻]
+        self.emitted = {}       # 已产出的路径 -> 产出时的 (大小, 修改时间)
+
+    @staticmethod
+    def signature(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    def consider(self, path):
+        """记录一个可能的新文件，稍后检查其是否写完"""
+        if path in self.pending:
+            return
+        if not path.lower().endswith(self.exts) or path_excluded(path, self.folder, self.excludes):
+            return
+        try:
+            sig = self.signature(path)
+        except OSError:
+            return
+        # 已处理过且未再变化的文件不重复产出；同名文件被替换后会重新处理
+        if self.emitted.get(path) != sig:
+            self.pending[path] = [sig, time.monotonic()]
+
+    def scan(self, top, notify=None):
+        """扫描 top 下的文件，同时为每个文件夹加上 inotify 监视"""
+        max_depth = self.max_depth
+        if max_depth is not None and top != self.folder:
+            max_depth -= os.path.relpath(top, self.folder).count(os.sep) + 1
+            if max_depth < 0:
+                return
+        on_dir = notify.add if notify else None
+        for path, _ in iter_media_files([top], self.recursive, self.exts, self.excludes, max_depth, on_dir=on_dir):
+            self.consider(path)
+
+    def ready(self):
+        """返回已稳定的文件并从待定列表移除"""
+        now = time.monotonic()
+        done = []
+        for path, state in list(self.pending.items()):
+            try:
+                sig = self.signature(path)
+            except OSError:
+                # 文件已被移走或删除
+                del self.pending[path]
+                continue
+            if sig != state[0]:
+                state[0], state[1] = sig, now
+            elif now - state[1] >= self.stable_seconds:
+                del self.pending[path]
+                self.emitted[path] = sig
+                done.append(path)
+        return done
+
+    def watch(self, is_running=lambda: True):
+        """持续产出写完的文件，直到 is_running() 返回假；启动时已有的文件同样会产出"""
+        notify = Inotify.open()
+        self.mode = "inotify" if notify else "定时扫描"
+        try:
+            self.scan(self.folder, notify)
+            while is_running():
+                if notify:
+                    for path, mask in notify.read(self.poll_seconds):
+                        if path is None:
+                            # 事件丢失，整体重扫一遍
+                            self.scan(self.folder, notify)
+                        elif mask & Inotify.IN_ISDIR:
+                            if self.recursive and not path_excluded(path, self.folder, self.excludes):
+                                self.scan(path, notify)
+                        else:
+                            self.consider(path)
+                else:
+                    time.sleep(self.poll_seconds)
+                    self.scan(self.folder)
+                for path in self.ready():
+                    yield path
+        finally:
+            if notify:
+                notify.close()
@@ -1,17 +1,35 @@
 import os
-import json
-import time
 import subprocess
 import threading
 import re
-from datetime import datetime, timedelta
+import time
+import queue
+import sqlite3
 from tkinter import filedialog, messagebox, Menu,font
 import ttkbootstrap as ttkb
 from ttkbootstrap.constants import *
 from tkinterdnd2 import DND_FILES, TkinterDnD
 
-# 配置文件
-CONFIG_FILE = "cmd_presets.json"
+from batch_core import (
+    VIDEO_EXTS, AUDIO_EXTS, QUEUE_ORDERS, DISK_MIN_FREE,
+    guess_resource, normalize_preset, class_limits_from, iter_media_files, format_seconds,
+    LogWriter, BatchLogFile, BuildManifest, BatchJournal, BatchSettings, BatchRunner, ProbeCache, ProbePool, Prober, FileListModel,
+    PresetStore,
+)
+from batch_watch import FolderWatcher
+from batch_metrics import MetricsServer, DEFAULT_PORT as METRICS_PORT
+
+# 日志刷新间隔 (毫秒) 及日志框默认保留的最大行数
+LOG_FLUSH_MS = 100
+LOG_MAX_LINES = 5000
+# 单次刷新最多渲染的日志条数，其余留到下一帧
+LOG_BATCH_LIMIT = 2000
+# 槽位面板的刷新间隔 (毫秒)
+SLOT_PANEL_MS = 1000
+# 后台扫描每攒够这么多文件或间隔这么久 (秒) 就插入列表一次
+SCAN_BATCH_SIZE = 500
+SCAN_BATCH_SECONDS = 0.2
+
 
 class BatchProcessorApp:
     def __init__(self, root):
@@ -27,14 +45,58 @@ class BatchProcessorApp:
         
         # 核心变量
         # 支持的文件格式
-        self.video_exts = ('.mp4', '.mkv', '.avi', '.mpeg', '.mpg', '.wmv')
-        self.audio_exts = ('.mp3', '.aac', '.mka', '.mpa', '.flac', '.wav', '.wma', '.ogg', '.ape')
-        self.process_signal= ["frame=", "time=", "正在处理视频："]
+        self.video_exts = VIDEO_EXTS
+        self.audio_exts = AUDIO_EXTS
+        self.process_signal= ["frame=", "time=", "正在处理视频：", "处理进度："]
         self.is_running = False
-        self.current_process = None 
+        self.runner = None
+        self.progress_marks = set()     # 各槽位进度行在日志框中的位置标记
+        self.last_log_is_progress = False
+        self.concurrency_var = ttkb.IntVar(value=os.cpu_count() or 1)
+        self.auto_slots_var = ttkb.BooleanVar(value=False)
+        self.log_max_lines_var = ttkb.IntVar(value=LOG_MAX_LINES)
+        self.queue_order_var = ttkb.StringVar(value=QUEUE_ORDERS["list"])
+        self.log_queue = queue.SimpleQueue()
+        self.log_writer = LogWriter(on_error=self.on_log_error)
+        self.log_file = BatchLogFile(self.log_writer)
+        self.job_log_writer = LogWriter(on_error=self.on_log_error)
+        self.job_log_var = ttkb.BooleanVar(value=False)
+        self.perf_report_var = ttkb.BooleanVar(value=False)
+        self.min_free_var = ttkb.DoubleVar(value=DISK_MIN_FREE / 1024 ** 3)   # 输出磁盘至少保留 (GB)
+        self.max_write_var = ttkb.DoubleVar(value=0)    # 写入带宽上限 (MB/s)，0 不限
+        self.remote_var = ttkb.BooleanVar(value=False)
+        self.remote_port_var = ttkb.IntVar(value=8765)
+        self.remote_token_var = ttkb.StringVar(value="")
+        self.job_server = None
+        self.metrics_var = ttkb.BooleanVar(value=False)
+        self.metrics_port_var = ttkb.IntVar(value=METRICS_PORT)
+        self.metrics_server = None
+        self.slot_panel_after = None    # 槽位面板下一次刷新的 after 编号，未在刷新时为 None
+        self.presets = {}
+        self.preset_store = PresetStore()
+        try:
+            self.probe_cache = ProbeCache()
+        except sqlite3.Error:
+            self.probe_cache = None
+        self.prober = Prober(self.probe_cache)
+        try:
+            self.manifest = BuildManifest()
+        except sqlite3.Error:
+            self.manifest = None
+        self.probe_pool = ProbePool(self.prober.probe_entry)
+        self.probe_outstanding = 0
+        self.model = FileListModel()
+        self.view_start = 0             # Treeview 可见窗口在列表中的起始位置
         self.recursive_var = ttkb.BooleanVar(value=False)
+        self.scan_depth_var = ttkb.IntVar(value=0)         # 递归层数，0 为不限
+        self.scan_exclude_var = ttkb.StringVar(value="")   # 排除的通配符，分号分隔
+        self.scan_cancel = None         # 当前这轮扫描的取消事件，空闲时为 None
+        self.scans_running = 0
+        self.scan_count = 0
         self.shutdown_var = ttkb.BooleanVar(value=False)
+        self.rerun_failed_var = ttkb.BooleanVar(value=False)    # 整批结束后重跑失败的任务
         self.overwrite_var = ttkb.StringVar(value="skip") 
+        self.hash_sample_var = ttkb.BooleanVar(value=False)
         self.output_path_var = ttkb.StringVar(value="")
         self.naming_rule_var = ttkb.StringVar(value="{name}_done{ext}")
         self.use_own_dir = True
@@ -43,6 +105,8 @@ class BatchProcessorApp:
         self.create_context_menu()
         self.load_presets()
         self.register_dnd()
+        self.root.after(LOG_FLUSH_MS, self.flush_logs)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_ui(self):
 
@@ -63,9 +127,18 @@ class BatchProcessorApp:
         in_btn_frame.pack(fill=X, pady=(0, 10))
         ttkb.Button(in_btn_frame, text="🎬 添加文件", command=self.add_files, bootstyle="primary-link").pack(side=LEFT, padx=5)
         ttkb.Button(in_btn_frame, text="📂 添加文件夹", command=self.add_folder, bootstyle="warning-link").pack(side=LEFT, padx=5)
+        ttkb.Button(in_btn_frame, text="👁 监视文件夹", command=self.watch_folder, bootstyle="info-link").pack(side=LEFT, padx=5)
         style.configure("MyColor.TCheckbutton", foreground="seagreen")
         ttkb.Checkbutton(in_btn_frame, text="递归子目录", variable=self.recursive_var, style="MyColor.TCheckbutton").pack(side=LEFT, padx=10)
+        ttkb.Label(in_btn_frame, text="层数(0=不限):").pack(side=LEFT)
+        ttkb.Spinbox(in_btn_frame, textvariable=self.scan_depth_var, from_=0, to=99, width=3).pack(side=LEFT, padx=(2, 8))
+        ttkb.Label(in_btn_frame, text="排除:").pack(side=LEFT)
+        ttkb.Entry(in_btn_frame, textvariable=self.scan_exclude_var, width=14).pack(side=LEFT, padx=2)
         ttkb.Button(in_btn_frame, text="清空列表", command=self.clear_list, bootstyle="danger-link",width=8).pack(side=RIGHT, padx=0)
+        self.scan_btn = ttkb.Button(in_btn_frame, text="取消扫描", command=self.cancel_scan, bootstyle="secondary-link", state=DISABLED)
+        self.scan_btn.pack(side=RIGHT)
+        self.scan_lbl = ttkb.Label(in_btn_frame, text="", bootstyle="secondary", font=("Microsoft YaHei", 9))
+        self.scan_lbl.pack(side=RIGHT, padx=5)
 
         # 文件列表框：
         tree_container = ttkb.Frame(input_tab)
@@ -101,9 +174,16 @@ class BatchProcessorApp:
         # 双向绑定
         self.tree.configure(xscrollcommand=hbar.set)
         hbar.configure(command=self.tree.xview)
+        # 垂直滚动条滚动的是数据模型，Treeview 只渲染可见的几行
+        self.vbar = ttkb.Scrollbar(tree_container, orient=VERTICAL, bootstyle="primary", command=self.on_vscroll)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_view(-3 if e.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_view(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_view(3))
+        self.tree.bind("<Configure>", lambda e: self.refresh_view())
 
         # 采用 grid 布局
         self.tree.grid(row=0, column=0, sticky=NSEW)
+        self.vbar.grid(row=0, column=1, sticky=NS)
         hbar.grid(row=1, column=0, sticky=EW)
         # 设置权重，应对扩展
         tree_container.grid_columnconfigure(0, weight=1)
@@ -127,6 +207,56 @@ class BatchProcessorApp:
         conflict_f.grid(row=2, column=1, sticky=W)
         ttkb.Radiobutton(conflict_f, text="跳过现有文件", variable=self.overwrite_var, bootstyle="info",value="skip").pack(side=LEFT, padx=5)
         ttkb.Radiobutton(conflict_f, text="强制覆盖", variable=self.overwrite_var, bootstyle="info", value="overwrite").pack(side=LEFT, padx=5)
+        ttkb.Radiobutton(conflict_f, text="增量更新", variable=self.overwrite_var, bootstyle="info", value="incremental").pack(side=LEFT, padx=5)
+        ttkb.Checkbutton(conflict_f, text="抽样哈希校验", variable=self.hash_sample_var, style="MyColor.TCheckbutton").pack(side=LEFT, padx=5)
+
+        ttkb.Label(output_tab, text="并发任务:").grid(row=3, column=0, sticky=W, pady=15)
+        slots_f = ttkb.Frame(output_tab)
+        slots_f.grid(row=3, column=1, sticky=W, padx=5)
+        ttkb.Spinbox(slots_f, textvariable=self.concurrency_var, from_=1, to=128, width=8).pack(side=LEFT)
+        ttkb.Checkbutton(slots_f, text="按系统负载自动调节", variable=self.auto_slots_var, style="MyColor.TCheckbutton").pack(side=LEFT, padx=10)
+        ttkb.Label(output_tab, text="同时运行的任务数，默认=CPU核数；自动调节时为起始值", font=("Microsoft YaHei", 9)).grid(row=3, column=2)
+
+        ttkb.Label(output_tab, text="日志行数:").grid(row=4, column=0, sticky=W)
+        ttkb.Spinbox(output_tab, textvariable=self.log_max_lines_var, from_=100, to=1000000, increment=1000, width=8).grid(row=4, column=1, sticky=W, padx=5)
+        ttkb.Label(output_tab, text="日志框保留的最大行数", font=("Microsoft YaHei", 9)).grid(row=4, column=2)
+        ttkb.Label(output_tab, text="队列顺序:").grid(row=5, column=0, sticky=W)
+        ttkb.Combobox(output_tab, textvariable=self.queue_order_var, values=list(QUEUE_ORDERS.values()), state="readonly", width=22).grid(row=5, column=1, sticky=W, padx=5)
+        ttkb.Label(output_tab, text="按探测到的时长/大小/编码排序后派发", font=("Microsoft YaHei", 9)).grid(row=5, column=2)
+
+        log_opts = ttkb.Frame(output_tab)
+        log_opts.grid(row=6, column=1, sticky=W, padx=5, pady=15)
+        ttkb.Checkbutton(log_opts, text="输出 JSONL 任务日志 (batch_jobs.jsonl)", variable=self.job_log_var, style="MyColor.TCheckbutton").pack(side=LEFT)
+        ttkb.Checkbutton(log_opts, text="导出性能报告 (batch_perf.csv/json)", variable=self.perf_report_var, style="MyColor.TCheckbutton").pack(side=LEFT, padx=(15, 0))
+
+        ttkb.Label(output_tab, text="远程执行:").grid(row=7, column=0, sticky=W)
+        remote_f = ttkb.Frame(output_tab)
+        remote_f.grid(row=7, column=1, sticky=W, padx=5)
+        ttkb.Checkbutton(remote_f, text="作为协调端", variable=self.remote_var, style="MyColor.TCheckbutton").pack(side=LEFT)
+        ttkb.Label(remote_f, text="端口").pack(side=LEFT, padx=(10, 2))
+        ttkb.Spinbox(remote_f, textvariable=self.remote_port_var, from_=1024, to=65535, width=6).pack(side=LEFT)
+        ttkb.Label(remote_f, text="口令").pack(side=LEFT, padx=(10, 2))
+        ttkb.Entry(remote_f, textvariable=self.remote_token_var, width=12, show="*").pack(side=LEFT)
+        ttkb.Label(output_tab, text="执行端: python -m batch_remote http://本机:端口", font=("Microsoft YaHei", 9)).grid(row=7, column=2)
+
+        ttkb.Label(output_tab, text="磁盘保护:").grid(row=8, column=0, sticky=W, pady=15)
+        disk_f = ttkb.Frame(output_tab)
+        disk_f.grid(row=8, column=1, sticky=W, padx=5)
+        ttkb.Label(disk_f, text="至少保留").pack(side=LEFT)
+        ttkb.Spinbox(disk_f, textvariable=self.min_free_var, from_=0, to=100000, increment=1, width=6).pack(side=LEFT, padx=2)
+        ttkb.Label(disk_f, text="GB").pack(side=LEFT)
+        ttkb.Label(disk_f, text="写入上限").pack(side=LEFT, padx=(15, 0))
+        ttkb.Spinbox(disk_f, textvariable=self.max_write_var, from_=0, to=100000, increment=10, width=6).pack(side=LEFT, padx=2)
+        ttkb.Label(disk_f, text="MB/s").pack(side=LEFT)
+        ttkb.Label(output_tab, text="剩余空间不足时暂停派发任务；写入上限 0 为不限", font=("Microsoft YaHei", 9)).grid(row=8, column=2)
+
+        ttkb.Label(output_tab, text="运行指标:").grid(row=9, column=0, sticky=W)
+        metrics_f = ttkb.Frame(output_tab)
+        metrics_f.grid(row=9, column=1, sticky=W, padx=5)
+        ttkb.Checkbutton(metrics_f, text="提供指标接口", variable=self.metrics_var, style="MyColor.TCheckbutton").pack(side=LEFT)
+        ttkb.Label(metrics_f, text="端口").pack(side=LEFT, padx=(10, 2))
+        ttkb.Spinbox(metrics_f, textvariable=self.metrics_port_var, from_=1024, to=65535, width=6).pack(side=LEFT)
+        ttkb.Label(output_tab, text="本机 http://127.0.0.1:端口/metrics (Prometheus) 或 /metrics.json", font=("Microsoft YaHei", 9)).grid(row=9, column=2)
         output_tab.columnconfigure(1, weight=1)
 
         # --- 2. 命令编辑区 (常驻) ---
@@ -140,6 +270,8 @@ class BatchProcessorApp:
         self.preset_combo.pack(side=LEFT, padx=(5,0))
         self.preset_combo.bind("<<ComboboxSelected>>", self.on_preset_change)
         ttkb.Button(preset_row, text="⚒️ 编 辑", command=self.edit_preset, bootstyle="dark-link", width=10,padding=0).pack(side=LEFT, padx=(0,10))
+        self.resource_lbl = ttkb.Label(preset_row, text="", bootstyle="secondary", font=("Microsoft YaHei", 9))
+        self.resource_lbl.pack(side=LEFT)
     
         
         ttkb.Button(preset_row, text="💾 保 存", command=self.save_preset, bootstyle="warning-link", width=10,padding=0).pack(side=RIGHT, padx=(0,5))
@@ -161,10 +293,13 @@ class BatchProcessorApp:
         self.stop_btn = ttkb.Button(button_f, text="⏹️ 终止任务", command=self.stop_process, bootstyle=DANGER, width=12, state=DISABLED)
         # self.stop_btn.pack(side=RIGHT, padx=5)
         
+        ttkb.Button(button_f, text="↻ 续跑上次任务", command=self.resume_last_batch, bootstyle="info-link").pack(side=RIGHT, padx=5)
+
         self.open_output = ttkb.Button(button_f, text="📂 打开输出目录", command=self.open_output_folder, bootstyle="warning-link")
         self.open_output.pack(side=RIGHT, padx=5)
 
         ttkb.Checkbutton(button_f, text="完成后关机", variable=self.shutdown_var, style="MyColor.TCheckbutton", width=15).pack(side=RIGHT, padx=(5,5))
+        ttkb.Checkbutton(button_f, text="结束后重跑失败任务", variable=self.rerun_failed_var, style="MyColor.TCheckbutton").pack(side=RIGHT, padx=(5,5))
         ttkb.Button(button_f, text="🗑清空日志", command=self.clear_logs, bootstyle="warning-link").pack(side=LEFT)
 
         # 日志工具栏
@@ -186,8 +321,18 @@ class BatchProcessorApp:
         self.progress = ttkb.Progressbar(status_f, bootstyle="success")
         self.progress.grid(row=0, column=0, sticky=EW, padx=(0,5))
         
-        self.status_lbl = ttkb.Label(status_f, text="就绪", anchor=E, width=20)
+        self.status_lbl = ttkb.Label(status_f, text="就绪", anchor=E, width=32)
         self.status_lbl.grid(row=0, column=1, sticky=E, padx=(5,0))
+        # 分布式执行时显示各执行端的吞吐
+        self.hosts_lbl = ttkb.Label(status_f, text="", anchor=W, font=("Microsoft YaHei", 9), bootstyle="secondary")
+        self.hosts_lbl.grid(row=1, column=0, columnspan=2, sticky=EW)
+        # 各槽位正在处理的任务，与指标接口读取同一份计数；运行时才显示
+        slot_columns = {"slot": ("槽位", 50), "file": ("文件", 320), "percent": ("进度", 70),
+                        "fps": ("fps", 60), "speed": ("速度", 60), "eta": ("剩余", 80)}
+        self.slot_tree = ttkb.Treeview(status_f, columns=list(slot_columns), show='headings', height=3, bootstyle="secondary")
+        for col, (text, width) in slot_columns.items():
+            self.slot_tree.heading(col, text=text, anchor=W)
+            self.slot_tree.column(col, width=width, anchor=W, stretch=(col == "file"))
         
 
     # --- 日志与路径操作 ---
@@ -196,26 +341,100 @@ class BatchProcessorApp:
         self.log_area.configure(state=NORMAL)
         self.log_area.delete("1.0", END)
         self.log_area.configure(state=DISABLED)
+        for mark in self.progress_marks:
+            self.log_area.mark_unset(mark)
+        self.progress_marks.clear()
+        self.last_log_is_progress = False
 
     def save_log(self, content, first_time=False):
-        """将当前日志保存到输出目录"""
-        out_dir = self.output_path_var.get()
-        if not os.path.exists(out_dir):
-            os.makedirs(out_dir)
-        log_file = os.path.join(out_dir, f"batch_cmd.log")
-    
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")      
-        try:
-            if first_time:
-                with open(log_file, "w", encoding="utf-8") as f:
-                    f.write(f"[{timestamp}] {content}")
-                    # self.log_area.insert(END, f"日志保存至：\n{log_file}", "信息")
+        """将日志交给后台写入线程保存到输出目录"""
+        self.log_file.write(self.output_path_var.get(), content, first_time)
+
+    def on_log_error(self, e):
+        # 写入线程中调用，经由日志队列显示，不再写回文件
+        self.log(f"无法保存日志：{e}", "命令")
+
+    def ensure_job_server(self):
+        """按需启动协调端任务服务器，启动失败返回 None"""
+        port = int(self.remote_port_var.get())
+        token = self.remote_token_var.get().strip() or None
+        if self.job_server and (self.job_server.address[1] != port or self.job_server.token != token):
+            self.job_server.close()
+            self.job_server = None
+        if self.job_server is None:
+            from batch_remote import JobServer, default_host
+            try:
+                self.job_server = JobServer(default_host(token), port, token=token, log=self.log)
+            except OSError as e:
+                messagebox.showwarning("警告", f"无法启动协调端：{e}")
+                return None
+            self.log(f"协调端已在端口 {port} 监听，等待执行端领取任务", "信息")
+            if not token:
+                self.log("未设置口令，协调端只接受本机的执行端；其他主机需要设置口令后才能连接", "错误")
+            self.refresh_hosts()
+        return self.job_server
+
+    def refresh_hosts(self):
+        """每 2 秒刷新一次各执行端的吞吐"""
+        if not self.job_server:
+            self.hosts_lbl.configure(text="")
+            return
+        parts = [f"{h['host']}: {h['jobs_per_minute']} 任务/分，运行 {h['running']}，完成 {h['completed']}，失败 {h['failed']}"
+                 for h in self.job_server.host_stats()]
+        self.hosts_lbl.configure(text=" | ".join(parts) or "暂无执行端连接")
+        self.root.after(2000, self.refresh_hosts)
+
+    def ensure_metrics_server(self):
+        """按需启动指标接口 (只监听本机)，端口改变时重新启动"""
+        port = int(self.metrics_port_var.get())
+        if self.metrics_server and self.metrics_server.address[1] != port:
+            self.metrics_server.close()
+            self.metrics_server = None
+        if self.metrics_server is None:
+            try:
+                self.metrics_server = MetricsServer(lambda: self.runner.metrics() if self.runner else None, port=port)
+            except OSError as e:
+                self.log(f"无法启动指标接口：{e}", "错误")
+                return
+            self.log(f"运行指标：http://127.0.0.1:{port}/metrics", "信息")
+
+    def refresh_slots(self):
+        """运行期间定时刷新槽位面板，批处理结束后收起"""
+        if not (self.is_running and self.runner):
+            self.slot_panel_after = None
+            self.slot_tree.delete(*self.slot_tree.get_children())
+            self.slot_tree.grid_remove()
+            return
+        rows = []
+        for s in self.runner.metrics()["slots"]:
+            rows.append((
+                s["slot"], s["file"],
+                f"{s['percent']:.1f}%" if s["percent"] is not None else format_seconds(s["out_time"] or 0),
+                f"{s['fps']:g}" if s["fps"] is not None else "",
+                f"{s['speed']:g}x" if s["speed"] is not None else "",
+                format_seconds(s["eta"]) if s["eta"] is not None else "",
+            ))
+        items = self.slot_tree.get_children()
+        for k, values in enumerate(rows):
+            if k < len(items):
+                self.slot_tree.item(items[k], values=values)
             else:
-                with open(log_file, "a", encoding="utf-8") as f:
-                    f.write(f"\n[{timestamp}] {content}")
-            
-        except Exception as e:
-            self.log_area.insert(END, f"无法保存日志：{e}", "错误")
+                self.slot_tree.insert("", END, values=values)
+        if len(items) > len(rows):
+            self.slot_tree.delete(*items[len(rows):])
+        self.slot_panel_after = self.root.after(SLOT_PANEL_MS, self.refresh_slots)
+
+    def on_close(self):
+        """关闭窗口前把缓冲中的日志写入磁盘"""
+        if self.job_server:
+            self.job_server.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        self.log_writer.close()
+        self.job_log_writer.close()
+        if self.probe_cache:
+            self.probe_cache.flush()
+        self.root.destroy()
 
     def open_output_folder(self):
         """打开输出文件夹"""
@@ -232,40 +451,75 @@ class BatchProcessorApp:
             return
         if messagebox.askyesno("确认", "确定要强制终止当前任务并停止队列吗？"):
             self.is_running = False
-            if self.current_process:
-                try:
-                    # Windows下彻底杀死进程树
-                    subprocess.run(f"taskkill /F /T /PID {self.current_process.pid}", shell=True, capture_output=True)
-                except:
-                    self.current_process.terminate()
+            if self.runner:
+                self.runner.stop()
             self.log("🛑 任务已被用户手动终止！", "错误")
             self.start_btn.configure(text="💪 开始批处理", command=self.start_process, bootstyle="success", width=12)
 
-    def log(self, message, level="命令"):
-        self.log_area.configure(state=NORMAL)
-        # 识别是否为 FFmpeg 进度行
-        is_progress_line = False
-        for id in self.process_signal:
-            if id in message:
-                is_progress_line = True
-                break
-        
-        if is_progress_line and self.last_log_is_progress:
+    def log(self, message, level="命令", slot=None):
+        """线程安全：日志先进入队列，由 flush_logs 按固定帧率批量渲染"""
+        self.log_queue.put((message, level, slot))
+
+    def flush_logs(self):
+        """定时取出队列中的日志，合并同一槽位的连续进度行后一次性写入日志框"""
+        batch = []
+        try:
+            while len(batch) < LOG_BATCH_LIMIT:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if batch:
+            lines = []
+            progress_pos = {}   # 槽位 -> 本批中尚可被覆盖的进度行位置
+            for message, level, slot in batch:
+                is_progress_line = any(id in message for id in self.process_signal)
+                if is_progress_line and slot in progress_pos:
+                    lines[progress_pos[slot]] = (message, level, slot, True)
+                    continue
+                lines.append((message, level, slot, is_progress_line))
+                if is_progress_line:
+                    progress_pos[slot] = len(lines) - 1
+                else:
+                    progress_pos.pop(slot, None)
+                    # 无槽位的进度行依赖"上一行"判断，中间插入了其他日志就不能再合并
+                    progress_pos.pop(None, None)
+
+            self.log_area.configure(state=NORMAL)
+            for message, level, slot, is_progress_line in lines:
+                self.render_log_line(message, level, slot, is_progress_line)
+            self.trim_logs()
+            self.log_area.see(END)
+            self.log_area.configure(state=DISABLED)
+
+        self.root.after(LOG_FLUSH_MS, self.flush_logs)
+
+    def render_log_line(self, message, level, slot, is_progress_line):
+        # 并发执行时每个槽位各自保留一行进度，用标记记录该行的位置
+        mark = f"progress_{slot}" if slot is not None else None
+
+        if is_progress_line and mark in self.progress_marks:
+            # 覆盖该槽位原有的进度行
+            self.log_area.delete(mark, f"{mark} lineend")
+            self.log_area.insert(mark, f"[{level}] ", "time")
+            self.log_area.insert(f"{mark} lineend", message.strip(), "进展")
+        elif is_progress_line and mark is None and self.last_log_is_progress:
             # 如果上一行也是进度，删除最后一行 (从倒数第二字符开始所在的行首，到结尾)
             self.log_area.delete("end-2c linestart", "end-1c")
-        
-        # timestamp = datetime.now().strftime("[%H:%M:%S] ")
-        
-        # 插入新内容
-        if is_progress_line:
+            self.log_area.insert(END, f"[{level}] ", "time")
+            self.log_area.insert(END, f"{message.strip()}\n", "进展")
+        elif is_progress_line:
             # 进度行不强制换行，但为了 delete 逻辑，末尾加 \n
-            # self.log_area.insert(END, timestamp, "time")
+            start = self.log_area.index("end-1c")
             self.log_area.insert(END, f"[{level}] ", "time")
             self.log_area.insert(END, f"{message.strip()}\n", "进展")
+            if mark:
+                self.log_area.mark_set(mark, start)
+                self.log_area.mark_gravity(mark, LEFT)
+                self.progress_marks.add(mark)
             self.last_log_is_progress = True
         else:
             # 普通日志：换行显示
-            # self.log_area.insert(END, timestamp, "time")
             self.log_area.insert(END, f"[{level}] ", "time")
             self.log_area.insert(END, f"{message.strip()}\n", level)
             # 保存日志到文件
@@ -273,8 +527,27 @@ class BatchProcessorApp:
                 self.save_log(message.strip())
             self.last_log_is_progress = False
 
-        self.log_area.see(END)
-        self.log_area.configure(state=DISABLED)
+        # 槽位任务结束后，下一个任务重新开始一行进度
+        if not is_progress_line and mark in self.progress_marks and level == "信息":
+            self.log_area.mark_unset(mark)
+            self.progress_marks.discard(mark)
+
+    def trim_logs(self):
+        """日志超过上限时删除最早的行，保持内存占用稳定"""
+        try:
+            max_lines = max(100, int(self.log_max_lines_var.get()))
+        except Exception:
+            max_lines = LOG_MAX_LINES
+        line_count = int(self.log_area.index("end-1c").split(".")[0])
+        excess = line_count - max_lines
+        if excess <= 0:
+            return
+        # 进度行被删除时同时移除其标记，避免标记落到第一行上覆盖其他内容
+        for mark in list(self.progress_marks):
+            if int(self.log_area.index(mark).split(".")[0]) <= excess:
+                self.log_area.mark_unset(mark)
+                self.progress_marks.discard(mark)
+        self.log_area.delete("1.0", f"{excess + 1}.0")
 
     # --- 右键菜单 ---
     def create_context_menu(self):
@@ -292,129 +565,163 @@ class BatchProcessorApp:
 
     # --- 媒体信息与列表管理 ---
     def get_media_info(self, file_path):
-        try:
-            cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', file_path]
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            data = json.loads(result.stdout)
-            f = data.get('format', {})
-            streams = data.get('streams', [])
-            size = f"{int(f.get('size', 0)) / (1024*1024):.2f} MB"
-            dur = time.strftime('%H:%M:%S', time.gmtime(float(f.get('duration', 0))))
-            v_codec, v_br, a_codec, a_br = "N/A", "N/A", "N/A", "N/A"
-            for s in streams:
-                br = f"{int(s.get('bit_rate', 0)) // 1000}k" if s.get('bit_rate') else "N/A"
-                if s.get('codec_type') == 'video':
-                    v_codec, v_br = s.get('codec_name', 'unknown'), br
-                elif s.get('codec_type') == 'audio':
-                    a_codec, a_br = s.get('codec_name', 'unknown'), br
-            return size, dur, v_codec, v_br, a_codec, a_br
-        except:
-            return "Error", "N/A", "N/A", "N/A", "N/A", "N/A"
+        return self.prober.probe_entry(file_path)[0]
 
     def move_item(self, direction):
         selected = self.tree.selection()
         if not selected: return
-        for item in selected:
-            idx = self.tree.index(item)
-            self.tree.move(item, '', idx + direction)
+        self.model.move(selected, direction)
+        # 被移到窗口之外时跟随滚动
+        positions = [i for i, e in enumerate(self.model.entries) if e.iid in selected]
+        if positions[0] < self.view_start:
+            self.view_start = positions[0]
+        elif positions[-1] >= self.view_start + self.visible_rows():
+            self.view_start = positions[-1] - self.visible_rows() + 1
+        self.refresh_view(selected)
 
     def delete_selected(self):
-        for item in self.tree.selection():
-            self.tree.delete(item)
+        self.model.remove(self.tree.selection())
+        self.refresh_view()
+
+    # --- 文件列表可见窗口 ---
+    def visible_rows(self):
+        """Treeview 当前高度能显示的行数"""
+        return max(5, self.tree.winfo_height() // 30 + 1)
+
+    def refresh_view(self, selection=None):
+        """按 view_start 重新渲染可见窗口内的行"""
+        rows = self.visible_rows()
+        total = len(self.model)
+        self.view_start = max(0, min(self.view_start, total - rows + 1))
+        if selection is None:
+            selection = self.tree.selection()
+        self.tree.delete(*self.tree.get_children())
+        for entry in self.model.entries[self.view_start:self.view_start + rows]:
+            self.tree.insert("", END, iid=entry.iid, values=entry.values())
+        keep = [iid for iid in selection if self.tree.exists(iid)]
+        if keep:
+            self.tree.selection_set(keep)
+        if total:
+            self.vbar.set(self.view_start / total, min(1.0, (self.view_start + rows) / total))
+        else:
+            self.vbar.set(0, 1)
+
+    def scroll_view(self, delta):
+        self.view_start += delta
+        self.refresh_view()
+
+    def on_vscroll(self, action, value, unit=None):
+        if action == "moveto":
+            self.view_start = int(float(value) * len(self.model))
+        elif unit == "pages":
+            self.view_start += int(value) * self.visible_rows()
+        else:
+            self.view_start += int(value)
+        self.refresh_view()
 
     def add_to_list(self, *paths):
-        if not paths: return
-        files_input = []
-        supported_exts = list(self.video_exts).extend(list(self.audio_exts))
-        for path in paths:
-            # 如果路径是文件夹，则递归或直接遍历其下的文件
-            if os.path.isdir(path):
-                if self.recursive_var.get():
-                    # 递归模式
-                    for root_dir, _, files in os.walk(path):
-                        for f in files:
-                            if f.lower().endswith(supported_exts):
-                                files_input.append(os.path.join(root_dir, f))
-                else:
-                    # 非递归模式，只看当前层级
-                    for f in os.listdir(path):
-                        full_p = os.path.join(path, f)
-                        if os.path.isfile(full_p) and f.lower().endswith(supported_exts):
-                            files_input.append(full_p)
-            else:   # 单文件
-                if os.path.isfile(path) and path.lower().endswith(supported_exts):
-                    files_input.append(path)
-        
-        # 检查文件列表框里是否已存在
-        files_in_list = [self.tree.item(item)['values'][-1] for item in self.tree.get_children()]
-        seen = set(files_in_list)
-        new_paths = []
-        for path in files_input:
-            if path not in seen:
-                new_paths.append(path)
-                seen.add(path)
-
-        """更新文件列表 Treeview"""
-        # 清空现有内容
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-
-        # 重新插入数据
-        for file in seen:  
-            info = self.get_media_info(file)
-            self.tree.insert("", END, values=(os.path.basename(file), *info, file))
-    def add_to_list(self, *paths):
+        """在后台线程扫描 paths，找到的文件分批插入列表，扫描期间可随时取消"""
         if not paths:
             return
-        # 1. 修复 extend 返回 None 的 Bug，并转换为 tuple (endswith 接受 tuple 效率更高)
-        # 使用 set 去重并预处理为小写
-        supported_exts = tuple(ext.lower() for ext in (set(self.video_exts) | set(self.audio_exts)))
-        # 2. 获取当前 Treeview 中已有的路径，避免重复处理
-        # 假设路径存储在最后一列
-        existing_paths = {self.tree.item(item)['values'][-1] for item in self.tree.get_children()}
-        
+        excludes, max_depth = self.scan_options()
+        # 扫描进行中再次添加时并入同一轮，共用计数与取消按钮
+        if self.scan_cancel is None:
+            self.scan_cancel = threading.Event()
+            self.scan_count = 0
+            self.scan_btn.configure(state=NORMAL)
+            self.scan_lbl.configure(text="扫描中…")
+        self.scans_running += 1
+        threading.Thread(
+            target=self.scan_worker, daemon=True,
+            args=(paths, self.recursive_var.get(), excludes, max_depth, self.scan_cancel),
+        ).start()
+
+    def scan_options(self):
+        """返回界面上设置的 (排除通配符列表, 最大递归层数或 None)"""
+        try:
+            max_depth = max(0, int(self.scan_depth_var.get())) or None
+        except Exception:
+            max_depth = None
+            self.scan_depth_var.set(0)
+        return [p.strip() for p in self.scan_exclude_var.get().split(";") if p.strip()], max_depth
+
+    def scan_worker(self, paths, recursive, excludes, max_depth, cancel):
+        """扫描线程：按数量或时间攒批，交给主线程插入"""
+        batch = []
+        last = time.monotonic()
+        for item in iter_media_files(paths, recursive, excludes=excludes, max_depth=max_depth, cancel=cancel):
+            batch.append(item)
+            if len(batch) >= SCAN_BATCH_SIZE or time.monotonic() - last >= SCAN_BATCH_SECONDS:
+                self.root.after(0, self.add_scanned, batch, cancel)
+                batch = []
+                last = time.monotonic()
+        self.root.after(0, self.add_scanned, batch, cancel, True)
+
+    def add_scanned(self, batch, cancel, finished=False):
+        """主线程：插入一批扫描结果 (已取消的扫描结果直接丢弃)"""
+        if cancel.is_set():
+            return
+        self.scan_count += self.insert_files(batch)
+        self.scan_lbl.configure(text=f"扫描中… 已添加 {self.scan_count} 个文件")
+        if finished:
+            self.scans_running -= 1
+            if self.scans_running == 0:
+                self.end_scan(f"扫描完成，新增 {self.scan_count} 个文件")
+
+    def insert_files(self, items):
+        """把 (路径, 字节数) 追加到列表并提交探测，返回新增条数"""
         new_files_to_add = []
-        def is_supported(filename):
-            return filename.lower().endswith(supported_exts)
-        
-        # 3. 收集新增文件
-        for path in paths:
-            if os.path.isdir(path):
-                if self.recursive_var.get():
-                    # 递归模式：使用 os.walk
-                    for root_dir, _, files in os.walk(path):
-                        for f in files:
-                            full_p = os.path.join(root_dir, f)
-                            if is_supported(f) and full_p not in existing_paths:
-                                new_files_to_add.append(full_p)
-                                existing_paths.add(full_p) # 防止本次添加中出现重复
-                else:
-                    # 非递归模式：使用 os.scandir 性能比 listdir 更好
-                    with os.scandir(path) as it:
-                        for entry in it:
-                            if entry.is_file() and is_supported(entry.name) and entry.path not in existing_paths:
-                                new_files_to_add.append(entry.path)
-                                existing_paths.add(entry.path)
-            elif os.path.isfile(path):
-                if is_supported(path) and path not in existing_paths:
-                    new_files_to_add.append(path)
-                    existing_paths.add(path)
-        # 4. 增量更新 Treeview (不要清空现有内容)
-        # 这样可以避免对旧文件重复执行耗时的 get_media_info
-        for file_path in new_files_to_add:
-            try:
-                info = self.get_media_info(file_path)
-                # 插入新行
-                self.tree.insert(
-                    "", 
-                    "end", 
-                    values=(os.path.basename(file_path), *info, file_path)
-                )
-            except Exception as e:
-                print(f"解析媒体信息失败: {file_path}, 错误: {e}")
+        for path, size in items:
+            # 已有路径由数据模型的索引判断
+            entry = self.model.add(path)
+            if entry:
+                entry.size = size
+                new_files_to_add.append(entry)
+        if new_files_to_add:
+            # 只刷新可见窗口，媒体信息由后台探测池逐个补全，避免阻塞界面
+            self.refresh_view()
+            for entry in new_files_to_add:
+                self.probe_outstanding += 1
+                self.probe_pool.submit(entry.path, lambda info, entry=entry: self.root.after(0, self.fill_media_info, entry, info))
+        return len(new_files_to_add)
+
+    def cancel_scan(self):
+        if self.scan_cancel is not None:
+            self.scan_cancel.set()
+            self.end_scan(f"已取消扫描，新增 {self.scan_count} 个文件")
+
+    def end_scan(self, text):
+        self.scan_cancel = None
+        self.scans_running = 0
+        self.scan_btn.configure(state=DISABLED)
+        self.scan_lbl.configure(text=text)
+
+    def fill_media_info(self, entry, result):
+        """探测完成后回填对应条目的媒体信息列"""
+        info, entry.duration, entry.size = result
+        self.probe_outstanding = max(0, self.probe_outstanding - 1)
+        if self.probe_outstanding == 0:
+            self.report_probe_cache()
+        entry.info = info
+        if self.tree.exists(entry.iid):
+            self.tree.item(entry.iid, values=entry.values())
+
+    def report_probe_cache(self):
+        """一批探测全部完成后，落盘缓存并记录命中统计"""
+        if not self.probe_cache:
+            return
+        self.probe_cache.flush()
+        hits, misses = self.probe_cache.take_stats()
+        if hits or misses:
+            self.log(f"媒体信息缓存：命中 {hits}，未命中 {misses}", "信息")
 
     def clear_list(self):
-        for item in self.tree.get_children(): self.tree.delete(item)
+        self.cancel_scan()
+        self.probe_pool.cancel()
+        self.probe_outstanding = 0
+        self.model.clear()
+        self.view_start = 0
+        self.refresh_view()
         self.output_path_var.set("")
 
     def add_files(self):
@@ -425,6 +732,13 @@ class BatchProcessorApp:
         )
         self.add_to_list(*files)
 
+    def watch_folder(self):
+        """监视模式：持续处理所选文件夹中新到达的文件，直到点击终止"""
+        if self.is_running: return
+        folder = filedialog.askdirectory(title="选择要监视的文件夹")
+        if folder:
+            self.start_process(watch_folder=folder)
+
     def add_folder(self):
         folder = filedialog.askdirectory()
         if folder:
@@ -446,38 +760,86 @@ class BatchProcessorApp:
         self.add_to_list(*paths)
 
     # --- 预设逻辑 ---
+    def read_presets(self):
+        """返回 {名称: 规范化后的预设} (流水线预设已展开为多行命令)；文件未变化时直接用缓存"""
+        try:
+            return self.preset_store.presets()
+        except (OSError, ValueError) as e:
+            self.log(f"无法读取预设文件：{e}", "错误")
+            return self.presets
+
     def save_preset(self):
         name = self.preset_name_entry.get().strip()
         cmd = self.cmd_text.get("1.0", END).strip()
         if not name or not cmd: return
-        presets = {}
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f: presets = json.load(f)
-        presets[name] = cmd
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f: json.dump(presets, f, indent=4, ensure_ascii=False)
+        try:
+            preset = normalize_preset(self.preset_store.raw(name) or {}, self.presets)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"无法读取预设文件：{e}")
+            return
+        if preset["cmd"] != cmd:
+            preset["resource"] = guess_resource(cmd)
+            # 修改过的流水线改存为多行命令
+            preset.pop("steps", None)
+        if "steps" in preset:
+            del preset["cmd"]
+        else:
+            preset["cmd"] = cmd
+        for key in ("max_jobs", "scratch_dir", "encoding", "split", "retry"):
+            if not preset[key]:
+                del preset[key]
+        try:
+            self.preset_store.save(name, preset)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"预设 '{name}' 未保存：{e}")
+            return
         self.load_presets()
         messagebox.showinfo("成功", f"预设 '{name}' 已保存")
 
     def load_presets(self):
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    presets = json.load(f)
-                    self.preset_combo['values'] = list(presets.keys())
-            except: pass
+        self.presets = self.read_presets()
+        self.preset_combo['values'] = list(self.presets.keys())
+        for name, problems in self.preset_store.errors.items():
+            self.log(f"预设 {name} 无效，已忽略：{'；'.join(problems)}", "错误")
 
     def on_preset_change(self, event):
         name = self.preset_combo.get()
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            presets = json.load(f)
-            self.cmd_text.delete("1.0", END)
-            self.cmd_text.insert(END, presets.get(name, ""))
+        self.presets = self.read_presets()
+        preset = self.presets.get(name, normalize_preset(""))
+        self.cmd_text.delete("1.0", END)
+        self.cmd_text.insert(END, preset["cmd"])
+        limit = preset["max_jobs"] or class_limits_from(self.presets).get(preset["resource"])
+        self.resource_lbl.configure(text=f"资源: {preset['resource'].upper()}" + (f" ×{limit}" if limit else ""))
+
+    def current_preset_name(self, cmd_tpl):
+        """命令框内容与所选预设一致时返回预设名称，否则返回 None"""
+        name = self.preset_combo.get()
+        preset = self.presets.get(name)
+        return name if preset and preset["cmd"] == cmd_tpl else None
+
+    def preset_option(self, cmd_tpl, key):
+        """当前预设声明的选项，如中间文件目录、输出编码 (命令被手工修改过时不使用)"""
+        name = self.current_preset_name(cmd_tpl)
+        return self.presets[name][key] if name else None
+
+    def job_resource(self, cmd_tpl):
+        """确定本次批处理命令所属的资源类别及其并发上限"""
+        preset = self.presets.get(self.preset_combo.get())
+        if preset and preset["cmd"] == cmd_tpl:
+            cls = preset["resource"]
+        else:
+            cls = guess_resource(cmd_tpl)
+            preset = None
+        limits = class_limits_from(self.presets)
+        if preset and preset["max_jobs"]:
+            limits[cls] = int(preset["max_jobs"])
+        return cls, limits
 
     def edit_preset(self):
-        if os.path.exists(CONFIG_FILE):
+        path = self.preset_store.ensure_file()
+        if os.path.exists(path):
             try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    subprocess.Popen(['notepad.exe', CONFIG_FILE])
+                subprocess.Popen(['notepad.exe', path])
             except:
                 messagebox.showwarning("警告", "无法打开配置文件")
 
@@ -485,140 +847,139 @@ class BatchProcessorApp:
             messagebox.showwarning("警告", "配置文件尚不存在")
 
     # --- 执行引擎 ---
-    def start_process(self):
-        items = self.tree.get_children()
-        if not items or self.is_running: return
-        cmd_tpl = self.cmd_text.get("1.0", END).strip()
-        if "{input}" not in cmd_tpl or "{output}" not in cmd_tpl:
-            messagebox.showwarning("警告", "命令模版必须包含 {input} 和 {output}")
-            return
-        
+    def start_process(self, journal=None, watch_folder=None, settings=None):
+        """settings 为空时按界面当前的选项创建；续跑时传入日志中保存的原设置"""
+        if self.is_running or not (len(self.model) or watch_folder): return
+        if settings is None:
+            cmd_tpl = self.cmd_text.get("1.0", END).strip()
+            if "{input}" not in cmd_tpl or "{output}" not in cmd_tpl:
+                messagebox.showwarning("警告", "命令模版必须包含 {input} 和 {output}")
+                return
+            settings = self.settings_from_ui(cmd_tpl)
+        watcher = None
+        if watch_folder:
+            # 监视模式不处理列表中的文件，文件夹里已有和新到达的文件都由监视器送入
+            excludes, max_depth = self.scan_options()
+            watcher = FolderWatcher(watch_folder, self.recursive_var.get(), excludes=excludes, max_depth=max_depth)
+            files_list = []
+        else:
+            files_list = self.model.paths()
+        # 获取输出目录，并清空log文件
+        self.output_path_var.set(settings.resolve_output_dir(files_list or [os.path.join(watch_folder, "")]))
+        self.save_log("批处理任务开始", first_time=True)
+        self.progress.configure(value=0)
+        self.status_lbl.configure(text=f"开始执行: 0/{len(files_list)}")
+
+        remote = None
+        if self.remote_var.get():
+            remote = self.ensure_job_server()
+            if remote is None:
+                return
+        self.runner = BatchRunner(settings, self.prober, log=self.log, status=self.update_status,
+                                  job_log_writer=self.job_log_writer, remote=remote, manifest=self.manifest)
         self.is_running = True
         self.start_btn.configure(text="⏹️ 终止任务", command=self.stop_process, bootstyle="danger", width=12)
-        threading.Thread(target=self.run_worker, args=(cmd_tpl,), daemon=True).start()
-
-    def run_worker(self, cmd_tpl):
-        files_list = [self.tree.item(item)['values'][-1] for item in self.tree.get_children()]   
-        if not files_list:return
-
-        # 获取输出目录
-        output_dir = self.output_path_var.get()
-        if not output_dir:
-            output_dir = os.path.dirname(files_list[0])
-            self.output_path_var.set(output_dir)
-
-        # 清空log文件
-        self.save_log("批处理任务开始",first_time=True)
-        self.root.after(0, self.log, f"启动命令：\n {cmd_tpl}", "信息")
-        self.root.after(0, self.log, "-------------------------------------", "信息")
-        
-        files_total = len(files_list)
-        processed_count = 0
-        failed_count = 0
-        skip_count = 0
-        total_processing_time = timedelta(0)
-
-        # 恢复进度条及状态栏
-        self.root.after(0, lambda: self.progress.configure(value=0))
-        self.root.after(0, lambda: self.status_lbl.configure(text=f"开始执行: 1/{files_total}"))
-
-        for i, in_path in enumerate(files_list):
-            if not self.is_running: break
-            
-            fname = os.path.basename(in_path)
-            name_only, ext = os.path.splitext(fname)
-            out_fname = self.naming_rule_var.get().replace("{name}", name_only).replace("{ext}", ext)
-
-            if self.use_own_dir:
-                out_dir = os.path.dirname(in_path)
-                
-            full_out = os.path.join(out_dir, out_fname)
-
-            if os.path.exists(full_out) and self.overwrite_var.get() == "skip":
-                self.root.after(0, self.log, f"跳过已存在文件: {fname}", "信息")
-                skip_count += 1
-                self.update_status(i + 1, files_total)
-                continue
-
-            final_cmd = cmd_tpl.replace("{input}", f'"{in_path}"').replace("{output}", f'"{full_out}"')
-
-            # 1. 记录开始时间
-            start_time = datetime.now()
-            self.root.after(0, self.log, f"第{i+1}/{files_total}个任务启动: 【{fname}】at {start_time.strftime('%Y-%m-%d %H:%M:%S')}", "信息")
+        if self.metrics_var.get():
+            self.ensure_metrics_server()
+        self.slot_tree.grid(row=2, column=0, columnspan=2, sticky=EW, pady=(5, 0))
+        if self.slot_panel_after is None:
+            self.slot_panel_after = self.root.after(SLOT_PANEL_MS, self.refresh_slots)
+        entries = [] if watcher else self.model.entries
+        threading.Thread(target=self.run_worker, args=(
+            files_list, [e.duration for e in entries], [e.size for e in entries],
+            [(e.info or ("",) * 6)[2::2] for e in entries], journal, watcher,
+        ), daemon=True).start()
+
+    def settings_from_ui(self, cmd_tpl):
+        """按界面当前的选项创建本次批处理的设置"""
+        try:
+            slots = max(1, int(self.concurrency_var.get()))
+        except Exception:
+            slots = os.cpu_count() or 1
+            self.concurrency_var.set(slots)
+        try:
+            min_free, max_write = max(0.0, self.min_free_var.get()), max(0.0, self.max_write_var.get())
+        except Exception:
+            min_free, max_write = DISK_MIN_FREE / 1024 ** 3, 0.0
+            self.min_free_var.set(min_free)
+            self.max_write_var.set(max_write)
+
+        resource, class_limits = self.job_resource(cmd_tpl)
+        return BatchSettings(
+            cmd_tpl, output_dir=self.output_path_var.get(), use_own_dir=self.use_own_dir,
+            naming_rule=self.naming_rule_var.get(), overwrite=self.overwrite_var.get(), slots=slots,
+            resource=resource, class_limits=class_limits, job_log=self.job_log_var.get(),
+            order=next((k for k, v in QUEUE_ORDERS.items() if v == self.queue_order_var.get()), "list"),
+            hash_sample=self.hash_sample_var.get(), scratch_dir=self.preset_option(cmd_tpl, "scratch_dir"),
+            preset=self.current_preset_name(cmd_tpl), perf_report=self.perf_report_var.get(),
+            auto_slots=self.auto_slots_var.get(), encoding=self.preset_option(cmd_tpl, "encoding"),
+            split=self.preset_option(cmd_tpl, "split"),
+            min_free=min_free * 1024 ** 3, max_write=max_write * 1024 ** 2,
+            retry=self.preset_option(cmd_tpl, "retry"), rerun_failed=self.rerun_failed_var.get(),
+        )
 
-            try:
-                self.current_process = subprocess.Popen(
-                    final_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                    text=True, encoding='gbk', errors='replace'
-                )
-                
-                for line in iter(self.current_process.stdout.readline, ''):
-                    if not self.is_running: break
-                    if line.strip():
-                        lvl = "错误" if "Error" in line or "Failed" in line else "命令"
-                        self.root.after(0, self.log, f" {line.strip()}", lvl)
-                
-                self.current_process.wait()
-                if not self.is_running: break
-                
-                if self.current_process.returncode == 0:
-                    self.root.after(0, self.log, f"第{i+1}个任务成功输出：【{full_out}】", "信息")
-                    processed_count += 1
-                else:
-                    self.root.after(0, self.log, f"第{i+1}个任务处理失败: 【{fname}】", "错误")
-                    failed_count += 1
-            except Exception as e:
-                self.root.after(0, self.log, f"第{i+1}个任务系统错误: {str(e)}", "错误")
-                failed_count += 1
-            
-            # 2. 记录结束时间
-            end_time = datetime.now()
-            self.root.after(0, self.log, f"第{i+1}/{files_total}个任务结束 at {end_time.strftime('%Y-%m-%d %H:%M:%S')}", "信息")
-    
-    
-            # 3. 计算时间差
-            duration = end_time - start_time
-            total_processing_time += duration
-            
-            # 4. 格式化输出
-            # duration 是一个 timedelta 对象
-            total_seconds = int(duration.total_seconds())
-            hours, remainder = divmod(total_seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            self.root.after(0, self.log, f"第{i+1}个任务耗时：{hours} 小时 {minutes} 分钟 {seconds} 秒", "信息")
-            self.root.after(0, self.log, "-------------------------------------", "信息")
-            self.update_status(i + 1, files_total)
-
-        if self.is_running:
-            self.root.after(0, self.log, "", "结果")
-            self.root.after(0, self.log, "✨ 所有批处理任务已顺利结束", "结果")
-
-        # 显示处理结果
-        # duration 是一个 timedelta 对象
-        total_seconds = int(total_processing_time.total_seconds())
-        hours, remainder = divmod(total_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-
-        self.root.after(0, self.log, "========= 处理总结 =========", "结果")
-        self.root.after(0, self.log, f"文件总数：{files_total}", "结果")
-        self.root.after(0, self.log, f"成功完成：{processed_count}", "结果")
-        self.root.after(0, self.log, f"  已跳过：{skip_count}", "结果")
-        self.root.after(0, self.log, f"处理失败：{failed_count}", "结果")
-        self.root.after(0, self.log, f"共计耗时：{hours} 小时 {minutes} 分钟 {seconds} 秒", "结果")
-        self.root.after(0, self.log, "==========================", "结果")
-        
-        # 任务完成后关机
-        if self.shutdown_var.get() and self.is_running: 
-            os.system("shutdown /s /t 60")
-        
-        self.is_running = False
-        self.current_process = None
-        self.start_btn.configure(text="💪 开始批处理", command=self.start_process, bootstyle="success", width=12)
+    def resume_last_batch(self):
+        """续跑上次未完成的批处理：恢复其设置，只重新排队待处理和中断的任务"""
+        if self.is_running: return
+        try:
+            journal = BatchJournal.load_last()
+        except Exception as e:
+            messagebox.showwarning("警告", f"无法读取上次的批处理日志：{e}")
+            return
+        remaining = journal.remaining() if journal else []
+        if not remaining:
+            messagebox.showinfo("提示", "没有需要续跑的批处理任务")
+            return
+        if not messagebox.askyesno("确认", f"上次批处理还有 {len(remaining)} 个任务未完成，是否续跑？"):
+            return
 
-    def update_status(self, current, files_total):
-        pct = (current / files_total) * 100
+        removed = journal.discard_partials()
+        settings = BatchSettings.from_dict(journal.header)
+        self.clear_list()
+        self.cmd_text.delete("1.0", END)
+        self.cmd_text.insert(END, settings.cmd)
+        self.output_path_var.set(settings.output_dir)
+        self.use_own_dir = settings.use_own_dir
+        self.naming_rule_var.set(settings.naming_rule)
+        self.overwrite_var.set(settings.overwrite)
+        self.hash_sample_var.set(settings.hash_sample)
+        self.concurrency_var.set(settings.slots)
+        self.auto_slots_var.set(settings.auto_slots)
+        self.rerun_failed_var.set(settings.rerun_failed)
+        # 续跑的文件清单是确定的，直接同步插入，无需后台扫描
+        self.insert_files((p, None) for p in remaining if os.path.isfile(p))
+        self.log(f"续跑批处理 {journal.header['batch']}：剩余 {len(remaining)} 个任务，已清理 {removed} 个未完成的输出", "信息")
+        # 直接沿用日志中的完整设置 (并发数、资源上限、分段、重试、编码、中间文件目录等)，不再从界面重新生成
+        self.start_process(journal=journal, settings=settings)
+
+    def run_worker(self, files_list, durations=None, sizes=None, codecs=None, journal=None, watcher=None):
+        """后台线程：执行整批任务 (或持续监视文件夹)，结束后 (包括出错时) 恢复界面状态"""
+        try:
+            self.runner.run(files_list, durations, sizes, codecs, journal, watcher)
+            self.log_writer.flush()
+
+            # 任务完成后关机
+            if self.shutdown_var.get() and self.is_running: 
+                os.system("shutdown /s /t 60")
+        except Exception as e:
+            self.log(f"批处理异常终止：{e}", "错误")
+            self.runner.stop()
+        finally:
+            self.runner.scheduler = None
+            self.is_running = False
+            self.root.after(0, lambda: self.start_btn.configure(text="💪 开始批处理", command=self.start_process, bootstyle="success", width=12))
+
+    def update_status(self, current, files_total, fraction=None, eta=None):
+        """fraction 为按媒体时长加权的完成比例，未提供时按文件个数计算"""
+        if fraction is None:
+            # 监视模式开始时还没有任务
+            fraction = current / files_total if files_total else 0.0
+        pct = fraction * 100
+        text = f"总进度: {current}/{files_total} ({pct:.1f}%)"
+        if eta is not None and current < files_total:
+            text += f" 剩余 {format_seconds(eta)}"
         self.root.after(0, lambda: self.progress.configure(value=pct))
-        self.root.after(0, lambda: self.status_lbl.configure(text=f"总进度: {current}/{files_total} ({pct:.1f}%)"))
+        self.root.after(0, lambda: self.status_lbl.configure(text=text))
 
 if __name__ == "__main__":
     root = TkinterDnD.Tk()
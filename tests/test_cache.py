@@ -0,0 +1,67 @@
+import os
+from types import SimpleNamespace
+
+import batch_core
+from batch_core import BuildManifest, ProbeCache
+
+
+def stat(size=1, mtime_ns=1):
+    return SimpleNamespace(st_size=size, st_mtime_ns=mtime_ns)
+
+
+def test_probe_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr(batch_core.time, "time", lambda: float(next(clock)))
+    cache = ProbeCache(str(tmp_path / "probe.sqlite"), max_entries=10)
+    for k in range(10):
+        cache.put(f"p{k}", stat(), {"k": k})
+    assert cache.get("p0", stat()) == {"k": 0}
+
+    # 超出上限后淘汰到 90%：最久未用的 p1、p2 被淘汰，刚读过的 p0 保留
+    cache.put("p10", stat(), {"k": 10})
+    assert cache.get("p0", stat()) == {"k": 0}
+    assert cache.get("p1", stat()) is None
+    assert cache.get("p2", stat()) is None
+    assert cache.get("p3", stat()) == {"k": 3}
+    assert cache.get("p10", stat()) == {"k": 10}
+    # 文件大小或修改时间变化视为未命中
+    assert cache.get("p3", stat(size=2)) is None
+    assert cache.get("p3", stat(mtime_ns=2)) is None
+    assert cache.take_stats() == (4, 4)
+
+
+def test_probe_cache_reprobe_does_not_evict(tmp_path):
+    cache = ProbeCache(str(tmp_path / "probe.sqlite"), max_entries=10)
+    for k in range(10):
+        cache.put(f"p{k}", stat(), {"k": k})
+    # 同一文件反复重新探测只更新原记录，不应被当成新增而触发淘汰
+    for mtime_ns in range(2, 50):
+        cache.put("p9", stat(mtime_ns=mtime_ns), {"k": mtime_ns})
+    assert cache._count == 10
+    assert all(cache.get(f"p{k}", stat()) == {"k": k} for k in range(9))
+    assert cache.get("p9", stat(mtime_ns=49)) == {"k": 49}
+    cache.flush()
+    assert ProbeCache(str(tmp_path / "probe.sqlite"), max_entries=10)._count == 10
+
+
+def test_build_manifest_skip_rules(tmp_path):
+    manifest = BuildManifest(str(tmp_path / "manifest.sqlite"))
+    out = str(tmp_path / "a_done.mp4")
+    with open(out, "wb") as f:
+        f.write(b"out")
+    manifest.record(out, str(tmp_path / "a.mp4"), "fp", "cmd", "tool 1")
+
+    assert manifest.is_current(out, "fp", "cmd", "tool 1")
+    assert not manifest.is_current(out, "fp2", "cmd", "tool 1")
+    assert not manifest.is_current(out, "fp", "cmd -y", "tool 1")
+    assert not manifest.is_current(out, "fp", "cmd", "tool 2")
+    assert not manifest.is_current(str(tmp_path / "other.mp4"), "fp", "cmd", "tool 1")
+
+    # 输出被改动或删除后不再跳过
+    with open(out, "ab") as f:
+        f.write(b"!")
+    assert not manifest.is_current(out, "fp", "cmd", "tool 1")
+    manifest.record(out, str(tmp_path / "a.mp4"), "fp", "cmd", "tool 1")
+    assert manifest.is_current(out, "fp", "cmd", "tool 1")
+    os.remove(out)
+    assert not manifest.is_current(out, "fp", "cmd", "tool 1")
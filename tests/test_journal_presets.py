@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+import pytest
+
+from batch_core import BatchJournal, PresetStore, parse_presets, validate_preset
+
+
+def test_journal_replay_ignores_torn_line(tmp_path):
+    journal = BatchJournal.create({"cmd": "x"}, ["a", "b", "c"], journal_dir=str(tmp_path))
+    journal.mark("a", "done", output="a_out")
+    journal.mark("b", "running", partial="b.partial")
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"state": "done", "inp')     # 崩溃时写了一半
+
+    loaded = BatchJournal.load(journal.path)
+    assert loaded.header["cmd"] == "x"
+    assert loaded.states["a"]["state"] == "done"
+    assert loaded.states["b"]["state"] == "running"
+    assert loaded.remaining() == ["b", "c"]
+    assert not loaded.complete
+    assert BatchJournal.load_last(str(tmp_path)).path == journal.path
+
+
+def test_journal_complete(tmp_path):
+    journal = BatchJournal.create({"cmd": "x"}, ["a"], journal_dir=str(tmp_path))
+    journal.mark("a", "done")
+    journal.close(complete=True)
+    loaded = BatchJournal.load(journal.path)
+    assert loaded.complete and loaded.remaining() == []
+
+
+def test_parse_presets_formats():
+    errors = {}
+    presets = parse_presets({
+        "plain": "ffmpeg -i {input} {output}",
+        "dict": {"cmd": "ffmpeg -i {input} -c:v h264_nvenc {output}", "max_jobs": 1},
+        "pipe": {"steps": ["plain", "| sox {input} {output}"]},
+        "bad": 5,
+    }, errors)
+    assert list(presets) == ["plain", "dict", "pipe"]
+    assert errors == {"bad": ["应为命令字符串或对象"]}
+    assert presets["dict"]["resource"] == "gpu"
+    assert presets["pipe"]["cmd"] == "ffmpeg -i {input} {output}\n| sox {input} {output}"
+    assert all(not validate_preset(p) for p in presets.values())
+
+
+def test_validate_preset():
+    preset = parse_presets({"x": {"cmd": "echo {input}", "resource": "tpu"}})["x"]
+    problems = validate_preset(preset)
+    assert any("{output}" in p for p in problems)
+    assert any("tpu" in p for p in problems)
+
+
+def test_preset_store_round_trip(tmp_path):
+    path = tmp_path / "cfg" / "cmd_presets.json"
+    seed = tmp_path / "seed.json"
+    seed.write_text(json.dumps({"a": "ffmpeg -i {input} {output}", "broken": "echo {input}"}), encoding="utf-8")
+    store = PresetStore(str(path), (str(seed),))
+    assert list(store.presets()) == ["a"]
+    assert "broken" in store.errors
+    assert path.exists()
+
+    store.save("b", {"cmd": "sox {input} {output}", "resource": "cpu"})
+    assert store.get("b")["cmd"] == "sox {input} {output}"
+    assert [f for f in os.listdir(path.parent)] == ["cmd_presets.json"]
+    with pytest.raises(ValueError):
+        store.save("c", {"cmd": "sox {input}"})
+    assert "c" not in json.loads(path.read_text(encoding="utf-8"))
+
+    # 外部修改后自动重新载入
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    raw["d"] = "cp {input} {output}"
+    time.sleep(0.01)
+    path.write_text(json.dumps(raw), encoding="utf-8")
+    assert "d" in store.presets()
+    assert set(PresetStore(str(path), ()).presets()) == {"a", "b", "d"}
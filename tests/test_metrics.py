@@ -0,0 +1,38 @@
+from batch_metrics import prometheus_text
+
+
+def test_prometheus_text():
+    text = prometheus_text({
+        "running": True, "files_total": 3, "eta": None, "progress": 0.5,
+        "processed": 2, "failed": 1, "retried": 1,
+        "totals": {"processed": 7, "failed": 1, "skipped": 2, "retried": 3},
+        "slots": [{"slot": 1, "file": 'a "b".mp4', "percent": 50.0, "fps": None}],
+        "hosts": [{"host": "render-1", "jobs_per_minute": 1.5, "running": 2}],
+    })
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "batch_running 1" in lines
+    assert "batch_files_total 3" in lines
+    assert "batch_progress_ratio 0.5" in lines
+    # 值未知的指标不输出
+    assert "batch_eta_seconds" not in text
+    assert "batch_slot_fps" not in text
+
+    assert 'batch_jobs_finished{result="processed"} 2' in lines
+    assert 'batch_jobs_finished{result="skipped"} 0' in lines
+    assert "# TYPE batch_jobs_finished gauge" in lines
+    assert "# TYPE batch_jobs_total counter" in lines
+    assert 'batch_jobs_total{result="processed"} 7' in lines
+    assert "batch_retries 1" in lines
+    assert "batch_retries_total 3" in lines
+
+    assert 'batch_slot_progress_percent{slot="1",file="a \\"b\\".mp4"} 50' in lines
+    assert 'batch_host_jobs_per_minute{host="render-1"} 1.5' in lines
+    assert 'batch_host_running{host="render-1"} 2' in lines
+
+
+def test_prometheus_text_idle():
+    text = prometheus_text({"running": False})
+    assert "batch_running 0" in text.splitlines()
+    assert 'batch_jobs_total{result="failed"} 0' in text
+    assert "batch_slot_" not in text and "batch_host_" not in text
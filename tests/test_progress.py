@@ -0,0 +1,59 @@
+from batch_core import FfmpegProgress, order_jobs
+
+
+def test_stats_line():
+    p = FfmpegProgress(duration=120.0)
+    line = "frame= 1437 fps= 95 q=28.0 size=   10240kB time=00:00:59.94 bitrate=1399.5kbits/s speed=3.98x    "
+    assert p.feed(line)
+    assert p.out_time == 59.94
+    assert p.fps == 95.0
+    assert p.speed == 3.98
+    assert round(p.percent(), 2) == 49.95
+    assert round(p.eta(), 2) == round((120.0 - 59.94) / 3.98, 2)
+
+
+def test_stats_line_with_na_values():
+    p = FfmpegProgress()
+    assert p.feed("size=N/A time=00:01:02.50 bitrate=N/A speed=N/A")
+    assert p.out_time == 62.5
+    assert p.speed is None
+    assert p.percent() is None
+    assert p.eta() is None
+
+
+def test_progress_pipe_output():
+    p = FfmpegProgress(duration=10.0)
+    assert not p.feed("fps=24.00")
+    assert not p.feed("speed=2.5x")
+    assert p.feed("out_time_us=5000000")
+    assert p.feed("out_time_ms=6000000")   # 实际单位也是微秒
+    assert p.out_time == 6.0
+    assert p.fps == 24.0 and p.speed == 2.5
+    assert p.percent() == 60.0
+
+
+def test_non_progress_lines():
+    p = FfmpegProgress()
+    for line in ("Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'a.mp4':",
+                 "  Duration: 00:10:00.00, start: 0.000000, bitrate: 1200 kb/s",
+                 "Stream mapping:", "out_time_us=N/A"):
+        assert not p.feed(line)
+    assert p.out_time == 0.0
+
+
+def test_long_time_over_24_hours():
+    p = FfmpegProgress()
+    assert p.feed("frame=1 fps=1 time=25:00:00.00 speed=1x")
+    assert p.out_time == 90000.0
+
+
+def test_order_jobs():
+    keys = [0, 1, 2, 3]
+    durations = [30.0, None, 90.0, 30.0]
+    sizes = [100, 500, 10, 200]
+    assert order_jobs(keys, "list", durations, sizes) == keys
+    assert order_jobs(keys, "lpt", durations, sizes) == [2, 3, 0, 1]
+    # 时长未知的排在最后，同时长按大小
+    assert order_jobs(keys, "sjf", durations, sizes) == [0, 3, 2, 1]
+    codecs = [("h264",), ("hevc",), ("h264",), ("hevc",)]
+    assert order_jobs(keys, "codec", durations, sizes, codecs) == [2, 0, 3, 1]
@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from batch_remote import Agent, JobServer
+
+
+@pytest.fixture
+def server():
+    server = JobServer(host="127.0.0.1", port=0, token="secret", lease_seconds=0.2)
+    yield server
+    server.close()
+
+
+def submit(server, command="echo hi"):
+    """在后台线程中提交命令，返回 (线程, 结果字典, 收到的输出行)"""
+    result = {}
+    lines = []
+
+    def run():
+        result["returncode"] = server.run_command(command, lines.append)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not server.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return thread, result, lines
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_expired_lease_is_requeued_and_stale_reports_rejected(server):
+    thread, result, lines = submit(server)
+    first = server.lease("a")
+    assert first["command"] == "echo hi"
+    assert server.lease("b") is None
+
+    # a 不再续约，租约过期后任务重新排队
+    wait_for(lambda: server.pending)
+    server.lease_seconds = 30
+    second = server.lease("b")
+    assert second["job_id"] == first["job_id"]
+    assert second["lease"] != first["lease"]
+
+    # 过期租约的回报一律忽略，并要求 a 终止
+    stale = {"job_id": first["job_id"], "lease": first["lease"], "host": "a"}
+    assert server.progress(dict(stale, lines=["late"])) == {"cancel": True}
+    assert server.complete(dict(stale, returncode=1)) == {"accepted": False}
+    assert thread.is_alive()
+
+    current = {"job_id": second["job_id"], "lease": second["lease"], "host": "b"}
+    assert server.progress(dict(current, lines=["working"])) == {"cancel": False}
+    assert server.complete(dict(current, returncode=0, seconds=1.0, lines=["done"])) == {"accepted": True}
+    thread.join(5)
+    assert result["returncode"] == 0
+    assert lines == ["working", "done"]
+    stats = {h["host"]: h for h in server.host_stats()}
+    assert stats["b"]["completed"] == 1 and stats["b"]["running"] == 0
+    assert stats["a"]["running"] == 0
+
+
+def request(server, path, token, payload=None):
+    url = "http://127.0.0.1:%d%s" % (server.address[1], path)
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"X-Batch-Token": token})
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return resp.status
+
+
+def test_requests_need_the_token(server):
+    for token in ("", "wrong"):
+        with pytest.raises(urllib.error.HTTPError) as info:
+            request(server, "/lease", token, {"host": "x"})
+        assert info.value.code == 403
+        with pytest.raises(urllib.error.HTTPError) as info:
+            request(server, "/stats", token)
+        assert info.value.code == 403
+    assert request(server, "/lease", "secret", {"host": "x"}) == 204
+    assert request(server, "/stats", "secret") == 200
+
+
+def test_non_loopback_server_requires_token():
+    with pytest.raises(ValueError):
+        JobServer(host="0.0.0.0", port=0)
+
+
+def test_agent_requires_token_for_remote_server():
+    with pytest.raises(ValueError):
+        Agent("http://192.168.1.10:8765")
+    assert Agent("http://192.168.1.10:8765", token="secret").token == "secret"
+    assert Agent("http://127.0.0.1:8765/").server_url == "http://127.0.0.1:8765"
+    assert Agent("http://[::1]:8765").server_url == "http://[::1]:8765"
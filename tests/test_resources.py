@@ -0,0 +1,92 @@
+import shutil
+import threading
+
+from batch_core import AdaptiveConcurrency, BatchRunner, BatchSettings, DiskGuard, SplitJob
+
+
+def acquire(guard, key, out_path, need, is_running=lambda: True, waits=None):
+    on_wait = (lambda need, available: waits.append(available)) if waits is not None else (lambda *a: None)
+    return guard.acquire(key, out_path, need, lambda: 0.0, is_running, on_wait)
+
+
+def test_disk_guard_fits_and_never_fits(tmp_path):
+    out = str(tmp_path / "out.mp4")
+    free = shutil.disk_usage(str(tmp_path)).free
+    guard = DiskGuard(min_free=0)
+    assert acquire(guard, "a", out, 1) is True
+    guard.release("a")
+    assert guard.active == {}
+
+    # 没有运行中的任务时空间不会再释放出来，直接返回 None 而不是一直等待
+    waits = []
+    guard = DiskGuard(min_free=free * 10)
+    assert acquire(guard, "a", out, 1, waits=waits) is None
+    assert waits == []
+    assert acquire(guard, "a", out, 1, is_running=lambda: False) is False
+
+
+def test_disk_guard_waits_for_running_job(tmp_path):
+    out = str(tmp_path / "out.mp4")
+    free = shutil.disk_usage(str(tmp_path)).free
+    guard = DiskGuard(min_free=free // 4)
+    assert acquire(guard, "a", out, free // 2) is True
+
+    # a 预计还要写入一半的剩余空间，b 需要等 a 结束
+    waits = []
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(b=acquire(guard, "b", out, free // 2, waits=waits)))
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive()
+    assert len(waits) == 1
+    guard.release("a", in_size=100, out_size=50)
+    thread.join(5)
+    assert result["b"] is True
+    assert list(guard.active) == ["b"]
+    assert guard.ratio() == 0.5
+
+
+SAMPLE = {"cpu": 0.5, "iowait": 0.05, "load": 0.5, "mem_free": 0.5, "mem_pressure": None}
+
+
+def test_adaptive_concurrency_decisions():
+    adaptive = AdaptiveConcurrency(None, None, None, load=object())
+
+    def decide(queued=3, **changes):
+        return adaptive.decide(dict(SAMPLE, **changes), 4, queued)
+
+    assert decide() == (5, "CPU 与磁盘仍有余量")
+    assert decide(queued=0) == (4, None)
+    assert decide(cpu=0.9) == (4, None)
+    assert decide(iowait=0.2) == (4, None)
+    assert decide(mem_free=0.05)[0] == 3
+    assert decide(mem_pressure=20.0)[0] == 3
+    assert decide(mem_pressure=5.0)[0] == 5
+    assert decide(iowait=0.4)[0] == 3
+    assert decide(load=2.0, cpu=0.9)[0] == 3
+    # 运行队列长但 CPU 空闲 (多为等待 I/O)，不算过载
+    assert decide(load=2.0, cpu=0.5)[0] == 5
+
+
+def test_split_count_needs_long_enough_media():
+    runner = BatchRunner(BatchSettings("ffmpeg -i {input} {output}", split=4), journal_dir=None)
+    assert runner.split_count(3600) == 4
+    assert runner.split_count(300) == 2
+    assert runner.split_count(200) == 0
+    assert runner.split_count(None) == 0
+    runner.remote = object()
+    assert runner.split_count(3600) == 0
+    assert BatchRunner(BatchSettings("x", split=0), journal_dir=None).split_count(3600) == 0
+
+
+def test_split_join_duration_check():
+    def split(duration):
+        return SplitJob(0, "in.mp4", "out.mp4", "out.partial.mp4", None, duration, None, "")
+
+    # 误差取 1 秒与 0.5% 中较大者
+    assert split(600.0).duration_matches(602.9)
+    assert split(600.0).duration_matches(597.1)
+    assert not split(600.0).duration_matches(603.5)
+    assert split(100.0).duration_matches(100.9)
+    assert not split(100.0).duration_matches(101.5)
+    assert not split(100.0).duration_matches(None)
@@ -0,0 +1,35 @@
+import os
+
+from batch_core import partial_name, scan_paths
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x")
+
+
+def test_scan_skips_partial_outputs_and_split_folders(tmp_path):
+    top = str(tmp_path)
+    source = os.path.join(top, "a.mp4")
+    out = os.path.join(top, "a_done.mp4")
+    partial = partial_name(out)
+    touch(source)
+    touch(partial)
+    touch(os.path.join(partial + ".split", "seg000.mp4"))
+    touch(os.path.join(top, "sub", "b.mkv"))
+
+    found = sorted(scan_paths([top], recursive=True))
+    assert found == [source, os.path.join(top, "sub", "b.mkv")]
+    # 直接选中的临时输出同样不作为输入
+    assert list(scan_paths([partial])) == []
+
+
+def test_scan_excludes_and_depth(tmp_path):
+    top = str(tmp_path)
+    touch(os.path.join(top, "a.mp4"))
+    touch(os.path.join(top, "skip", "b.mp4"))
+    touch(os.path.join(top, "deep", "deeper", "c.mp4"))
+
+    found = sorted(scan_paths([top], recursive=True, excludes=("skip",), max_depth=1))
+    assert found == [os.path.join(top, "a.mp4")]
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from batch_core import JobScheduler, RetryPolicy
+
+
+def run_scheduler(jobs, slots, class_limits, resource_of, hold=0.05):
+    """执行全部任务，返回各类别观察到的最大同时运行数与执行过的任务"""
+    lock = threading.Lock()
+    running = {}
+    peak = {}
+    done = []
+
+    def handler(job, slot):
+        cls = resource_of(job)
+        with lock:
+            running[cls] = running.get(cls, 0) + 1
+            peak[cls] = max(peak.get(cls, 0), running[cls])
+        time.sleep(hold)
+        with lock:
+            running[cls] -= 1
+            done.append(job)
+
+    JobScheduler(slots, handler, class_limits, resource_of).run(jobs)
+    return peak, done
+
+
+def test_class_limit_is_respected():
+    jobs = [("gpu", k) for k in range(6)] + [("cpu", k) for k in range(6)]
+    peak, done = run_scheduler(jobs, 4, {"gpu": 1}, lambda job: job[0])
+    assert sorted(done) == sorted(jobs)
+    assert peak["gpu"] == 1
+    # gpu 满时先派发后面的 cpu 任务
+    assert peak["cpu"] >= 2
+
+
+def test_slot_limit():
+    peak, done = run_scheduler(list(range(8)), 3, None, lambda job: "cpu")
+    assert len(done) == 8
+    assert peak["cpu"] <= 3
+
+
+def test_submit_from_running_job():
+    seen = []
+    scheduler = None
+
+    def handler(job, slot):
+        seen.append(job)
+        if job == "parent":
+            scheduler.submit("child", front=True)
+
+    scheduler = JobScheduler(2, handler)
+    scheduler.run(["parent"])
+    assert seen == ["parent", "child"]
+
+
+def test_submit_later_keeps_run_alive():
+    seen = []
+    scheduler = None
+
+    def handler(job, slot):
+        seen.append(job)
+        if job == "first":
+            scheduler.submit_later("retry", 0.05)
+
+    scheduler = JobScheduler(1, handler)
+    scheduler.run(["first"])
+    assert seen == ["first", "retry"]
+    assert scheduler.delayed == 0
+
+
+def test_shrink_class():
+    scheduler = JobScheduler(8, lambda job, slot: None, {"gpu": 4})
+    scheduler.active = {"gpu": 3}
+    assert scheduler.shrink_class("gpu") == (4, 2)
+    scheduler.active = {"gpu": 1}
+    assert scheduler.shrink_class("gpu") == (2, 1)
+    # 没有声明上限的类别以总并发数为起点
+    scheduler.active = {"cpu": 5}
+    assert scheduler.shrink_class("cpu") == (8, 4)
+
+
+def test_retry_classify():
+    policy = RetryPolicy()
+    assert policy.classify(["[h264_nvenc @ 0x1] OpenEncodeSessionEx failed: out of memory (10)"]) == "resource"
+    assert policy.classify(["av_interleaved_write_frame(): No space left on device"]) == "resource"
+    assert policy.classify(["Error reading header: Connection reset by peer"]) == "transient"
+    assert policy.classify(["in.mp4: Invalid data found when processing input"]) == "permanent"
+    assert policy.classify(["something odd"], returncode=-9) == "resource"
+    assert policy.classify(["something odd"], returncode=1) == "permanent"
+
+
+def test_retry_custom_patterns_and_delay():
+    policy = RetryPolicy.from_dict({"attempts": 5, "backoff": 2, "max_backoff": 5,
+                                    "patterns": {"transient": ["license server busy"]}, "other": 1})
+    assert policy.attempts == 5
+    assert policy.classify(["License server BUSY, try later"]) == "transient"
+    assert [policy.delay(n) for n in (1, 2, 3, 4)] == [2.0, 4.0, 5.0, 5.0]
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from batch_core import CommandTemplate, PIPE_INPUT, PIPE_OUTPUT, compile_template, output_path_for, split_args
+
+
+def test_split_args_quotes():
+    assert split_args('ffmpeg -i "a b.mp4" -vf \'scale=1280:-2\' out.mp4') == [
+        "ffmpeg", "-i", "a b.mp4", "-vf", "scale=1280:-2", "out.mp4"]
+
+
+def test_split_args_unbalanced_quote():
+    with pytest.raises(ValueError):
+        split_args('ffmpeg -i "{input} {output}')
+
+
+def test_placeholder_is_one_argument():
+    tpl = CommandTemplate('ffmpeg -i {input} -c copy {output}')
+    assert not tpl.shell
+    cmd = tpl.render("/in/my \"clip\" 1.mp4", "/out/it's done.mp4")
+    assert cmd.steps == [(["ffmpeg", "-i", "/in/my \"clip\" 1.mp4", "-c", "copy", "/out/it's done.mp4"], False)]
+    assert cmd.groups() == [[cmd.steps[0][0]]]
+
+
+def test_name_ext_and_unknown_braces():
+    cmd = CommandTemplate("tool {input} -o {output} --label {name}{ext} {unknown}").render("/a/b.mkv", "/c/d.mkv")
+    assert cmd.steps[0][0] == ["tool", "/a/b.mkv", "-o", "/c/d.mkv", "--label", "b.mkv", "{unknown}"]
+
+
+def test_shell_fallback_on_operators():
+    tpl = CommandTemplate("ffmpeg -i {input} {output} > log.txt 2>&1")
+    assert tpl.shell
+    cmd = tpl.render("/in/a b.mp4", "/out/c.mp4")
+    assert cmd.shell
+    assert cmd.text == 'ffmpeg -i "/in/a b.mp4" "/out/c.mp4" > log.txt 2>&1'
+
+
+def test_quoted_operator_is_not_shell():
+    tpl = CommandTemplate("ffmpeg -i {input} -filter_complex \"[0:v]split=2[a][b]\" {output}")
+    assert not tpl.shell
+
+
+def test_pipeline_scratch_and_pipe_steps(tmp_path):
+    tpl = CommandTemplate("a {input} {output:.wav}\nb {input} {output}\n| c {input} {output}")
+    cmd = tpl.render("/in/x.mp4", "/out/x_done.m4a", scratch_dir=str(tmp_path))
+    (step1, p1), (step2, p2), (step3, p3) = cmd.steps
+    scratch = step1[2]
+    assert cmd.scratch_files == [scratch]
+    assert os.path.dirname(scratch) == str(tmp_path) and scratch.endswith(".step1.wav")
+    assert step2 == ["b", scratch, PIPE_OUTPUT] and not p2
+    assert step3 == ["c", PIPE_INPUT, "/out/x_done.m4a"] and p3
+    assert cmd.groups() == [[step1], [step2, step3]]
+    # 同一任务每次渲染的中间文件名一致
+    assert tpl.render("/in/x.mp4", "/out/x_done.m4a", scratch_dir=str(tmp_path)).scratch_files == [scratch]
+
+
+def test_probe_fields():
+    assert not compile_template("ffmpeg -i {input} {output}").needs_probe
+    tpl = compile_template("ffmpeg -i {input} -t {duration} {output}")
+    assert tpl.needs_probe
+    cmd = tpl.render("i.mp4", "o.mp4", media={"duration": "12.000"})
+    assert cmd.steps[0][0] == ["ffmpeg", "-i", "i.mp4", "-t", "12.000", "o.mp4"]
+
+
+def test_output_path_for():
+    assert output_path_for(os.path.join("d", "clip.mov"), "{name}_done{ext}", "out") == os.path.join("d", "clip_done.mov")
+    assert output_path_for(os.path.join("d", "clip.mov"), "{name}.mp4", "out", use_own_dir=False) == os.path.join("out", "clip.mp4")
@@ -0,0 +1,47 @@
+import os
+import time
+
+from batch_watch import FolderWatcher
+
+
+def write(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def test_file_is_emitted_once_after_it_stops_growing(tmp_path):
+    watcher = FolderWatcher(str(tmp_path), stable_seconds=0.5)
+    path = os.path.join(watcher.folder, "a.mp4")
+    write(path, b"x")
+    write(os.path.join(watcher.folder, "a_done.partial.mp4"), b"x")
+    write(os.path.join(watcher.folder, "notes.txt"), b"x")
+
+    watcher.scan(watcher.folder)
+    assert list(watcher.pending) == [path]
+    assert watcher.ready() == []
+
+    # 仍在写入：大小变化后重新计时
+    time.sleep(0.3)
+    write(path, b"more")
+    assert watcher.ready() == []
+    time.sleep(0.3)
+    assert watcher.ready() == []
+    time.sleep(0.3)
+    assert watcher.ready() == [path]
+
+    # 已产出且未变化的文件不重复产出，被替换后重新处理
+    watcher.scan(watcher.folder)
+    assert watcher.pending == {}
+    write(path, b"replaced")
+    watcher.scan(watcher.folder)
+    assert list(watcher.pending) == [path]
+
+
+def test_deleted_file_is_dropped(tmp_path):
+    watcher = FolderWatcher(str(tmp_path), stable_seconds=0)
+    path = os.path.join(watcher.folder, "a.mkv")
+    write(path, b"x")
+    watcher.scan(watcher.folder)
+    os.remove(path)
+    assert watcher.ready() == []
+    assert watcher.pending == {}